@@ -1,4 +1,9 @@
 import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional, AsyncGenerator
 from passlib.context import CryptContext
@@ -15,8 +20,17 @@ from database import users, AsyncSessionLocal
 SECRET_KEY = os.getenv("SECRET_KEY", "a_very_secret_key_that_should_be_in_env")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
+# Кэш пользователей и проверенных токенов, чтобы частые опросы не ходили в БД на каждый запрос
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+# Стоимость bcrypt: хэши со старой стоимостью прозрачно пересчитываются при входе
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt занимает ~100-300 мс CPU, поэтому выполняется в отдельном ограниченном пуле
+PASSWORD_HASH_WORKERS = max(1, int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 # --- Модели Pydantic ---
@@ -37,13 +51,126 @@ async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
         yield session
 
-# --- Функции ---
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# --- Кэши аутентификации ---
+class TTLCache:
+    """LRU-кэш с ограничением размера и временем жизни записей (только для event loop, без блокировок)."""
+
+    def __init__(self, ttl: float, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # ключ -> (значение, время истечения по monotonic)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+user_cache = TTLCache(AUTH_USER_CACHE_TTL)    # username -> UserInDB
+token_cache = TTLCache(AUTH_TOKEN_CACHE_TTL)  # токен -> username из проверенного JWT
+
+
+def invalidate_user(username: str):
+    """Вызывать после смены пароля или удаления пользователя."""
+    user_cache.pop(username)
+
+
+def auth_cache_stats() -> dict:
+    return {"users": user_cache.stats(), "tokens": token_cache.stats()}
+
+# --- Хэширование паролей вне event loop ---
+class PasswordHasherBusy(Exception):
+    pass
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
 
+class PasswordHasher:
+    """
+    Пул потоков для bcrypt (он отпускает GIL) с ограничением очереди: если задач больше,
+    чем workers + queue_limit, новые сразу отклоняются, а не копятся бесконечно.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.workers + self.queue_limit:
+                self.rejected += 1
+                raise PasswordHasherBusy("Слишком много одновременных входов, попробуйте позже.")
+            self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_seconds += time.perf_counter() - started
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> tuple:
+        """(пароль верный, новый хэш или None) - новый хэш, если изменилась стоимость bcrypt."""
+        return await self._run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+    async def hash(self, plain_password: str) -> str:
+        return await self._run(pwd_context.hash, plain_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "avg_latency_ms": round(self.total_seconds / self.completed * 1000, 1) if self.completed else 0.0,
+            }
+
+
+password_hasher = PasswordHasher()
+
+# --- Функции ---
+# Пароли хэшируются и проверяются только через password_hasher (ограниченный пул + rehash при входе)
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -51,31 +178,40 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme), 
-    db: AsyncSession = Depends(get_db_session)
-):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except JWTError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    query = select(users).where(users.c.username == token_data.username)
-    result = await db.execute(query)
-    user = result.fetchone()
+        # Проверенный токен кэшируем не дольше срока его действия
+        token_cache.put(token, token_data.username, ttl=payload["exp"] - time.time() if "exp" in payload else None)
+
+    cached_user = user_cache.get(username)
+    if cached_user is not None:
+        return cached_user
+
+    # Сессию открываем только при промахе кэша
+    async with AsyncSessionLocal() as db:
+        query = select(users).where(users.c.username == username)
+        result = await db.execute(query)
+        user = result.fetchone()
 
     if user is None:
         raise credentials_exception
-    return UserInDB(**user._asdict())
+    user = UserInDB(**user._asdict())
+    user_cache.put(username, user)
+    return user
 
 async def get_current_active_user(current_user: UserInDB = Depends(get_current_user)):
     return current_user
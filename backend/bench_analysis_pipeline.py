@@ -0,0 +1,114 @@
+# backend/bench_analysis_pipeline.py
+"""
+Офлайн-бенчмарк очереди анализов, single-flight и консенсуса на заглушке модели:
+ни биржа, ни Gemini не используются. Графики и промпт подставляются фиктивные,
+все остальное (JobQueue, SingleFlight, collect_consensus, голосование, сохранение
+сигналов через save_analysis_result во временную SQLite) - настоящее.
+
+    python bench_analysis_pipeline.py --requests 2000 --pairs 50 --concurrency 64 --latency-ms 20 --error-rate 0.05
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from collections import Counter
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+import jobs
+import logic
+import main as api
+import database
+import response_cache
+from model_governor import ModelGovernor, CircuitBreaker
+from model_backends import StubBackend, STUB_DEFAULT_RESPONSE
+
+FAKE_CHARTS = ["chart_1h.png", "chart_4h.png", "chart_1d.png"]
+
+
+async def make_signal_db(directory: str):
+    """Временная SQLite для save_analysis_result: те же таблицы и пользователь, от имени которого идут запросы."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(directory, 'bench_history.db')}")
+    async with engine.begin() as conn:
+        await conn.run_sync(database.metadata.create_all)
+        await conn.execute(database.users.insert().values(id=1, username="bench", hashed_password="x"))
+    return engine
+
+
+def make_analyzer(backend: StubBackend, consensus: dict):
+    async def analyze(pair: str, strategy_key: str) -> dict:
+        prompt = f"Стратегия {strategy_key} для {pair}"
+        results = await logic.gather_opinions(FAKE_CHARTS, prompt, backend=backend, consensus=consensus)
+        return logic.decide_signal(results, FAKE_CHARTS)
+    return analyze
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность конвейера анализа на заглушке модели")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--pairs", type=int, default=20, help="разных пар (одинаковые объединяет single-flight)")
+    parser.add_argument("--concurrency", type=int, default=32, help="воркеров очереди")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--rate-per-minute", type=float, default=1e9, help="лимит регулятора на ключ")
+    parser.add_argument("--model-concurrency", type=int, default=256, help="одновременных генераций")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="использовать кэш ответов (в отдельном временном файле)")
+    parser.add_argument("--samples", type=int, default=0,
+                        help="консенсус multi_sample: вариантов ответа в одном запросе (0 - отдельные запросы)")
+    parser.add_argument("--mixed", action="store_true", help="чередовать Long/Short/None в ответах")
+    args = parser.parse_args()
+
+    responses = [STUB_DEFAULT_RESPONSE]
+    if args.mixed:
+        responses = [dict(STUB_DEFAULT_RESPONSE, direction=d) for d in ("Long", "Short", "Long", "None", "Short")]
+    backend = StubBackend(responses, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+    # В бенчмарке ошибки заглушки не должны размыкать цепь
+    governor = logic.governor = ModelGovernor(concurrency=args.model_concurrency, rate_per_minute=args.rate_per_minute,
+                                              burst=args.model_concurrency, backoff_base=0.01,
+                                              breaker=CircuitBreaker(threshold=10 ** 9))
+    logic.console.quiet = True
+    # Постоянный кэш ответов превратил бы повторный прогон в чтение из SQLite
+    workdir = tempfile.mkdtemp()
+    cache = logic.response_cache = response_cache.ResponseCache(
+        path=os.path.join(workdir, "bench_responses.db"),
+        mode="on" if args.response_cache else "off")
+    # Сигналы сохраняются тем же обработчиком, что и в API, но во временную базу
+    engine = await make_signal_db(workdir)
+    api.AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+    # Период single-flight фиксирован: все запросы попадают в одну "свечу"
+    flight = jobs.SingleFlight(make_analyzer(backend, {"mode": "multi_sample", "samples": args.samples} if args.samples else None), lambda key: float("inf"))
+    queue = jobs.JobQueue(analyzer=flight, on_result=api.save_analysis_result,
+                          concurrency=args.concurrency, max_queue=args.requests)
+    await queue.start()
+
+    started = time.perf_counter()
+    submitted = [queue.submit(f"PAIR{i % args.pairs}/USDT", "bench", user_id=1) for i in range(args.requests)]
+    while not all(job.finished for job in submitted):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await queue.stop()
+    async with engine.connect() as conn:
+        saved = await conn.scalar(select(func.count()).select_from(database.analyses))
+    await engine.dispose()
+
+    latencies = sorted(job.finished_at - job.created_at for job in submitted)
+    outcomes = Counter(job.result["status"] if job.result else job.status for job in submitted)
+    print(f"{args.requests} запросов за {elapsed:.2f} с: {args.requests / elapsed:.0f} запросов/с")
+    print(f"задержка: p50 {statistics.median(latencies) * 1000:.0f} мс, p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f} мс")
+    print(f"исходы: {dict(outcomes)}, сохранено сигналов: {saved}")
+    print(f"вызовов модели: {backend.calls} (ошибок {backend.errors}), single-flight: {flight.stats()}")
+    print(f"регулятор: {governor.stats()}")
+    print(f"кэш ответов: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+# backend/bench_login_storm.py
+"""
+Задержка event loop во время волны входов: bcrypt прямо в обработчике
+против отдельного пула PasswordHasher. Пока идут проверки паролей, фоновая
+корутина "пингует" loop каждые 10 мс (как опрос /analyses/active) и
+записывает, насколько она опоздала.
+
+    python bench_login_storm.py --logins 50 --rounds 12
+"""
+
+import time
+import asyncio
+import argparse
+import statistics
+
+from passlib.context import CryptContext
+
+import auth
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.01) -> list:
+    lags = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - started - interval) * 1000)
+    return lags
+
+
+async def inline_login(context: CryptContext, hashed: str):
+    # Старое поведение: bcrypt выполняется в потоке event loop
+    return context.verify_and_update("password", hashed)
+
+
+async def pooled_login(hasher: auth.PasswordHasher, hashed: str):
+    try:
+        return await hasher.verify_and_update("password", hashed)
+    except auth.PasswordHasherBusy:
+        return None  # в API это ответ 429
+
+
+async def run_storm(name: str, make_login, logins: int):
+    stop = asyncio.Event()
+    probe = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    results = await asyncio.gather(*[make_login() for _ in range(logins)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    lags = await probe
+    rejected = sum(1 for r in results if r is None)
+    print(f"{name:8} | {logins} входов за {elapsed:6.2f} с | отклонено {rejected:3} | "
+          f"лаг loop: p50 {statistics.median(lags):7.1f} мс, p99 {sorted(lags)[int(len(lags) * 0.99) - 1]:7.1f} мс, "
+          f"max {max(lags):7.1f} мс ({len(lags)} замеров)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Лаг event loop под волной входов")
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=auth.BCRYPT_ROUNDS)
+    args = parser.parse_args()
+
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=args.rounds)
+    auth.pwd_context = context
+    hashed = context.hash("password")
+    hasher = auth.PasswordHasher()
+
+    await run_storm("inline", lambda: inline_login(context, hashed), args.logins)
+    await run_storm("pool", lambda: pooled_login(hasher, hashed), args.logins)
+    print(f"pool: {hasher.workers} потоков, отклонено {hasher.rejected}, "
+          f"средняя задержка входа {hasher.total_seconds / max(hasher.completed, 1) * 1000:.0f} мс")
+    hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,314 @@
+# backend/charts.py
+"""
+Рендеринг графиков mplfinance в пуле процессов.
+Отрисовка упирается в CPU и GIL, поэтому каждый график рисуется в отдельном
+процессе с заранее импортированными matplotlib/mplfinance.
+Готовые PNG адресуются хэшем входных данных и переиспользуются, пока их не вытеснят.
+"""
+
+import io
+import os
+import time
+import asyncio
+import json
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from rich.console import Console
+
+console = Console()
+
+CHART_WORKERS = max(1, int(os.getenv("CHART_WORKERS", str(min(4, os.cpu_count() or 1)))))
+CHARTS_DIR = "temp_charts"
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Графики моложе этого (сек) не вытесняются: их еще загружает идущий анализ или
+# запрашивает фронтенд по chart_images только что завершенного
+CHART_CACHE_GRACE = float(os.getenv("CHART_CACHE_GRACE_SEC", "900"))
+
+# Все, что влияет на картинку. При изменении оформления увеличьте CHART_STYLE_VERSION.
+CHART_STYLE_VERSION = 1
+CHART_PARAMS = {
+    "rsi_length": 14,
+    "bb_length": 20,
+    "bb_std": 2,
+    "mav": [9, 21, 50],
+    "style": "charles",
+    "figratio": [16, 9],
+    "dpi": 100,
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"pending": 0, "rendered": 0, "failed": 0}
+_inflight = {}  # путь PNG -> Future, чтобы одинаковые графики не рисовались дважды
+
+
+def _warm_worker():
+    """Инициализатор процесса: тяжелые импорты выполняются один раз при старте воркера."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import pandas  # noqa: F401
+    import mplfinance  # noqa: F401
+    import indicators  # noqa: F401
+
+
+def render_chart(symbol: str, timeframe: str, ohlcv: list, as_bytes: bool = False, filepath: str = None):
+    """
+    Рисует один график (свечи, объем, MA, BBands, RSI). Выполняется в процессе пула.
+    Возвращает путь к PNG (filepath) или байты PNG при as_bytes=True.
+    """
+    import pandas as pd
+    import mplfinance as mpf
+    import indicators
+
+    df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df.set_index('timestamp', inplace=True)
+
+    close = df['close'].to_numpy()
+    df['RSI'] = indicators.rsi(close, length=CHART_PARAMS['rsi_length'])
+    df['BBU'], df['BBL'] = indicators.bbands(close, length=CHART_PARAMS['bb_length'], std=CHART_PARAMS['bb_std'])
+    addplots = [
+        mpf.make_addplot(df['BBU'], color='cyan', width=0.7),
+        mpf.make_addplot(df['BBL'], color='cyan', width=0.7),
+        mpf.make_addplot(df['RSI'], panel=1, color='purple', title="RSI", ylim=(0, 100))
+    ]
+    plot_kwargs = dict(type='candle', style=CHART_PARAMS['style'], volume=True, figratio=tuple(CHART_PARAMS['figratio']),
+                       addplot=addplots, mav=tuple(CHART_PARAMS['mav']), title=f"Analysis for {symbol} - {timeframe}")
+
+    if as_bytes:
+        buffer = io.BytesIO()
+        mpf.plot(df, **plot_kwargs, savefig=dict(fname=buffer, dpi=CHART_PARAMS['dpi'], format='png'))
+        return buffer.getvalue()
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    # Пишем во временный файл и атомарно переименовываем: параллельные запросы
+    # никогда не увидят недописанный PNG
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    mpf.plot(df, **plot_kwargs, savefig=dict(fname=tmp_path, dpi=CHART_PARAMS['dpi'], format='png'))
+    os.replace(tmp_path, filepath)
+    return filepath
+
+
+def chart_key(symbol: str, timeframe: str, ohlcv: list) -> str:
+    """Хэш всего, от чего зависит картинка: пара, таймфрейм, последняя свеча, параметры и стиль."""
+    payload = json.dumps([CHART_STYLE_VERSION, symbol, timeframe, len(ohlcv), ohlcv[-1], CHART_PARAMS], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+
+class ChartRenderCache:
+    """
+    Каталог PNG, адресуемых по содержимому, с вытеснением самых старых файлов по размеру.
+    Файлы, использованные за последние grace секунд, не удаляются, даже если лимит превышен.
+    """
+
+    def __init__(self, directory: str = CHARTS_DIR, max_bytes: int = CHART_CACHE_MAX_BYTES,
+                 grace: float = CHART_CACHE_GRACE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path_for(self, symbol: str, timeframe: str, key: str) -> str:
+        return f"{self.directory}/chart_{symbol.replace('/', '')}_{timeframe}_{key}.png"
+
+    def lookup(self, path: str) -> bool:
+        with self._lock:
+            try:
+                # Обновляем mtime, чтобы вытеснялись давно не использованные графики
+                os.utime(path)
+            except OSError:
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, path: str):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_size()
+            else:
+                try:
+                    self._bytes += os.path.getsize(path)
+                except OSError:
+                    return
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _charts(self) -> list:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in names if n.startswith("chart_") and n.endswith(".png")]
+
+    def _scan_size(self) -> int:
+        total = 0
+        for path in self._charts():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _evict(self):
+        files = []
+        for path in self._charts():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        self._bytes = sum(size for _, size, _ in files)
+        recent = time.time() - self.grace
+        for mtime, size, path in files:
+            # Файлы отсортированы по mtime: дальше только недавно использованные
+            if self._bytes <= self.max_bytes or mtime > recent:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+render_cache = ChartRenderCache()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: не копируем потоки и сокеты веб-сервера в дочерние процессы
+            _pool = ProcessPoolExecutor(
+                max_workers=CHART_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+        return _pool
+
+
+def start_pool():
+    """Поднимает воркеры заранее, чтобы первый запрос не ждал импорта matplotlib."""
+    pool = get_pool()
+    for future in [pool.submit(_warm_worker) for _ in range(CHART_WORKERS)]:
+        future.result()
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _on_render_done(future):
+    with _stats_lock:
+        _stats["pending"] -= 1
+        if future.cancelled() or future.exception() is not None:
+            _stats["failed"] += 1
+        else:
+            _stats["rendered"] += 1
+
+
+def _on_cached_render_done(path: str, future):
+    with _stats_lock:
+        _inflight.pop(path, None)
+    if not future.cancelled() and future.exception() is None:
+        render_cache.add(path)
+
+
+def submit_render(symbol: str, timeframe: str, ohlcv: list, as_bytes: bool = False):
+    """
+    Ставит отрисовку графика в очередь пула и возвращает Future.
+    Если такой график уже есть в кэше (или рисуется сейчас), повторно он не рисуется.
+    """
+    path = render_cache.path_for(symbol, timeframe, chart_key(symbol, timeframe, ohlcv))
+    if render_cache.lookup(path):
+        done = Future()
+        if not as_bytes:
+            done.set_result(path)
+            return done
+        try:
+            with open(path, 'rb') as f:
+                done.set_result(f.read())
+            return done
+        except OSError:
+            # Файл вытеснили между lookup и чтением - рисуем заново
+            pass
+
+    with _stats_lock:
+        if not as_bytes and path in _inflight:
+            return _inflight[path]
+        _stats["pending"] += 1
+    try:
+        future = get_pool().submit(render_chart, symbol, timeframe, ohlcv, as_bytes, None if as_bytes else path)
+    except Exception:
+        with _stats_lock:
+            _stats["pending"] -= 1
+            _stats["failed"] += 1
+        raise
+    future.add_done_callback(_on_render_done)
+    if not as_bytes:
+        with _stats_lock:
+            _inflight[path] = future
+        future.add_done_callback(lambda f: _on_cached_render_done(path, f))
+    return future
+
+
+async def render_charts_async(symbol: str, frames: dict, as_bytes: bool = False) -> dict:
+    """
+    Параллельно рисует графики всех таймфреймов в пуле процессов: frames = {timeframe: ohlcv}.
+    Возвращает {timeframe: путь или байты PNG}, для неудачных графиков - None.
+    """
+    futures = {}
+    for tf, ohlcv in frames.items():
+        try:
+            futures[tf] = asyncio.wrap_future(submit_render(symbol, tf, ohlcv, as_bytes))
+        except Exception as e:
+            # Ошибка одного графика (например, пул недоступен) не должна отменять остальные
+            failed = futures[tf] = asyncio.get_running_loop().create_future()
+            failed.set_exception(e)
+    results = {}
+    for tf, future in futures.items():
+        try:
+            results[tf] = await future
+        except Exception as e:
+            console.print(f"❌ Не удалось создать график для {symbol} {tf}: {e}")
+            results[tf] = None
+    return results
+
+
+def stats() -> dict:
+    with _stats_lock:
+        pending = _stats["pending"]
+        return {
+            "workers": CHART_WORKERS,
+            "queue_depth": max(pending - CHART_WORKERS, 0),
+            "in_flight": pending,
+            "rendered": _stats["rendered"],
+            "failed": _stats["failed"],
+            "cache": render_cache.stats(),
+        }
@@ -1,8 +1,14 @@
 # backend/database.py
 import os
+import time
+from uuid import uuid4
+from collections import deque
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from sqlalchemy import MetaData, Table, Column, Integer, String, Float, DateTime, ForeignKey, func, Boolean # <-- Импортируем Boolean
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from sqlalchemy import MetaData, Table, Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Index, text # <-- Импортируем Boolean
 
 load_dotenv()
 
@@ -12,11 +18,130 @@ DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "postgres")
 
-DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Полный URL переопределяет DB_*; для локального запуска без Postgres:
+# DATABASE_URL=sqlite+aiosqlite:///trader_history.db
+DATABASE_URL = os.getenv("DATABASE_URL", f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
 
-async_engine = create_async_engine(DATABASE_URL)
+# --- Пул соединений (общий для API и трекера) ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Кэш подготовленных выражений asyncpg и драйвера SQLAlchemy над ним. 0 - для pgbouncer
+# в режиме transaction: оба кэша отключаются, а выражения получают уникальные имена,
+# чтобы не столкнуться с чужими на переиспользованном соединении сервера
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+
+class PoolCheckoutStats:
+    """Сколько запросы ждут свободное соединение - по этим числам подбирается размер пула."""
+
+    def __init__(self, window: int = 1000):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent = deque(maxlen=window)
+
+    def record(self, wait: float):
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._recent.append(wait)
+
+    def stats(self) -> dict:
+        recent = sorted(self._recent)
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "p95_wait_ms": round(recent[int(len(recent) * 0.95) - 1] * 1000, 3) if recent else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+checkout_stats = PoolCheckoutStats()
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool, замеряющий ожидание соединения при каждом checkout."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            checkout_stats.timeouts += 1
+            raise
+        finally:
+            checkout_stats.record(time.perf_counter() - started)
+
+
+def create_engine(url: str = DATABASE_URL):
+    """Единая фабрика движка: параметры пула берутся из окружения, поддерживаются asyncpg и aiosqlite."""
+    if url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":")):
+        # In-memory SQLite живет, пока открыто одно соединение
+        return create_async_engine(url, poolclass=StaticPool)
+
+    connect_args = {}
+    if url.startswith("postgresql+asyncpg"):
+        connect_args["statement_cache_size"] = DB_STATEMENT_CACHE_SIZE
+        connect_args["prepared_statement_cache_size"] = DB_STATEMENT_CACHE_SIZE
+        if DB_STATEMENT_CACHE_SIZE == 0:
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+    return create_async_engine(
+        url,
+        poolclass=TimedAsyncQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+async_engine = create_engine()
 AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
+
+def pool_stats() -> dict:
+    pool = async_engine.pool
+    stats = {"pool": type(pool).__name__, **checkout_stats.stats()}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(),
+                     max_overflow=DB_MAX_OVERFLOW)
+    return stats
+
+def utcnow() -> datetime:
+    """
+    Наивное UTC-время для колонок DateTime. Пишется из Python, а не func.now(): так в
+    SQLite время хранится в том же формате 'YYYY-MM-DD HH:MM:SS.ffffff', в каком
+    SQLAlchemy передает параметры, и сравнения (курсор истории) работают корректно.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    """Приводит время с часовым поясом (например, '...Z' из запроса) к наивному UTC колонок DateTime."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+async def normalize_legacy_timestamps(conn) -> int:
+    """
+    SQLite: записи, созданные через func.now(), хранят время без долей секунды
+    ('YYYY-MM-DD HH:MM:SS'), и строковое сравнение с параметром '... .000000' считает
+    их более ранними. Дописываем доли секунды; возвращает число исправленных строк.
+    """
+    if conn.dialect.name != "sqlite":
+        return 0
+    result = await conn.execute(text("UPDATE analyses SET timestamp = timestamp || '.000000' WHERE length(timestamp) = 19"))
+    return max(result.rowcount, 0)
+
+
 metadata = MetaData()
 
 users = Table(
@@ -42,10 +167,30 @@ analyses = Table(
     Column("risk_reward_ratio", String),
     Column("invalidation_hours", Integer),
     Column("consensus", String),
-    Column("timestamp", DateTime, default=func.now()),
+    Column("timestamp", DateTime, default=utcnow),
     Column("status", String, default='active', nullable=False),
     Column("entry_timestamp", DateTime, nullable=True),
     Column("closed_timestamp", DateTime, nullable=True),
     # --- ВОТ НОВАЯ КОЛОНКА ---
     Column("is_high_quality", Boolean, default=False, nullable=False),
+    # История пользователя читается страницами по (timestamp, id) от новых к старым
+    Index("ix_analyses_user_timestamp", "user_id", "timestamp", "id"),
+    # Трекер на каждом цикле выбирает сигналы по статусу и символу
+    Index("ix_analyses_status_symbol", "status", "symbol"),
+)
+
+# Живые воркеры трекера (heartbeat) и аренды шардов: каким шардом символов владеет воркер и до какого времени
+tracker_workers = Table(
+    "tracker_workers",
+    metadata,
+    Column("owner", String, primary_key=True),
+    Column("heartbeat_at", DateTime, nullable=False),
+)
+
+tracker_leases = Table(
+    "tracker_leases",
+    metadata,
+    Column("shard", Integer, primary_key=True, autoincrement=False),
+    Column("owner", String, nullable=False),
+    Column("expires_at", DateTime, nullable=False),
 )
@@ -0,0 +1,309 @@
+# backend/indicators.py
+"""
+Векторные индикаторы на NumPy: RSI, BBands, ATR, ADX, SMA/EMA.
+Все функции считают вдоль последней оси, поэтому на вход можно подать как один
+ряд (n_bars,), так и матрицу (n_symbols, n_bars) - тогда расчет идет сразу по всем
+символам. Результаты совпадают с прежними pandas-калькуляторами (ewm/rolling).
+
+Для живых обновлений есть потоковые версии (Streaming*): они инициализируются
+окном истории и затем обновляются одной новой свечой за O(1).
+"""
+
+import math
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Максимальный множитель роста внутри блока сканирования, чтобы не было переполнения
+_SCAN_GROWTH_LIMIT = {np.dtype(np.float32): 1e6, np.dtype(np.float64): 1e12}
+
+
+def _as_array(values, dtype=np.float64) -> np.ndarray:
+    return np.asarray(values, dtype=dtype)
+
+
+def _decay_scan(w: np.ndarray, decay: float) -> np.ndarray:
+    """
+    Линейная рекурсия s[t] = decay * s[t-1] + w[t] (s[-1] = 0) вдоль последней оси.
+    Считается блоками через cumsum без поэлементных циклов Python.
+    """
+    n = w.shape[-1]
+    if n == 0 or decay <= 0:
+        return w.copy()
+    limit = _SCAN_GROWTH_LIMIT.get(w.dtype, 1e12)
+    block = max(1, int(np.log(limit) / -np.log(decay))) if decay < 1 else n
+
+    out = np.empty_like(w)
+    carry = np.zeros(w.shape[:-1], dtype=w.dtype)
+    for start in range(0, n, block):
+        chunk = w[..., start:start + block]
+        k = chunk.shape[-1]
+        growth = np.power(w.dtype.type(decay), -np.arange(k, dtype=w.dtype))
+        acc = np.cumsum(chunk * growth, axis=-1)
+        out[..., start:start + k] = (decay * carry[..., None] + acc) / growth
+        carry = out[..., start + k - 1]
+    return out
+
+
+def _mask_min_periods(values: np.ndarray, min_periods: int) -> np.ndarray:
+    if min_periods > 1:
+        values[..., :min_periods - 1] = np.nan
+    return values
+
+
+def ewm_mean(values, alpha: float, adjust: bool = True, min_periods: int = 0, dtype=np.float64) -> np.ndarray:
+    """Аналог pandas Series.ewm(alpha=..., adjust=...).mean() для рядов без пропусков."""
+    x = _as_array(values, dtype)
+    decay = 1.0 - alpha
+    if adjust:
+        numerator = _decay_scan(x, decay)
+        steps = np.arange(1, x.shape[-1] + 1, dtype=x.dtype)
+        denominator = steps if decay == 1 else (1 - np.power(x.dtype.type(decay), steps)) / alpha
+        result = numerator / denominator
+    else:
+        w = x * alpha
+        w[..., 0] = x[..., 0]
+        result = _decay_scan(w, decay)
+    return _mask_min_periods(result, min_periods)
+
+
+def _ewm_after_first(values: np.ndarray, alpha: float) -> np.ndarray:
+    """ewm(adjust=False) для ряда, у которого первый элемент - NaN (результат diff)."""
+    result = np.full_like(values, np.nan)
+    if values.shape[-1] > 1:
+        result[..., 1:] = ewm_mean(values[..., 1:], alpha, adjust=False, dtype=values.dtype)
+    return result
+
+
+def sma(values, length: int, dtype=np.float64) -> np.ndarray:
+    x = _as_array(values, dtype)
+    result = np.full_like(x, np.nan)
+    if x.shape[-1] >= length:
+        result[..., length - 1:] = sliding_window_view(x, length, axis=-1).mean(axis=-1)
+    return result
+
+
+def ema(values, length: int, adjust: bool = False, dtype=np.float64) -> np.ndarray:
+    return ewm_mean(values, 2.0 / (length + 1), adjust=adjust, dtype=dtype)
+
+
+def rsi(close, length: int = 14, dtype=np.float64) -> np.ndarray:
+    x = _as_array(close, dtype)
+    delta = np.diff(x, axis=-1, prepend=np.nan).astype(x.dtype, copy=False)
+    gain = np.where(delta > 0, delta, 0).astype(x.dtype)
+    loss = np.where(delta < 0, -delta, 0).astype(x.dtype)
+    avg_gain = ewm_mean(gain, 1.0 / length, adjust=True, min_periods=length, dtype=x.dtype)
+    avg_loss = ewm_mean(loss, 1.0 / length, adjust=True, min_periods=length, dtype=x.dtype)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = 100 - (100 / (1 + avg_gain / avg_loss))
+    # Ряды без единого падения считаются перекупленными полностью
+    no_losses = (avg_loss == 0).all(axis=-1)
+    result[no_losses] = 100.0
+    return result
+
+
+def bbands(close, length: int = 20, std: float = 2, dtype=np.float64):
+    """Возвращает (upper, lower), стандартное отклонение выборочное (ddof=1), как в pandas."""
+    x = _as_array(close, dtype)
+    middle = np.full_like(x, np.nan)
+    std_dev = np.full_like(x, np.nan)
+    if x.shape[-1] >= length:
+        windows = sliding_window_view(x, length, axis=-1)
+        middle[..., length - 1:] = windows.mean(axis=-1)
+        std_dev[..., length - 1:] = windows.std(axis=-1, ddof=1)
+    return middle + std_dev * std, middle - std_dev * std
+
+
+def true_range(high, low, close, dtype=np.float64) -> np.ndarray:
+    high, low, close = (_as_array(v, dtype) for v in (high, low, close))
+    prev_close = np.concatenate([np.full_like(close[..., :1], np.nan), close[..., :-1]], axis=-1)
+    # fmax игнорирует NaN первой свечи, как и combine(..., max) в pandas-версии
+    return np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+def atr(high, low, close, length: int = 14, dtype=np.float64) -> np.ndarray:
+    return ewm_mean(true_range(high, low, close, dtype), 1.0 / length, adjust=False, dtype=dtype)
+
+
+def _adx_components(high, low, close, length: int, dtype):
+    high, low = _as_array(high, dtype), _as_array(low, dtype)
+    alpha = 1.0 / length
+    average_range = atr(high, low, close, length, dtype)
+
+    plus_dm = np.diff(high, axis=-1, prepend=np.nan).astype(high.dtype, copy=False)
+    minus_dm = np.diff(low, axis=-1, prepend=np.nan).astype(low.dtype, copy=False)
+    plus_dm[plus_dm < 0] = 0
+    minus_dm[minus_dm > 0] = 0
+
+    plus_avg = _ewm_after_first(plus_dm, alpha)
+    minus_avg = _ewm_after_first(minus_dm, alpha)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plus_di = 100 * (plus_avg / average_range)
+        minus_di = 100 * (np.abs(minus_avg) / average_range)
+        dx = 100 * (np.abs(plus_di - minus_di) / (np.abs(plus_di + minus_di) + 1e-6))
+    return average_range, plus_avg, minus_avg, _ewm_after_first(dx, alpha)
+
+
+def adx(high, low, close, length: int = 14, dtype=np.float64) -> np.ndarray:
+    """ADX без изменения входных данных (в отличие от старой calculate_adx)."""
+    return _adx_components(high, low, close, length, dtype)[3]
+
+
+def stack(series_list: list, length: int = None, dtype=np.float64) -> np.ndarray:
+    """
+    Собирает ряды разных символов в матрицу (n_symbols, length) по последним
+    length значениям (по умолчанию - длина самого короткого ряда) для пакетного расчета.
+    """
+    length = length or min(len(s) for s in series_list)
+    return np.stack([_as_array(s, dtype)[-length:] for s in series_list])
+
+
+# <--- ПОТОКОВЫЕ ИНДИКАТОРЫ (O(1) НА СВЕЧУ) --->
+
+def _last(values: np.ndarray) -> float:
+    return float(values[-1]) if len(values) else math.nan
+
+
+class StreamingRSI:
+    """RSI по Уайлдеру (ewm adjust=True), как rsi(), но с обновлением по одной свече."""
+
+    def __init__(self, closes, length: int = 14):
+        closes = _as_array(closes)
+        self.length = length
+        self.decay = 1.0 - 1.0 / length
+        delta = np.diff(closes, prepend=np.nan)
+        # Числители ewm для роста/падения и общий знаменатель (сумма весов)
+        self._gain = _last(_decay_scan(np.where(delta > 0, delta, 0.0), self.decay))
+        self._loss = _last(_decay_scan(np.where(delta < 0, -delta, 0.0), self.decay))
+        self._weight = _last(_decay_scan(np.ones_like(closes), self.decay))
+        self._count = len(closes)
+        self._prev_close = _last(closes)
+        self.value = self._compute()
+
+    def _compute(self) -> float:
+        if self._count < self.length:
+            return math.nan
+        avg_gain, avg_loss = self._gain / self._weight, self._loss / self._weight
+        if avg_loss == 0:
+            return 100.0 if avg_gain > 0 else math.nan
+        return 100 - 100 / (1 + avg_gain / avg_loss)
+
+    def update(self, close: float) -> float:
+        delta = close - self._prev_close if not math.isnan(self._prev_close) else 0.0
+        self._gain = self.decay * (self._gain if self._count else 0.0) + max(delta, 0.0)
+        self._loss = self.decay * (self._loss if self._count else 0.0) + max(-delta, 0.0)
+        self._weight = self.decay * (self._weight if self._count else 0.0) + 1.0
+        self._count += 1
+        self._prev_close = close
+        self.value = self._compute()
+        return self.value
+
+
+class StreamingBBands:
+    """Полосы Боллинджера на скользящем окне: среднее и дисперсия по Уэлфорду."""
+
+    def __init__(self, closes, length: int = 20, std: float = 2):
+        self.length = length
+        self.std = std
+        self._window = deque(maxlen=length)
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.value = (math.nan, math.nan)
+        for close in _as_array(closes)[-length:]:
+            self.update(float(close))
+
+    def update(self, close: float):
+        if len(self._window) < self.length:
+            self._window.append(close)
+            delta = close - self._mean
+            self._mean += delta / len(self._window)
+            self._m2 += delta * (close - self._mean)
+        else:
+            oldest = self._window[0]
+            self._window.append(close)
+            new_mean = self._mean + (close - oldest) / self.length
+            self._m2 += (close - oldest) * (close - new_mean + oldest - self._mean)
+            self._mean = new_mean
+
+        if len(self._window) < self.length:
+            self.value = (math.nan, math.nan)
+        else:
+            std_dev = math.sqrt(max(self._m2, 0.0) / (self.length - 1))
+            self.value = (self._mean + std_dev * self.std, self._mean - std_dev * self.std)
+        return self.value
+
+
+class StreamingATR:
+    """ATR (ewm adjust=False от true range), как atr(), с обновлением по одной свече."""
+
+    def __init__(self, highs, lows, closes, length: int = 14):
+        self.alpha = 1.0 / length
+        self.value = _last(atr(highs, lows, closes, length))
+        self._prev_close = _last(_as_array(closes))
+
+    def update(self, high: float, low: float, close: float) -> float:
+        candidates = [high - low]
+        if not math.isnan(self._prev_close):
+            candidates += [abs(high - self._prev_close), abs(low - self._prev_close)]
+        tr = max(candidates)
+        self.value = tr if math.isnan(self.value) else (1 - self.alpha) * self.value + self.alpha * tr
+        self._prev_close = close
+        return self.value
+
+
+class StreamingADX:
+    """ADX с той же формулой, что и adx(), с обновлением по одной свече."""
+
+    def __init__(self, highs, lows, closes, length: int = 14):
+        self.alpha = 1.0 / length
+        self._atr = StreamingATR(highs, lows, closes, length)
+        _, plus_avg, minus_avg, adx_values = _adx_components(highs, lows, closes, length, np.float64)
+        self._plus = _last(plus_avg)
+        self._minus = _last(minus_avg)
+        self.value = _last(adx_values)
+        self._prev_high = _last(_as_array(highs))
+        self._prev_low = _last(_as_array(lows))
+
+    def _smooth(self, previous: float, current: float) -> float:
+        return current if math.isnan(previous) else (1 - self.alpha) * previous + self.alpha * current
+
+    def update(self, high: float, low: float, close: float) -> float:
+        average_range = self._atr.update(high, low, close)
+        if not math.isnan(self._prev_high):
+            self._plus = self._smooth(self._plus, max(high - self._prev_high, 0.0))
+            self._minus = self._smooth(self._minus, min(low - self._prev_low, 0.0))
+            if average_range:
+                plus_di = 100 * self._plus / average_range
+                minus_di = 100 * abs(self._minus) / average_range
+                dx = 100 * abs(plus_di - minus_di) / (abs(plus_di + minus_di) + 1e-6)
+                self.value = self._smooth(self.value, dx)
+        self._prev_high, self._prev_low = high, low
+        return self.value
+
+
+class CandleIndicatorStream:
+    """
+    Набор потоковых индикаторов графика для одной пары/таймфрейма.
+    Инициализируется свечами в формате ccxt [ts, open, high, low, close, volume]
+    и обновляется каждой новой закрытой свечой.
+    """
+
+    def __init__(self, ohlcv: list, rsi_length: int = 14, bb_length: int = 20, bb_std: float = 2, adx_length: int = 14):
+        data = np.asarray(ohlcv, dtype=np.float64).reshape(-1, 6)
+        highs, lows, closes = data[:, 2], data[:, 3], data[:, 4]
+        self.rsi = StreamingRSI(closes, rsi_length)
+        self.bbands = StreamingBBands(closes, bb_length, bb_std)
+        self.atr = StreamingATR(highs, lows, closes, adx_length)
+        self.adx = StreamingADX(highs, lows, closes, adx_length)
+
+    def update(self, candle: list) -> dict:
+        _, _, high, low, close, _ = candle
+        upper, lower = self.bbands.update(close)
+        return {
+            "rsi": self.rsi.update(close),
+            "bb_upper": upper,
+            "bb_lower": lower,
+            "atr": self.atr.update(high, low, close),
+            "adx": self.adx.update(high, low, close),
+        }
@@ -0,0 +1,277 @@
+# backend/jobs.py
+"""
+Фоновая очередь анализов. POST /analyze/ только ставит задачу в очередь и сразу
+возвращает ее ID, а ограниченный пул воркеров выполняет анализы по очереди.
+Результат забирается опросом или через поток событий (SSE).
+"""
+
+import os
+import copy
+import time
+import uuid
+import asyncio
+from collections import OrderedDict, deque
+
+from rich.console import Console
+
+console = Console()
+
+ANALYSIS_CONCURRENCY = max(1, int(os.getenv("ANALYSIS_CONCURRENCY", "2")))
+ANALYSIS_QUEUE_LIMIT = int(os.getenv("ANALYSIS_QUEUE_LIMIT", "100"))
+# Сколько завершенных задач хранить и как долго (сек), чтобы клиент успел забрать результат
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "1000"))
+# Начальная оценка длительности анализа, пока нет статистики
+DEFAULT_JOB_DURATION = 120.0
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, pair: str, strategy_key: str, user_id: int):
+        self.id = uuid.uuid4().hex
+        self.pair = pair
+        self.strategy_key = strategy_key
+        self.user_id = user_id
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def _notify(self):
+        # Будим всех, кто ждет изменения статуса, и взводим событие заново
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class InMemoryJobStore:
+    """Хранилище задач в памяти процесса; завершенные задачи вытесняются по TTL и лимиту."""
+
+    def __init__(self, ttl: int = JOB_RESULT_TTL, limit: int = JOB_HISTORY_LIMIT):
+        self.ttl = ttl
+        self.limit = limit
+        self._jobs = OrderedDict()
+
+    def add(self, job: Job):
+        self._jobs[job.id] = job
+        self._prune()
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def _prune(self):
+        now = time.time()
+        finished = [j for j in self._jobs.values() if j.finished]
+        overflow = len(self._jobs) - self.limit
+        for job in finished:
+            if now - job.finished_at > self.ttl or overflow > 0:
+                del self._jobs[job.id]
+                overflow -= 1
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые анализы (пара, стратегия, текущая свеча) в один
+    запуск и кратко кэширует его результат до закрытия свечи. Каждый вызывающий получает
+    собственную копию результата, поэтому запись в БД по-прежнему делается для каждого.
+    period_fn(strategy_key) -> время (unix, сек) закрытия текущей свечи стратегии.
+    """
+
+    def __init__(self, analyzer, period_fn):
+        self.analyzer = analyzer
+        self.period_fn = period_fn
+        self._inflight = {}  # ключ -> asyncio.Task
+        self._results = {}   # ключ -> результат, действительный до конца свечи
+        self.executions = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+
+    def _prune(self):
+        now = time.time()
+        for key in [k for k in self._results if k[2] <= now]:
+            del self._results[key]
+
+    async def _execute(self, key: tuple, pair: str, strategy_key: str) -> dict:
+        self.executions += 1
+        try:
+            result = await self.analyzer(pair, strategy_key)
+            # Ошибки (биржа недоступна и т.п.) не кэшируем - следующий запрос попробует снова
+            if not result.get("error"):
+                self._results[key] = result
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def __call__(self, pair: str, strategy_key: str) -> dict:
+        self._prune()
+        key = (pair, strategy_key, self.period_fn(strategy_key))
+        if key in self._results:
+            self.cache_hits += 1
+            return copy.deepcopy(self._results[key])
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._execute(key, pair, strategy_key))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # shield: отмена одного ожидающего не прерывает общий анализ для остальных
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def stats(self) -> dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "cache_hits": self.cache_hits,
+            "in_flight": len(self._inflight),
+            "cached_results": len(self._results),
+        }
+
+
+class JobQueue:
+    """
+    Очередь анализов с ограниченным числом одновременно работающих воркеров.
+    analyzer - корутина (pair, strategy_key) -> dict, on_result - корутина (job, result),
+    вызываемая после успешного анализа (например, для сохранения в БД).
+    """
+
+    def __init__(self, analyzer, on_result=None, store: InMemoryJobStore = None,
+                 concurrency: int = ANALYSIS_CONCURRENCY, max_queue: int = ANALYSIS_QUEUE_LIMIT):
+        self.analyzer = analyzer
+        self.on_result = on_result
+        self.store = store or InMemoryJobStore()
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._pending = OrderedDict()  # job_id -> Job в порядке очереди
+        self._queue = asyncio.Queue()
+        self._workers = []
+        self._running = 0
+        self._durations = deque(maxlen=50)
+        self.completed = 0
+        self.failed = 0
+
+    async def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, pair: str, strategy_key: str, user_id: int) -> Job:
+        if len(self._pending) >= self.max_queue:
+            raise QueueFullError("Очередь анализов переполнена, попробуйте позже.")
+        job = Job(pair, strategy_key, user_id)
+        self.store.add(job)
+        self._pending[job.id] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str):
+        return self.store.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self._pending.pop(job.id, None)
+            self._running += 1
+            job.status = RUNNING
+            job.started_at = time.time()
+            job._notify()
+            try:
+                result = await self.analyzer(job.pair, job.strategy_key)
+                if result.get("error"):
+                    job.status, job.error = FAILED, result["error"]
+                else:
+                    if self.on_result is not None:
+                        await self.on_result(job, result)
+                    job.status, job.result = DONE, result
+            except asyncio.CancelledError:
+                job.status, job.error = FAILED, "Анализ прерван остановкой сервера."
+                raise
+            except Exception as e:
+                console.print(f"❌ Задача анализа {job.id} завершилась ошибкой: {e}")
+                job.status, job.error = FAILED, f"Внутренняя ошибка сервера: {e}"
+            finally:
+                job.finished_at = time.time()
+                self._durations.append(job.finished_at - job.started_at)
+                self._running -= 1
+                if job.status == DONE:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                job._notify()
+                self._queue.task_done()
+
+    def average_duration(self) -> float:
+        return sum(self._durations) / len(self._durations) if self._durations else DEFAULT_JOB_DURATION
+
+    def position(self, job: Job) -> int:
+        """Позиция в очереди (1 - следующая на запуск), 0 - задача уже выполняется или завершена."""
+        if job.status != QUEUED:
+            return 0
+        for index, job_id in enumerate(self._pending, start=1):
+            if job_id == job.id:
+                return index
+        return 0
+
+    def eta(self, job: Job) -> float:
+        """Оценка времени (сек) до готовности результата."""
+        average = self.average_duration()
+        if job.finished:
+            return 0.0
+        if job.status == RUNNING:
+            return max(average - (time.time() - job.started_at), 0.0)
+        # Перед нами position - 1 задач плюс уже запущенные, все делят concurrency воркеров
+        waves = (self.position(job) - 1 + self._running) // self.concurrency
+        return waves * average + average
+
+    def describe(self, job: Job, include_result: bool = True) -> dict:
+        info = {
+            "job_id": job.id,
+            "status": job.status,
+            "pair": job.pair,
+            "strategy_key": job.strategy_key,
+            "position": self.position(job),
+            "eta_seconds": round(self.eta(job), 1),
+        }
+        if include_result and job.finished:
+            info["result"] = job.result
+            info["error"] = job.error
+        return info
+
+    async def events(self, job: Job, heartbeat: float = 5.0):
+        """Асинхронный генератор снимков состояния задачи до ее завершения."""
+        while True:
+            changed = job.changed
+            yield self.describe(job)
+            if job.finished:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._pending),
+            "running": self._running,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "failed": self.failed,
+            "average_duration": round(self.average_duration(), 1),
+        }
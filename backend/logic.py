@@ -1,78 +1,82 @@
 # backend/logic.py
 
-import matplotlib
-matplotlib.use('Agg')
-
 import os
 import json
-import pandas as pd
+import asyncio
 from collections import Counter
-import mplfinance as mpf
-import ccxt
-import google.generativeai as genai
+import ccxt.async_support as ccxt_async
 from dotenv import load_dotenv
 from rich.console import Console
 import re
-import time
+
+import charts
+import prefilter
+from model_backends import ModelBackend, ModelBlockedError, MultiSampleUnsupported, get_backend
+from model_governor import governor, ModelUnavailableError
+from response_cache import response_cache, image_digests, make_key
+from strategies import registry, render_prompt
+from market_data import fetch_ohlcv_cached_async, next_candle_close, timeframe_seconds
 
 # --- НАСТРОЙКА ---
 load_dotenv()
-try:
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    exchange = ccxt.binance()
-    console = Console()
-except Exception as e:
-    print(f"❌ Ошибка конфигурации API: {e}")
-    exit()
-
-# <--- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ-КАЛЬКУЛЯТОРЫ --->
-def calculate_rsi(series: pd.Series, length: int = 14) -> pd.Series:
-    delta = series.diff()
-    gain = delta.where(delta > 0, 0)
-    loss = -delta.where(delta < 0, 0)
-    avg_gain = gain.ewm(com=length - 1, min_periods=length).mean()
-    avg_loss = loss.ewm(com=length - 1, min_periods=length).mean()
-    if avg_loss.empty or (avg_loss == 0).all():
-        return pd.Series(100.0, index=series.index)
-    rs = avg_gain / avg_loss
-    return 100 - (100 / (1 + rs))
-
-def calculate_bbands(series: pd.Series, length: int = 20, std: int = 2):
-    middle_band = series.rolling(window=length).mean()
-    std_dev = series.rolling(window=length).std()
-    upper_band = middle_band + (std_dev * std)
-    lower_band = middle_band - (std_dev * std)
-    return upper_band, lower_band
+console = Console()
+
+# Сколько мнений AI запрашивается одновременно (1 = последовательный режим)
+CONSENSUS_FANOUT = max(1, int(os.getenv("CONSENSUS_FANOUT", "3")))
+TARGET_SUCCESSFUL_RUNS = 3
+MAX_ATTEMPTS = 5
+REQUIRED_VOTES = 2
+
+# Один долгоживущий асинхронный клиент биржи на весь процесс: общий пул
+# соединений aiohttp, загруженные рынки и соблюдение лимитов запросов
+_exchange = None
+_exchange_lock = asyncio.Lock()
+
+async def get_exchange():
+    global _exchange
+    if _exchange is None:
+        async with _exchange_lock:
+            if _exchange is None:
+                client = ccxt_async.binance({'enableRateLimit': True})
+                try:
+                    await client.load_markets()
+                except Exception:
+                    await client.close()
+                    raise
+                _exchange = client
+    return _exchange
+
+async def close_exchange():
+    global _exchange
+    async with _exchange_lock:
+        client, _exchange = _exchange, None
+    if client is not None:
+        await client.close()
 
 # <--- ОСНОВНЫЕ ФУНКЦИИ --- >
 
-def fetch_and_plot(symbol: str, timeframe: str) -> str:
-    """Создает один график для указанного таймфрейма."""
+async def fetch_candles(exchange, symbol: str, timeframe: str) -> list:
+    """Свечи для графика или None, если данных недостаточно."""
     try:
-        ohlcv = exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=200)
-        if len(ohlcv) < 50:
-            return None
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df.set_index('timestamp', inplace=True)
-        os.makedirs("temp_charts", exist_ok=True)
-
-        df['RSI'] = calculate_rsi(df['close'])
-        df['BBU'], df['BBL'] = calculate_bbands(df['close'])
-        addplots = [
-            mpf.make_addplot(df['BBU'], color='cyan', width=0.7),
-            mpf.make_addplot(df['BBL'], color='cyan', width=0.7),
-            mpf.make_addplot(df['RSI'], panel=1, color='purple', title="RSI", ylim=(0, 100))
-        ]
-        plot_kwargs = dict(type='candle', style='charles', volume=True, figratio=(16, 9), addplot=addplots, mav=(9, 21, 50),
-                           title=f"Analysis for {symbol} - {timeframe}")
-        
-        filepath = f"temp_charts/analysis_{symbol.replace('/', '')}_{timeframe}.png"
-        mpf.plot(df, **plot_kwargs, savefig=dict(fname=filepath, dpi=100))
-        return filepath if os.path.exists(filepath) else None
+        ohlcv = await fetch_ohlcv_cached_async(exchange, symbol, timeframe, limit=200)
     except Exception as e:
-        console.print(f"❌ Не удалось создать график для {timeframe}: {e}")
+        console.print(f"❌ Не удалось загрузить свечи для {timeframe}: {e}")
         return None
+    return ohlcv if len(ohlcv) >= 50 else None
+
+async def fetch_market_data(symbol: str, timeframes: list):
+    """Параллельно запрашивает текущую цену и свечи всех таймфреймов: (цена, {timeframe: ohlcv})."""
+    exchange = await get_exchange()
+    ticker, *candles = await asyncio.gather(
+        exchange.fetch_ticker(symbol),
+        *[fetch_candles(exchange, symbol, tf) for tf in timeframes],
+    )
+    return ticker['last'], dict(zip(timeframes, candles))
+
+async def plot_charts(symbol: str, frames: dict) -> list:
+    """Создает графики всех таймфреймов параллельно в пуле процессов (в порядке frames)."""
+    rendered = await charts.render_charts_async(symbol, {tf: ohlcv for tf, ohlcv in frames.items() if ohlcv})
+    return [rendered.get(tf) for tf in frames]
 
 def clean_json_response(raw_text: str) -> dict:
     """
@@ -105,96 +109,240 @@ def clean_json_response(raw_text: str) -> dict:
         console.print(f"   Не удалось обработать текст: {cleaned_text}")
         return None
 
-def analyze_with_gemini(image_paths: list, prompt_file: str, prompt_kwargs: dict):
+async def analyze_once(backend: ModelBackend, session, prompt: str, cache_key: str = None, bypass_cache: bool = False):
+    """
+    Одно мнение модели. Лимиты, повторы и circuit breaker - в model_governor;
+    отмена задачи прерывает и запрос, и паузу перед повтором. С cache_key разобранный
+    ответ сначала ищется в response_cache (без запроса, загрузки графиков и разбора).
+    """
+    if cache_key:
+        cached = await response_cache.get_async(cache_key, bypass=bypass_cache)
+        if cached is not None:
+            console.print("💾 Ответ модели взят из кэша.")
+            return cached
     try:
-        # --- КЛЮЧЕВОЕ ИЗМЕНЕНИЕ ЗДЕСЬ ---
-        # Используем 'utf-8-sig' для автоматического удаления BOM
-        with open(prompt_file, 'r', encoding='utf-8-sig') as f:
-            prompt_template = f.read()
-        prompt = prompt_template.format(**prompt_kwargs)
-    except FileNotFoundError:
-        console.print(f"❌ Промпт не найден: {prompt_file}")
+        raw_text = await governor.call(lambda: backend.generate(session, prompt), key=backend.api_key_id)
+    except ModelBlockedError as e:
+        console.print(f"❌ [bold red]{e} Пропускаем.[/bold red]")
         return None
-
-    uploaded_files = [genai.upload_file(path=p) for p in image_paths if p and os.path.exists(p)]
-    if not uploaded_files:
+    except ModelUnavailableError:
+        raise
+    except Exception as e:
+        console.print(f"❌ Не удалось получить ответ после {governor.max_retries} попыток: {e}")
         return None
+    trade_idea = clean_json_response(raw_text)
+    if cache_key and isinstance(trade_idea, dict):
+        await response_cache.put_async(cache_key, trade_idea)
+    return trade_idea
 
-    model = genai.GenerativeModel('gemini-2.5-pro')
-    safety_settings = {k: 'BLOCK_NONE' for k in ['HARM_CATEGORY_HARASSMENT', 'HARM_CATEGORY_HATE_SPEECH', 'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'HARM_CATEGORY_DANGEROUS_CONTENT']}
-    
+def _consensus_settled(results: list, finished: int) -> bool:
+    """Проверяет, можно ли прекратить сбор мнений: большинство уже есть или недостижимо."""
+    if len(results) >= TARGET_SUCCESSFUL_RUNS:
+        return True
+    best = Counter(r.get('direction') for r in results).most_common(1)
+    best_count = best[0][1] if best else 0
+    if best_count >= REQUIRED_VOTES:
+        return True
+    return best_count + (MAX_ATTEMPTS - finished) < REQUIRED_VOTES
+
+async def collect_consensus(backend: ModelBackend, session, prompt: str, fanout: int = None,
+                            cache_key=None, bypass_cache: bool = False) -> list:
+    """
+    Параллельно собирает мнения AI (до MAX_ATTEMPTS попыток, не более fanout одновременно).
+    Останавливается, как только большинство 2 из 3 достигнуто или стало недостижимым;
+    лишние попытки отменяются вместе с их запросами к модели.
+    cache_key(номер попытки) -> ключ response_cache: у каждой попытки свой ответ в кэше.
+    """
+    fanout = max(1, min(fanout or CONSENSUS_FANOUT, MAX_ATTEMPTS))
+    results = []
+    launched = finished = 0
+
+    console.print(f"🤖 Собираем {TARGET_SUCCESSFUL_RUNS} мнения от AI (максимум {MAX_ATTEMPTS} попыток, параллельно {fanout})...")
+    pending = set()
     try:
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = model.generate_content([prompt] + uploaded_files, safety_settings=safety_settings)
-                if not response.parts:
-                    console.print(f"❌ [bold red]Ответ от Gemini был заблокирован. Пропускаем.[/bold red]")
-                    return None
-                return clean_json_response(response.text)
-            except Exception as e:
-                console.print(f"🟡 Ошибка API (попытка {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(5)
-                else:
-                    console.print(f"❌ Не удалось получить ответ после {max_retries} попыток.")
-                    return None
+        while True:
+            while len(pending) < fanout and launched < MAX_ATTEMPTS:
+                launched += 1
+                console.print(f"--- Попытка №{launched} ---")
+                key = cache_key(launched) if cache_key else None
+                pending.add(asyncio.create_task(analyze_once(backend, session, prompt, key, bypass_cache)))
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            unavailable = None
+            for task in done:
+                finished += 1
+                try:
+                    trade_idea = task.result()
+                except ModelUnavailableError as e:
+                    # Цепь разомкнута - остальные попытки тоже будут отклонены
+                    unavailable = e
+                    continue
+                except Exception as e:
+                    console.print(f"❌ Попытка анализа завершилась ошибкой: {e}")
+                    continue
+                if trade_idea and trade_idea.get('direction', 'None').lower() != 'none':
+                    results.append(trade_idea)
+                    console.print(f"[green]✅ Успешный анализ получен ({len(results)}/{TARGET_SUCCESSFUL_RUNS})[/green]")
+            if unavailable is not None:
+                raise unavailable
+
+            if _consensus_settled(results, finished):
+                if pending:
+                    console.print(f"🎯 Исход консенсуса определен, отменяем {len(pending)} лишних запросов.")
+                break
     finally:
-        for f in uploaded_files:
-            try:
-                genai.delete_file(f.name)
-            except Exception:
-                pass
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    return results
+
+async def collect_samples(backend: ModelBackend, session, prompt: str, samples: int,
+                          cache_key: str = None, bypass_cache: bool = False) -> list:
+    """
+    Консенсус одним запросом: модель возвращает samples вариантов ответа на тот же промпт
+    и графики, по которым затем голосует decide_signal. Промпт и графики отправляются один раз.
+    Если бэкенд не умеет несколько вариантов, бросает MultiSampleUnsupported.
+    """
+    console.print(f"🤖 Запрашиваем {samples} вариантов ответа AI одним запросом...")
+    candidates = None
+    if cache_key:
+        candidates = await response_cache.get_async(cache_key, bypass=bypass_cache)
+        if candidates is not None:
+            console.print("💾 Варианты ответа модели взяты из кэша.")
+    if candidates is None:
+        try:
+            texts = await governor.call(lambda: backend.generate_samples(session, prompt, samples),
+                                        key=backend.api_key_id)
+        except (ModelUnavailableError, MultiSampleUnsupported):
+            raise
+        except ModelBlockedError as e:
+            console.print(f"❌ [bold red]{e} Пропускаем.[/bold red]")
+            return []
+        except Exception as e:
+            console.print(f"❌ Не удалось получить ответ после {governor.max_retries} попыток: {e}")
+            return []
+        candidates = [idea for idea in map(clean_json_response, texts) if isinstance(idea, dict)]
+        if cache_key and candidates:
+            await response_cache.put_async(cache_key, candidates)
 
-def run_full_analysis(pair: str, strategy_key: str):
+    results = [idea for idea in candidates if idea.get('direction', 'None').lower() != 'none']
+    console.print(f"[green]✅ Получено {len(results)} торговых идей из {len(candidates)} вариантов[/green]")
+    return results
+
+def analysis_period_end(strategy_key: str) -> float:
+    """
+    Время закрытия текущей свечи самого младшего таймфрейма стратегии: до этого
+    момента графики, а значит и результат анализа для пары, не меняются.
+    """
     try:
-        with open('config.json', 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        strategy = config['strategies'][strategy_key]
-    except (FileNotFoundError, KeyError):
-        return {"error": f"Стратегия '{strategy_key}' не найдена."}
+        timeframes = registry.get(strategy_key)['timeframes']
+    except KeyError:
+        return 0.0
+    return next_candle_close(min(timeframes, key=timeframe_seconds))
 
+async def gather_opinions(chart_paths: list, prompt: str, backend: ModelBackend = None,
+                          bypass_cache: bool = False, consensus: dict = None) -> list:
+    """
+    Открывает сессию бэкенда (графики загружаются один раз) и собирает мнения AI.
+    consensus - настройка стратегии: mode=multi_sample запрашивает samples вариантов
+    одним запросом, а если бэкенд этого не умеет - отдельными запросами, как sequential.
+    bypass_cache=True запрашивает модель заново, но сохраняет свежие ответы в кэш.
+    """
+    backend = backend or get_backend()
+    consensus = consensus or {}
+    digests = await asyncio.to_thread(image_digests, chart_paths)
+    cache_key = lambda attempt: make_key(backend.model_name, prompt, digests, attempt)
+    session = await backend.open_session(chart_paths)
     try:
-        current_price = exchange.fetch_ticker(pair)['last']
-    except Exception as e:
-        return {"error": f"Не удалось получить цену для {pair}: {e}"}
+        results = None
+        if consensus.get('mode') == 'multi_sample' and backend.supports_multi_sample:
+            samples = consensus.get('samples', TARGET_SUCCESSFUL_RUNS)
+            try:
+                results = await collect_samples(backend, session, prompt, samples,
+                                                cache_key=cache_key(f"samples:{samples}"), bypass_cache=bypass_cache)
+            except MultiSampleUnsupported as e:
+                console.print(f"⚠️ Несколько вариантов ответа не поддерживаются ({e}), переходим к отдельным запросам.")
+        if results is None:
+            results = await collect_consensus(backend, session, prompt, cache_key=cache_key, bypass_cache=bypass_cache)
+    finally:
+        await backend.close_session(session)
+    upload_stats = session.stats()
+    console.print(f"📤 Графики загружены {upload_stats['files']} шт. на {upload_stats['uses']} попыток: "
+                  f"сэкономлено {upload_stats['bytes_saved']} байт и {upload_stats['round_trips_saved']} запросов.")
+    return results
 
-    console.print(f"\n[bold cyan]--- Генерация идеи для {pair} ---[/bold cyan]")
-    console.print("🖼️  Создание набора графиков для анализа...")
-    chart_paths = [fetch_and_plot(pair, tf) for tf in strategy['timeframes']]
-    valid_charts = [p for p in chart_paths if p]
-    if not valid_charts:
-        return {"status": "no_signal", "message": "Не удалось создать графики для анализа."}
+def expected_model_calls(consensus: dict) -> int:
+    """Сколько запросов к основной модели минимум уходит на анализ, который заканчивается без сигнала."""
+    if consensus.get('mode') == 'multi_sample':
+        return 1
+    # Все ответы "None": сбор прекращается, когда большинство REQUIRED_VOTES стало недостижимым
+    return MAX_ATTEMPTS - REQUIRED_VOTES + 1
 
-    TARGET_SUCCESSFUL_RUNS = 3
-    MAX_ATTEMPTS = 5
-    results = []
-    
-    console.print(f"🤖 Собираем {TARGET_SUCCESSFUL_RUNS} мнения от AI (максимум {MAX_ATTEMPTS} попыток)...")
-    for i in range(1, MAX_ATTEMPTS + 1):
-        console.print(f"--- Попытка №{i} ---")
-        prompt_kwargs = {'symbol': pair, 'current_price': current_price}
-        trade_idea = analyze_with_gemini(valid_charts, strategy['prompt_file'], prompt_kwargs)
-        
-        if trade_idea and trade_idea.get('direction', 'None').lower() != 'none':
-            results.append(trade_idea)
-            console.print(f"[green]✅ Успешный анализ получен ({len(results)}/{TARGET_SUCCESSFUL_RUNS})[/green]")
-        
-        if len(results) >= TARGET_SUCCESSFUL_RUNS:
-            console.print(f"🎯 Цель в {TARGET_SUCCESSFUL_RUNS} успешных анализа достигнута.")
-            break
+async def screen_with_model(pair: str, timeframe: str, frames: dict) -> prefilter.Verdict:
+    """
+    Вторая ступень фильтра: один график и быстрая модель. Любая ошибка пропускает
+    анализ дальше - фильтр не должен терять сигналы из-за сбоев дешевой модели.
+    """
+    chart_path = (await plot_charts(pair, {timeframe: frames.get(timeframe)}))[0]
+    if not chart_path:
+        return prefilter.Verdict(True, "model", "Нет графика для быстрой проверки.")
+    backend = prefilter.get_screening_backend()
+    prompt = registry.render_screening_prompt(pair, timeframe)
+    digests = await asyncio.to_thread(image_digests, [chart_path])
+    cache_key = make_key(backend.model_name, prompt, digests, "prefilter")
+
+    answer = await response_cache.get_async(cache_key)
+    if answer is None:
+        session = await backend.open_session([chart_path])
+        try:
+            raw_text = await governor.call(lambda: backend.generate(session, prompt), key=backend.api_key_id)
+            answer = clean_json_response(raw_text)
+        except ModelUnavailableError:
+            raise
+        except Exception as e:
+            console.print(f"⚠️ Быстрая проверка {backend.model_name} не удалась: {e}")
+            answer = None
+        finally:
+            await backend.close_session(session)
+        prefilter.prefilter_stats.record_model_check(failed=not isinstance(answer, dict))
+        if isinstance(answer, dict):
+            await response_cache.put_async(cache_key, answer)
+
+    if not isinstance(answer, dict) or answer.get('setup') is not False:
+        return prefilter.Verdict(True, "model", (answer or {}).get('reason') or "Быстрая модель не исключила сетап.")
+    return prefilter.Verdict(False, "model", answer.get('reason') or f"Быстрая модель не нашла сетапа на {timeframe}.")
 
+async def prefilter_analysis(pair: str, strategy: dict, frames: dict):
+    """Результат no_signal, если предварительный фильтр отсек анализ, иначе None."""
+    settings = strategy['prefilter']
+    if not (prefilter.PREFILTER_ENABLED and settings['enabled']):
+        return None
+    verdict = prefilter.screen_numeric(settings, frames)
+    charts_at_stake = sum(1 for ohlcv in frames.values() if ohlcv)
+    if verdict.passed and settings['model_check']:
+        model_verdict = await screen_with_model(pair, settings['model_timeframe'], frames)
+        model_verdict.features = verdict.features
+        verdict = model_verdict
+        # Единственный график быстрой проверки уже отрисован
+        charts_at_stake -= 1
+    prefilter.prefilter_stats.record(verdict, expected_model_calls(strategy['consensus']), charts_at_stake)
+    if verdict.passed:
+        return None
+    console.print(f"🧹 Предварительный фильтр отсек анализ {pair}: {verdict.reason}")
+    return {"status": "no_signal", "message": f"Сетапа нет: {verdict.reason}", "prefilter": verdict.as_dict()}
+
+def decide_signal(results: list, chart_paths: list) -> dict:
+    """Голосование по направлениям: сигнал, только если не менее REQUIRED_VOTES мнений совпали."""
     if not results:
-        for p in valid_charts:
-            os.remove(p)
         return {"status": "no_signal", "message": "ИИ не нашел качественных торговых сетапов."}
 
     directions = [r.get('direction') for r in results]
     direction_counts = Counter(directions)
     
-    if not direction_counts or direction_counts.most_common(1)[0][1] < 2:
-        for p in valid_charts:
-            os.remove(p)
+    if not direction_counts or direction_counts.most_common(1)[0][1] < REQUIRED_VOTES:
         return {"status": "ambiguous", "message": "Рыночная ситуация НЕОДНОЗНАЧНАЯ.", "details": dict(direction_counts)}
         
     most_common_direction, count = direction_counts.most_common(1)[0]
@@ -205,15 +353,47 @@ def run_full_analysis(pair: str, strategy_key: str):
     final_result = confident_result
     final_result.update({
         'status': 'success',
-        'chart_images': [os.path.basename(p) for p in valid_charts],
+        'chart_images': [os.path.basename(p) for p in chart_paths],
         'consensus': f"{count}/{len(results)}"
     })
+    return final_result
 
-    # Очистка старых графиков после успешного анализа
-    for p in valid_charts:
-        try:
-            os.remove(p)
-        except OSError as e:
-            console.print(f"⚠️ Не удалось удалить файл графика {p}: {e}")
+async def run_full_analysis(pair: str, strategy_key: str):
+    try:
+        strategy = registry.get(strategy_key)
+    except KeyError:
+        return {"error": f"Стратегия '{strategy_key}' не найдена."}
 
-    return final_result
+    # При деградации API модели отказываем сразу, не тратя запросы к бирже и отрисовку
+    if governor.breaker.is_open():
+        error = ModelUnavailableError(governor.breaker.retry_after())
+        return {"error": str(error), "retry_after": error.retry_after}
+
+    try:
+        current_price, frames = await fetch_market_data(pair, strategy['timeframes'])
+    except Exception as e:
+        return {"error": f"Не удалось получить цену для {pair}: {e}"}
+
+    try:
+        screened_out = await prefilter_analysis(pair, strategy, frames)
+    except ModelUnavailableError as e:
+        return {"error": str(e), "retry_after": e.retry_after}
+    if screened_out:
+        return screened_out
+
+    console.print(f"\n[bold cyan]--- Генерация идеи для {pair} ---[/bold cyan]")
+    console.print("🖼️  Создание набора графиков для анализа...")
+    chart_paths = await plot_charts(pair, frames)
+    valid_charts = [p for p in chart_paths if p]
+    if not valid_charts:
+        return {"status": "no_signal", "message": "Не удалось создать графики для анализа."}
+
+    prompt = render_prompt(strategy, symbol=pair, current_price=current_price)
+    try:
+        results = await gather_opinions(valid_charts, prompt, consensus=strategy['consensus'])
+    except ModelUnavailableError as e:
+        return {"error": str(e), "retry_after": e.retry_after}
+
+    # Графики не удаляются: они остаются в кэше отрисовки и доступны по /charts,
+    # пока их не вытеснит лимит CHART_CACHE_MAX_MB
+    return decide_signal(results, valid_charts)
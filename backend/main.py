@@ -1,47 +1,70 @@
 # backend/main.py
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles # ВАЖНО: Импортируем StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional
-import asyncio
+from datetime import datetime
+import os
+import json
+import base64
 from fastapi.concurrency import run_in_threadpool
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Локальные импорты
 import logic # Убедитесь, что logic.py находится в той же папке
-from database import async_engine, metadata, users, analyses
+import charts
+import strategies
+import jobs
+import model_backends
+from model_governor import governor, ModelUnavailableError
+from market_data import ohlcv_cache
+from response_cache import response_cache
+from prefilter import prefilter_stats
+from database import async_engine, metadata, users, analyses, AsyncSessionLocal, pool_stats, normalize_legacy_timestamps, to_naive_utc
 from auth import (
     create_access_token,
     get_current_active_user,
-    get_password_hash,
-    verify_password,
+    password_hasher,
+    PasswordHasherBusy,
+    invalidate_user,
     UserInDB,
     Token,
     get_db_session,
+    auth_cache_stats,
 )
 
 # --- Модели данных Pydantic ---
 class AnalysisResultModel(BaseModel):
+    # Поля опциональны: /history может вернуть только запрошенные колонки (?fields=...)
     id: int
-    user_id: int
-    symbol: str
-    analysis_summary: str
-    direction: str
-    entry_type: str
-    entry_price: str
-    stop_loss: float
-    take_profit: float
-    risk_reward_ratio: str
-    invalidation_hours: int
-    consensus: str
-    status: str
+    user_id: Optional[int] = None
+    symbol: Optional[str] = None
+    analysis_summary: Optional[str] = None
+    direction: Optional[str] = None
+    entry_type: Optional[str] = None
+    entry_price: Optional[str] = None
+    stop_loss: Optional[float] = None
+    take_profit: Optional[float] = None
+    risk_reward_ratio: Optional[str] = None
+    invalidation_hours: Optional[int] = None
+    consensus: Optional[str] = None
+    status: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    entry_timestamp: Optional[datetime] = None
+    closed_timestamp: Optional[datetime] = None
+    is_high_quality: Optional[bool] = None
     # Добавляем опциональные поля, которые приходят из logic.py
     confidence_score: Optional[int] = None
     chart_images: Optional[List[str]] = None
 
+# Параметры постраничной выдачи истории
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+
 
 class AnalysisRequest(BaseModel):
     pair: str
@@ -57,12 +80,11 @@ app = FastAPI(
 # --- ВАЖНО: Раздача статических файлов для графиков ---
 # Эта строка позволяет фронтенду запрашивать картинки из папки temp_charts
 # Например, по URL: http://127.0.0.1:8000/charts/setup_BTCUSDT_1h_99.png
-app.mount("/charts", StaticFiles(directory="temp_charts"), name="charts")
+os.makedirs(charts.CHARTS_DIR, exist_ok=True)
+app.mount("/charts", StaticFiles(directory=charts.CHARTS_DIR), name="charts")
 
 
 # --- Глобальные переменные и CORS ---
-active_analyses_lock = asyncio.Lock()
-active_analyses_count = 0
 origins = ["*"] # Для разработки можно оставить так, для продакшена лучше указать конкретный домен фронтенда
 app.add_middleware(
     CORSMiddleware,
@@ -70,14 +92,64 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# --- Очередь анализов ---
+async def save_analysis_result(job: jobs.Job, result: dict):
+    # Если анализ успешен и получен подтвержденный сигнал, сохраняем его в БД
+    if result.get("status") != "success":
+        return
+    insert_query = analyses.insert().values(
+        user_id=job.user_id,
+        symbol=result["symbol"],
+        analysis_summary=result["analysis_summary"],
+        direction=result["direction"],
+        entry_type=result["entry_type"],
+        entry_price=str(result.get("entry_price")) if result.get("entry_price") else "Market",
+        stop_loss=result["stop_loss"],
+        take_profit=result["take_profit"],
+        risk_reward_ratio=result["risk_reward_ratio"],
+        invalidation_hours=result["invalidation_hours"],
+        consensus=result.get("consensus", "N/A"),
+        # тут можно будет добавить и другие поля, например, confidence_score
+    )
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert_query)
+        await db.commit()
+
+# Одинаковые запросы (пара, стратегия, свеча) выполняются один раз и делят результат
+analysis_flight = jobs.SingleFlight(logic.run_full_analysis, logic.analysis_period_end)
+analysis_queue = jobs.JobQueue(analyzer=analysis_flight, on_result=save_analysis_result)
+
 # --- События жизненного цикла ---
 @app.on_event("startup")
 async def startup():
+    # Некорректная конфигурация стратегий должна остановить запуск, а не давать 400 под нагрузкой
+    strategies.registry.load()
+    strategies.registry.install_signal_handler()
+    # Неизвестный MODEL_BACKEND тоже должен остановить запуск
+    model_backends.get_backend()
     async with async_engine.begin() as conn:
         # Эта команда создает таблицы в БД, если их еще нет
         await conn.run_sync(metadata.create_all)
+        # create_all не добавляет новые индексы к уже существующим таблицам
+        for index in analyses.indexes:
+            await conn.run_sync(index.create, checkfirst=True)
+        # Старые записи SQLite без долей секунды ломают keyset-курсор истории
+        await normalize_legacy_timestamps(conn)
+    # Прогреваем пул процессов отрисовки графиков
+    await run_in_threadpool(charts.start_pool)
+    await analysis_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await analysis_queue.stop()
+    await run_in_threadpool(charts.shutdown_pool)
+    await logic.close_exchange()
+    password_hasher.shutdown()
+    response_cache.close()
+    await async_engine.dispose()
 
 # --- Эндпоинты ---
 @app.post("/login", response_model=Token)
@@ -89,90 +161,168 @@ async def login_for_access_token(
     result = await db.execute(query)
     user_in_db_tuple = result.fetchone()
 
-    # Если пользователь не найден, создаем нового
-    if not user_in_db_tuple:
-        hashed_password = get_password_hash(form_data.password)
-        insert_query = users.insert().values(username=form_data.username, hashed_password=hashed_password)
-        await db.execute(insert_query)
-        await db.commit()
-        # Повторяем запрос, чтобы получить созданного пользователя
-        result = await db.execute(query)
-        user_in_db_tuple = result.fetchone()
+    # bcrypt выполняется в отдельном пуле; при перегрузке отвечаем 429, а не морозим event loop
+    try:
+        # Если пользователь не найден, создаем нового
+        if not user_in_db_tuple:
+            hashed_password = await password_hasher.hash(form_data.password)
+            insert_query = users.insert().values(username=form_data.username, hashed_password=hashed_password)
+            await db.execute(insert_query)
+            await db.commit()
+            # Повторяем запрос, чтобы получить созданного пользователя
+            result = await db.execute(query)
+            user_in_db_tuple = result.fetchone()
 
-    user_in_db = user_in_db_tuple._asdict()
+        user_in_db = user_in_db_tuple._asdict()
+        is_valid, new_hash = await password_hasher.verify_and_update(form_data.password, user_in_db['hashed_password'])
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e), headers={"Retry-After": "1"})
 
-    if not verify_password(form_data.password, user_in_db['hashed_password']):
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Стоимость bcrypt изменилась - сохраняем пересчитанный хэш
+    if new_hash:
+        await db.execute(users.update().where(users.c.id == user_in_db['id']).values(hashed_password=new_hash))
+        await db.commit()
+        invalidate_user(user_in_db['username'])
+
     access_token = create_access_token(data={"sub": user_in_db['username']})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/analyses/active")
-async def get_active_analyses_count():
-    # Возвращает текущее количество активных анализов для отображения очереди
-    return {"active_count": active_analyses_count}
+async def get_active_analyses_count(job_id: Optional[str] = None):
+    # Состояние очереди; с job_id - еще позиция задачи и оценка времени ожидания
+    stats = analysis_queue.stats()
+    response = {"active_count": stats["queued"] + stats["running"], **stats}
+    job = analysis_queue.get(job_id) if job_id else None
+    if job is not None:
+        response.update(position=analysis_queue.position(job), eta_seconds=round(analysis_queue.eta(job), 1))
+    return response
+
+@app.get("/metrics")
+async def get_metrics():
+    # Внутренние счетчики кэшей и очередей для мониторинга
+    return {
+        "ohlcv_cache": ohlcv_cache.stats(),
+        "chart_render": charts.stats(),
+        "analysis_queue": analysis_queue.stats(),
+        "analysis_single_flight": analysis_flight.stats(),
+        "auth_cache": auth_cache_stats(),
+        "password_hasher": password_hasher.stats(),
+        "db_pool": pool_stats(),
+        "model_governor": governor.stats(),
+        "response_cache": response_cache.stats(),
+        "prefilter": prefilter_stats.stats(),
+    }
 
-@app.post("/analyze/")
+@app.post("/analyze/", status_code=status.HTTP_202_ACCEPTED)
 async def analyze_pair(
     request: AnalysisRequest,
     current_user: UserInDB = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db_session)
 ):
-    global active_analyses_count
-    
-    # Блокируем и увеличиваем счетчик активных анализов
-    async with active_analyses_lock:
-        active_analyses_count += 1
-    
+    # Неизвестную стратегию отклоняем сразу, не занимая место в очереди
     try:
-        # Запускаем тяжелую, блокирующую функцию в отдельном потоке,
-        # чтобы не замораживать основной цикл FastAPI
-        result = await run_in_threadpool(logic.run_full_analysis, request.pair, request.strategy_key)
-        
-        if result.get("error"):
-            raise HTTPException(status_code=400, detail=result["error"])
-        
-        # Если анализ успешен и получен подтвержденный сигнал, сохраняем его в БД
-        if result.get("status") == "success":
-            insert_query = analyses.insert().values(
-                user_id=current_user.id,
-                symbol=result["symbol"],
-                analysis_summary=result["analysis_summary"],
-                direction=result["direction"],
-                entry_type=result["entry_type"],
-                entry_price=str(result.get("entry_price")) if result.get("entry_price") else "Market",
-                stop_loss=result["stop_loss"],
-                take_profit=result["take_profit"],
-                risk_reward_ratio=result["risk_reward_ratio"],
-                invalidation_hours=result["invalidation_hours"],
-                consensus=result.get("consensus", "N/A"),
-                # тут можно будет добавить и другие поля, например, confidence_score
-            )
-            await db.execute(insert_query)
-            await db.commit()
-            
-        return result
-        
-    except Exception as e:
-        # Ловим любые непредвиденные ошибки
-        raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {e}")
-    finally:
-        # В любом случае (успех или ошибка) уменьшаем счетчик
-        async with active_analyses_lock:
-            active_analyses_count -= 1
-
-@app.get("/history", response_model=List[AnalysisResultModel])
+        strategies.registry.get(request.strategy_key)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Стратегия '{request.strategy_key}' не найдена.")
+    # API модели деградировало - сразу отвечаем 503, а не ставим заведомо неудачный анализ в очередь
+    if governor.breaker.is_open():
+        retry_after = governor.breaker.retry_after()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=str(ModelUnavailableError(retry_after)),
+                            headers={"Retry-After": str(int(retry_after) + 1)})
+    try:
+        job = analysis_queue.submit(request.pair, request.strategy_key, current_user.id)
+    except jobs.QueueFullError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    return analysis_queue.describe(job)
+
+def get_user_job(job_id: str, current_user: UserInDB) -> jobs.Job:
+    job = analysis_queue.get(job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Задача анализа не найдена.")
+    return job
+
+@app.get("/analyze/{job_id}")
+async def get_analysis_job(job_id: str, current_user: UserInDB = Depends(get_current_active_user)):
+    # Опрос состояния задачи; после завершения в ответе есть result или error
+    return analysis_queue.describe(get_user_job(job_id, current_user))
+
+@app.get("/analyze/{job_id}/events")
+async def stream_analysis_job(job_id: str, current_user: UserInDB = Depends(get_current_active_user)):
+    # Server-Sent Events: снимок состояния при каждом изменении и раз в несколько секунд
+    job = get_user_job(job_id, current_user)
+
+    async def event_stream():
+        async for snapshot in analysis_queue.events(job):
+            yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+def encode_history_cursor(timestamp: datetime, record_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), record_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, record_id = json.loads(raw)
+        return to_naive_utc(datetime.fromisoformat(timestamp)), int(record_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор истории.")
+
+
+@app.get("/history", response_model=List[AnalysisResultModel], response_model_exclude_unset=True)
 async def get_user_history(
+    response: Response,
+    limit: int = Query(HISTORY_DEFAULT_LIMIT, ge=1, le=HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="Значение заголовка X-Next-Cursor предыдущей страницы"),
+    symbol: Optional[str] = None,
+    signal_status: Optional[str] = Query(None, alias="status"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    fields: Optional[str] = Query(None, description="Список колонок через запятую, например id,symbol,status"),
     current_user: UserInDB = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db_session)
 ):
-    # Запрос для получения всех записей анализа для текущего пользователя
-    query = select(analyses).where(analyses.c.user_id == current_user.id).order_by(analyses.c.timestamp.desc())
-    result = await db.execute(query)
-    history_records = result.fetchall()
+    # Страница истории пользователя от новых записей к старым. Keyset-пагинация по
+    # (timestamp, id) идет по индексу ix_analyses_user_timestamp, поэтому стоимость
+    # страницы не зависит от того, сколько всего записей у пользователя.
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in analyses.c]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Неизвестные поля: {unknown}")
+        # id и timestamp нужны для курсора следующей страницы
+        columns = [analyses.c[f] for f in dict.fromkeys(["id", "timestamp", *requested])]
+    else:
+        columns = [analyses]
+
+    query = select(*columns).where(analyses.c.user_id == current_user.id)
+    if symbol:
+        query = query.where(analyses.c.symbol == symbol)
+    if signal_status:
+        query = query.where(analyses.c.status == signal_status)
+    # Колонка timestamp хранит наивное UTC: asyncpg не сравнивает его со временем с поясом
+    if date_from:
+        query = query.where(analyses.c.timestamp >= to_naive_utc(date_from))
+    if date_to:
+        query = query.where(analyses.c.timestamp < to_naive_utc(date_to))
+    if cursor:
+        query = query.where(tuple_(analyses.c.timestamp, analyses.c.id) < tuple_(*decode_history_cursor(cursor)))
+    # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+    query = query.order_by(analyses.c.timestamp.desc(), analyses.c.id.desc()).limit(limit + 1)
+
+    history_records = (await db.execute(query)).fetchall()
+    if len(history_records) > limit:
+        history_records = history_records[:limit]
+        last = history_records[-1]
+        response.headers["X-Next-Cursor"] = encode_history_cursor(last.timestamp, last.id)
     # Преобразуем каждую запись в словарь для Pydantic модели
     return [record._asdict() for record in history_records]
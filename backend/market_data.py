@@ -0,0 +1,215 @@
+# backend/market_data.py
+"""
+Общий внутрипроцессный кэш свечей (OHLCV) для всех запросов анализа.
+Данные по паре (symbol, timeframe) переиспользуются до закрытия текущей свечи,
+а устаревший буфер дополняется только новыми свечами (fetch_ohlcv с since=).
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import ccxt
+
+OHLCV_CACHE_MAX_ENTRIES = int(os.getenv("OHLCV_CACHE_MAX_ENTRIES", "512"))
+OHLCV_CACHE_MAX_BYTES = int(os.getenv("OHLCV_CACHE_MAX_MB", "32")) * 1024 * 1024
+
+# Примерный размер одной свечи в памяти: список из 6 чисел + ссылка на него
+CANDLE_ROW_BYTES = 256
+# 1970-01-01 - четверг, недельные свечи Binance открываются в понедельник
+WEEK_OFFSET_SECONDS = 4 * 24 * 60 * 60
+
+
+def timeframe_seconds(timeframe: str) -> int:
+    return int(ccxt.Exchange.parse_timeframe(timeframe))
+
+
+def next_candle_close(timeframe: str, now: float = None) -> float:
+    """Время (unix, сек) закрытия текущей свечи указанного таймфрейма."""
+    now = time.time() if now is None else now
+    if timeframe.endswith('M'):
+        months = int(timeframe[:-1] or 1)
+        current = datetime.fromtimestamp(now, tz=timezone.utc)
+        month_index = current.year * 12 + current.month - 1
+        next_index = (month_index // months + 1) * months
+        return datetime(next_index // 12, next_index % 12 + 1, 1, tzinfo=timezone.utc).timestamp()
+
+    period = timeframe_seconds(timeframe)
+    offset = WEEK_OFFSET_SECONDS if timeframe.endswith('w') else 0
+    return ((now - offset) // period + 1) * period + offset
+
+
+class OHLCVCache:
+    """LRU-кэш свечей с TTL до закрытия свечи, лимитом по памяти и счетчиками попаданий."""
+
+    def __init__(self, max_entries: int = OHLCV_CACHE_MAX_ENTRIES, max_bytes: int = OHLCV_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (symbol, timeframe) -> dict(ohlcv, limit, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.rows_refreshed = 0
+
+    def lookup(self, symbol: str, timeframe: str, limit: int):
+        """
+        Возвращает (ohlcv, None) при попадании в кэш. Если буфер устарел, но его
+        можно дополнить, возвращает (None, timestamp последней свечи в мс),
+        при полном промахе - (None, None).
+        """
+        key = (symbol, timeframe)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['limit'] < limit or not entry['ohlcv']:
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            if entry['expires_at'] <= time.time():
+                self.misses += 1
+                return None, entry['ohlcv'][-1][0]
+            self.hits += 1
+            return entry['ohlcv'][-limit:], None
+
+    def put(self, symbol: str, timeframe: str, limit: int, ohlcv: list):
+        with self._lock:
+            self._store((symbol, timeframe), limit, ohlcv)
+
+    def merge(self, symbol: str, timeframe: str, limit: int, rows: list):
+        """
+        Дописывает свежие свечи в буфер (последняя, незакрытая свеча заменяется)
+        и обрезает его до окна. Возвращает новый буфер или None, если его уже вытеснили.
+        """
+        key = (symbol, timeframe)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            buffer = entry['ohlcv']
+            cut = len(buffer)
+            while cut > 0 and buffer[cut - 1][0] >= rows[0][0]:
+                cut -= 1
+            window = max(limit, entry['limit'])
+            merged = (buffer[:cut] + rows)[-window:]
+            self._store(key, window, merged)
+            self.refreshes += 1
+            self.rows_refreshed += len(rows)
+            return merged
+
+    def _store(self, key: tuple, limit: int, ohlcv: list):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old['size']
+        size = len(ohlcv) * CANDLE_ROW_BYTES
+        if size > self.max_bytes:
+            return
+        self._entries[key] = {
+            'ohlcv': ohlcv,
+            'limit': limit,
+            'expires_at': next_candle_close(key[1]),
+            'size': size,
+        }
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted['size']
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "incremental_refreshes": self.refreshes,
+                "rows_refreshed": self.rows_refreshed,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+ohlcv_cache = OHLCVCache()
+
+
+def _incremental_limit(since: int, timeframe: str, limit: int):
+    """Сколько свечей догрузить с момента since, или None, если выгоднее скачать окно целиком."""
+    missing = int((time.time() - since / 1000) // timeframe_seconds(timeframe)) + 1
+    return missing + 1 if missing < limit else None
+
+
+def _cached_fetch_steps(symbol: str, timeframe: str, limit: int):
+    """
+    Логика кэша без ввода-вывода, общая для синхронного и асинхронного клиента:
+    генератор отдает параметры очередного exchange.fetch_ohlcv, получает через send()
+    его результат и возвращает (StopIteration.value) итоговые свечи.
+    """
+    ohlcv, since = ohlcv_cache.lookup(symbol, timeframe, limit)
+    if ohlcv is not None:
+        return ohlcv
+
+    if since is not None:
+        # Если разрыв больше окна, дешевле и надежнее скачать окно целиком
+        refresh_limit = _incremental_limit(since, timeframe, limit)
+        if refresh_limit:
+            rows = yield {"since": since, "limit": refresh_limit}
+            merged = ohlcv_cache.merge(symbol, timeframe, limit, rows) if rows else None
+            if merged is not None:
+                return merged[-limit:]
+
+    ohlcv = yield {"limit": limit}
+    ohlcv_cache.put(symbol, timeframe, limit, ohlcv)
+    return ohlcv
+
+
+def fetch_ohlcv_cached(exchange, symbol: str, timeframe: str, limit: int = 200) -> list:
+    """
+    exchange.fetch_ohlcv через общий кэш: повторные запросы внутри свечи не идут
+    на биржу, а устаревший буфер догружается только свечами с момента последней.
+    """
+    steps = _cached_fetch_steps(symbol, timeframe, limit)
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(exchange.fetch_ohlcv(symbol, timeframe=timeframe, **request))
+    except StopIteration as done:
+        return done.value
+
+
+_inflight_fetches = {}  # (symbol, timeframe, limit) -> asyncio.Task
+
+
+async def _fetch_ohlcv_async(exchange, symbol: str, timeframe: str, limit: int) -> list:
+    steps = _cached_fetch_steps(symbol, timeframe, limit)
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(await exchange.fetch_ohlcv(symbol, timeframe=timeframe, **request))
+    except StopIteration as done:
+        return done.value
+
+
+async def fetch_ohlcv_cached_async(exchange, symbol: str, timeframe: str, limit: int = 200) -> list:
+    """
+    Асинхронная версия fetch_ohlcv_cached для ccxt.async_support.
+    Одновременные промахи по одной паре/таймфрейму ждут один общий запрос к бирже.
+    """
+    key = (symbol, timeframe, limit)
+    task = _inflight_fetches.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_ohlcv_async(exchange, symbol, timeframe, limit))
+        _inflight_fetches[key] = task
+        task.add_done_callback(lambda _: _inflight_fetches.pop(key, None))
+    return await asyncio.shield(task)
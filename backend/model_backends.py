@@ -0,0 +1,307 @@
+# backend/model_backends.py
+"""
+Бэкенды модели для анализа графиков. run_full_analysis работает только через
+интерфейс ModelBackend, поэтому Gemini можно заменить локальной заглушкой
+(MODEL_BACKEND=stub) и нагружать весь конвейер без квоты и сети.
+"""
+
+import os
+import abc
+import json
+import random
+import hashlib
+import asyncio
+import threading
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from dotenv import load_dotenv
+from rich.console import Console
+
+load_dotenv()
+console = Console()
+
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "gemini")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
+
+# Настройки заглушки: задержка ответа (мс), доля ошибок, ответ и seed для воспроизводимости
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "50"))
+STUB_LATENCY_JITTER_MS = float(os.getenv("STUB_LATENCY_JITTER_MS", "0"))
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STUB_THROTTLE_RATE = float(os.getenv("STUB_THROTTLE_RATE", "0"))
+STUB_RESPONSE_FILE = os.getenv("STUB_RESPONSE_FILE")
+STUB_SEED = int(os.getenv("STUB_SEED", "42"))
+# Та же схема, что в промптах стратегий: save_analysis_result читает все эти поля
+STUB_DEFAULT_RESPONSE = {
+    "symbol": "STUB/USDT",
+    "analysis_summary": "Ответ локальной заглушки модели.",
+    "direction": "Long",
+    "entry_type": "Limit",
+    "entry_price": 100.0,
+    "entry_reason": "Ответ локальной заглушки модели.",
+    "stop_loss": 95.0,
+    "take_profit": 110.0,
+    "risk_reward_ratio": "1:2",
+    "invalidation_hours": 24,
+    "confidence_score": 7,
+}
+
+
+class ModelBlockedError(Exception):
+    """Модель отказалась отвечать (фильтры безопасности) - повторять запрос бессмысленно."""
+
+
+class ModelRateLimitError(Exception):
+    """API ограничивает частоту запросов (HTTP 429 / исчерпана квота)."""
+
+
+class MultiSampleUnsupported(Exception):
+    """Модель не умеет возвращать несколько вариантов ответа в одном запросе."""
+
+
+class ModelBackend(abc.ABC):
+    """
+    Интерфейс бэкенда: open_session готовит графики (например, загружает их один раз
+    на весь анализ), generate возвращает сырой текст ответа, close_session освобождает ресурсы.
+    Без open_session и generate бэкенд не создается (TypeError при создании, а не посреди анализа).
+    """
+
+    name = "base"
+    model_name = None
+    # Идентификатор API-ключа для лимитов частоты (не сам ключ)
+    api_key_id = "default"
+
+    @abc.abstractmethod
+    async def open_session(self, image_paths: list):
+        ...
+
+    @abc.abstractmethod
+    async def generate(self, session, prompt: str) -> str:
+        ...
+
+    # Поддерживает ли бэкенд generate_samples (несколько вариантов ответа за один запрос)
+    supports_multi_sample = False
+
+    async def generate_samples(self, session, prompt: str, samples: int) -> list:
+        """Сырые тексты нескольких вариантов ответа на один запрос."""
+        raise MultiSampleUnsupported(f"Бэкенд {self.name} не поддерживает несколько вариантов ответа.")
+
+    async def close_session(self, session):
+        pass
+
+
+# <--- GEMINI --->
+
+class ChartUploadSession:
+    """
+    Загружает графики в Gemini один раз на весь анализ и переиспользует
+    дескрипторы файлов во всех попытках консенсуса. Файлы удаляются при close().
+    """
+
+    def __init__(self, image_paths: list):
+        self.image_paths = [p for p in image_paths if p and os.path.exists(p)]
+        self._lock = threading.Lock()
+        self._uploaded = None
+        self._uploaded_bytes = 0
+        self._uses = 0
+
+    def files(self) -> list:
+        """Возвращает загруженные файлы, выполняя загрузку при первом обращении."""
+        with self._lock:
+            if self._uploaded is None:
+                self._uploaded = []
+                for path in self.image_paths:
+                    try:
+                        self._uploaded.append(genai.upload_file(path=path))
+                        self._uploaded_bytes += os.path.getsize(path)
+                    except Exception as e:
+                        console.print(f"❌ Не удалось загрузить файл {path}: {e}")
+            if self._uploaded:
+                self._uses += 1
+            return list(self._uploaded)
+
+    def stats(self) -> dict:
+        """Сколько байт и сетевых запросов (upload + delete) сэкономлено повторным использованием."""
+        with self._lock:
+            reuses = max(self._uses - 1, 0)
+            files_count = len(self._uploaded or [])
+            return {
+                "files": files_count,
+                "uses": self._uses,
+                "bytes_uploaded": self._uploaded_bytes,
+                "bytes_saved": self._uploaded_bytes * reuses,
+                "round_trips_saved": 2 * files_count * reuses,
+            }
+
+    def close(self):
+        with self._lock:
+            uploaded, self._uploaded = self._uploaded or [], []
+        for f in uploaded:
+            try:
+                genai.delete_file(f.name)
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class GeminiBackend(ModelBackend):
+    name = "gemini"
+    supports_multi_sample = True
+
+    def __init__(self, model_name: str = GEMINI_MODEL):
+        api_key = os.getenv("GOOGLE_API_KEY") or ""
+        genai.configure(api_key=api_key)
+        self.api_key_id = hashlib.sha256(api_key.encode()).hexdigest()[:12]
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self.safety_settings = {k: 'BLOCK_NONE' for k in ['HARM_CATEGORY_HARASSMENT', 'HARM_CATEGORY_HATE_SPEECH', 'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'HARM_CATEGORY_DANGEROUS_CONTENT']}
+
+    async def open_session(self, image_paths: list) -> ChartUploadSession:
+        # Загрузка ленивая: файлы уходят в Gemini только при первом generate
+        return ChartUploadSession(image_paths)
+
+    async def generate(self, session: ChartUploadSession, prompt: str) -> str:
+        uploaded_files = await asyncio.to_thread(session.files)
+        if not uploaded_files:
+            raise ModelBlockedError("Нет загруженных графиков для анализа.")
+        try:
+            response = await self.model.generate_content_async([prompt] + uploaded_files, safety_settings=self.safety_settings)
+        except (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests) as e:
+            raise ModelRateLimitError(str(e)) from e
+        if not response.parts:
+            raise ModelBlockedError("Ответ от Gemini был заблокирован.")
+        return response.text
+
+    async def generate_samples(self, session: ChartUploadSession, prompt: str, samples: int) -> list:
+        uploaded_files = await asyncio.to_thread(session.files)
+        if not uploaded_files:
+            raise ModelBlockedError("Нет загруженных графиков для анализа.")
+        config = genai.GenerationConfig(candidate_count=samples)
+        try:
+            response = await self.model.generate_content_async([prompt] + uploaded_files, generation_config=config,
+                                                               safety_settings=self.safety_settings)
+        except (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests) as e:
+            raise ModelRateLimitError(str(e)) from e
+        except google_exceptions.InvalidArgument as e:
+            if "candidate" not in str(e).lower():
+                raise
+            # Модель не принимает candidate_count > 1: запоминаем и больше не пробуем
+            self.supports_multi_sample = False
+            raise MultiSampleUnsupported(str(e)) from e
+        # Заблокированные фильтрами варианты приходят без частей - пропускаем их
+        texts = ["".join(part.text for part in c.content.parts) for c in response.candidates if c.content.parts]
+        if not texts:
+            raise ModelBlockedError("Все варианты ответа Gemini были заблокированы.")
+        return texts
+
+    async def close_session(self, session: ChartUploadSession):
+        await asyncio.to_thread(session.close)
+
+
+# <--- ЛОКАЛЬНАЯ ЗАГЛУШКА --->
+
+class StubSession:
+    def __init__(self, image_paths: list):
+        self.image_paths = list(image_paths)
+        self.calls = 0
+
+    def stats(self) -> dict:
+        return {"files": len(self.image_paths), "uses": self.calls, "bytes_uploaded": 0,
+                "bytes_saved": 0, "round_trips_saved": 0}
+
+
+class StubBackendError(Exception):
+    pass
+
+
+class StubBackend(ModelBackend):
+    """
+    Детерминированная замена модели для нагрузочных тестов: заданный JSON-ответ
+    (или список ответов по кругу), задержка, доля ошибок и ответов 429. Сеть не используется.
+    """
+
+    name = "stub"
+    model_name = "stub"
+    supports_multi_sample = True
+
+    def __init__(self, responses: list = None, latency_ms: float = STUB_LATENCY_MS,
+                 jitter_ms: float = STUB_LATENCY_JITTER_MS, error_rate: float = STUB_ERROR_RATE,
+                 throttle_rate: float = STUB_THROTTLE_RATE, seed: int = STUB_SEED):
+        if responses is None:
+            responses = [STUB_DEFAULT_RESPONSE]
+            if STUB_RESPONSE_FILE:
+                with open(STUB_RESPONSE_FILE, 'r', encoding='utf-8') as f:
+                    loaded = json.load(f)
+                responses = loaded if isinstance(loaded, list) else [loaded]
+        self.responses = responses
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self.samples = 0
+
+    async def open_session(self, image_paths: list) -> StubSession:
+        return StubSession(image_paths)
+
+    async def generate(self, session: StubSession, prompt: str) -> str:
+        return (await self.generate_samples(session, prompt, 1))[0]
+
+    async def generate_samples(self, session: StubSession, prompt: str, samples: int) -> list:
+        # Один запрос с одной задержкой и одним шансом ошибки, но samples вариантов ответа
+        self.calls += 1
+        session.calls += 1
+        latency = max(self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms), 0.0)
+        await asyncio.sleep(latency / 1000)
+        roll = self._random.random()
+        if roll < self.throttle_rate:
+            self.errors += 1
+            raise ModelRateLimitError("Сымитированный ответ 429")
+        if roll < self.throttle_rate + self.error_rate:
+            self.errors += 1
+            raise StubBackendError("Сымитированная ошибка модели")
+        texts = []
+        for _ in range(samples):
+            response = self.responses[self.samples % len(self.responses)]
+            self.samples += 1
+            # Как и настоящая модель, отвечаем текстом с блоком ```json
+            texts.append(f"```json\n{json.dumps(response, ensure_ascii=False)}\n```")
+        return texts
+
+
+BACKENDS = {"gemini": GeminiBackend, "stub": StubBackend}
+
+_backends = {}  # имя модели -> бэкенд
+
+
+def make_backend(model_name: str = GEMINI_MODEL, stub_responses: list = None) -> ModelBackend:
+    """
+    Единая фабрика бэкендов по MODEL_BACKEND. model_name - модель Gemini,
+    stub_responses - ответы заглушки, если их формат отличается от сигнала.
+    """
+    if MODEL_BACKEND not in BACKENDS:
+        raise ValueError(f"Неизвестный MODEL_BACKEND '{MODEL_BACKEND}', доступны: {sorted(BACKENDS)}")
+    if MODEL_BACKEND == "stub":
+        return StubBackend(stub_responses)
+    return BACKENDS[MODEL_BACKEND](model_name)
+
+
+def get_backend(model_name: str = GEMINI_MODEL, stub_responses: list = None) -> ModelBackend:
+    """Бэкенд процесса для модели model_name (создается при первом обращении)."""
+    if model_name not in _backends:
+        backend = _backends[model_name] = make_backend(model_name, stub_responses)
+        console.print(f"🧠 Бэкенд модели: {backend.name} ({backend.model_name})")
+    return _backends[model_name]
+
+
+def set_backend(backend: ModelBackend, model_name: str = GEMINI_MODEL):
+    """Подменяет бэкенд процесса (бенчмарки, локальные прогоны)."""
+    _backends[model_name] = backend
@@ -0,0 +1,228 @@
+# backend/model_governor.py
+"""
+Общий регулятор вызовов модели: ограничение частоты (token bucket на каждый API-ключ),
+ограничение числа одновременных генераций, повторы с экспоненциальной паузой и
+джиттером и circuit breaker, который при деградации API сразу отказывает, а не
+добавляет нагрузку повторами всех параллельных запросов.
+"""
+
+import os
+import math
+import time
+import random
+import asyncio
+
+from rich.console import Console
+
+from model_backends import ModelBlockedError, ModelRateLimitError, MultiSampleUnsupported
+
+console = Console()
+
+MODEL_MAX_CONCURRENCY = max(1, int(os.getenv("MODEL_MAX_CONCURRENCY", "8")))
+# Запросов в минуту на один API-ключ и допустимый всплеск
+MODEL_RATE_PER_MINUTE = float(os.getenv("MODEL_RATE_PER_MINUTE", "60"))
+MODEL_RATE_BURST = int(os.getenv("MODEL_RATE_BURST", "10"))
+# Число попыток, включая первую: меньше одной быть не может
+MODEL_MAX_RETRIES = max(1, int(os.getenv("MODEL_MAX_RETRIES", "3")))
+MODEL_BACKOFF_BASE = float(os.getenv("MODEL_BACKOFF_BASE", "1"))
+MODEL_BACKOFF_MAX = float(os.getenv("MODEL_BACKOFF_MAX", "30"))
+# Сколько ошибок подряд размыкают цепь и через сколько секунд пробовать снова
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class ModelUnavailableError(Exception):
+    """API модели деградировало (цепь разомкнута) - запрос отклонен без обращения к нему."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Модель временно недоступна, повторите через {math.ceil(retry_after)} сек.")
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, burst: int):
+        if rate_per_sec <= 0:
+            raise ValueError(f"Лимит частоты должен быть положительным, получено {rate_per_sec} запросов/с")
+        self.rate = rate_per_sec
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Берет токен, при необходимости дожидаясь его. Возвращает время ожидания (сек)."""
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # Ушли в минус - ждем, пока долг восполнится; очередь за блокировкой сохраняет порядок
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if wait:
+                await asyncio.sleep(wait)
+            return wait
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._trial = None  # asyncio.Event пробного запроса в состоянии half_open
+
+    def retry_after(self) -> float:
+        return max(self.opened_at + self.cooldown - time.monotonic(), 0.0)
+
+    def is_open(self) -> bool:
+        return self.state == OPEN and self.retry_after() > 0
+
+    async def acquire(self) -> bool:
+        """
+        Пропускает запрос или бросает ModelUnavailableError. После паузы пропускает один
+        пробный запрос (возвращает True), остальные ждут его исхода.
+        """
+        while True:
+            if self.state == CLOSED:
+                return False
+            if self.is_open():
+                raise ModelUnavailableError(self.retry_after())
+            if self._trial is None:
+                self.state = HALF_OPEN
+                self._trial = asyncio.Event()
+                return True
+            await self._trial.wait()
+
+    def release_trial(self):
+        if self._trial is not None:
+            self._trial.set()
+            self._trial = None
+
+    def record_success(self):
+        if self.state != CLOSED:
+            console.print("🟢 API модели восстановилось, цепь замкнута.")
+        self.state = CLOSED
+        self.failures = 0
+        self.release_trial()
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state != OPEN:
+                self.opens += 1
+                console.print(f"🔴 API модели деградировало ({self.failures} ошибок подряд), "
+                              f"цепь разомкнута на {self.cooldown:.0f} сек.")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self.release_trial()
+
+
+class ModelGovernor:
+    def __init__(self, concurrency: int = MODEL_MAX_CONCURRENCY, rate_per_minute: float = MODEL_RATE_PER_MINUTE,
+                 burst: int = MODEL_RATE_BURST, max_retries: int = MODEL_MAX_RETRIES,
+                 backoff_base: float = MODEL_BACKOFF_BASE, backoff_max: float = MODEL_BACKOFF_MAX,
+                 breaker: CircuitBreaker = None):
+        # Корзины создаются лениво, поэтому проверяем лимит сразу, а не при первом запросе
+        if rate_per_minute <= 0:
+            raise ValueError(f"MODEL_RATE_PER_MINUTE должен быть положительным, получено {rate_per_minute}")
+        self.concurrency = concurrency
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_retries = max(1, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._buckets = {}  # API-ключ -> TokenBucket
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        self.failures = 0
+        self.rejected = 0
+        self.rate_limit_wait = 0.0
+
+    def _bucket(self, key: str) -> TokenBucket:
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(self.rate_per_minute / 60, self.burst)
+        return self._buckets[key]
+
+    def backoff(self, attempt: int) -> float:
+        """Экспоненциальная пауза с полным джиттером, чтобы повторы не шли волной."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def call(self, fn, key: str = "default"):
+        """
+        Выполняет корутину fn() с лимитами и повторами. ModelBlockedError и
+        MultiSampleUnsupported не повторяются;
+        при разомкнутой цепи сразу бросается ModelUnavailableError.
+        """
+        for attempt in range(self.max_retries):
+            try:
+                is_trial = await self.breaker.acquire()
+            except ModelUnavailableError:
+                self.rejected += 1
+                raise
+            # Исход пробного запроса: пока он не записан, любой выход (в том числе отмена
+            # в ожидании лимита частоты или семафора) освобождает пробный слот в finally
+            settled = False
+            try:
+                self.rate_limit_wait += await self._bucket(key).acquire()
+                async with self._semaphore:
+                    self.in_flight += 1
+                    self.calls += 1
+                    try:
+                        result = await fn()
+                    except (ModelBlockedError, MultiSampleUnsupported):
+                        # Модель ответила - API исправно, ответ просто отфильтрован
+                        self.breaker.record_success()
+                        settled = True
+                        raise
+                    except Exception as e:
+                        self.failures += 1
+                        self.breaker.record_failure()
+                        settled = True
+                        if isinstance(e, ModelRateLimitError):
+                            self.throttles += 1
+                        if attempt == self.max_retries - 1:
+                            raise
+                        delay = self.backoff(attempt)
+                        console.print(f"🟡 Ошибка API (попытка {attempt + 1}/{self.max_retries}): {e}. "
+                                      f"Повтор через {delay:.1f} сек.")
+                    else:
+                        self.breaker.record_success()
+                        settled = True
+                        return result
+                    finally:
+                        self.in_flight -= 1
+            finally:
+                # Отмененная попытка ничего не говорит о здоровье API
+                if is_trial and not settled:
+                    self.breaker.release_trial()
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+            "calls": self.calls,
+            "retries": self.retries,
+            "throttles": self.throttles,
+            "failures": self.failures,
+            "rejected_by_breaker": self.rejected,
+            "rate_limit_wait_sec": round(self.rate_limit_wait, 2),
+            "breaker": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+                "opens": self.breaker.opens,
+                "retry_after": round(self.breaker.retry_after(), 1) if self.breaker.state == OPEN else 0.0,
+            },
+        }
+
+
+governor = ModelGovernor()
@@ -0,0 +1,152 @@
+# backend/prefilter.py
+"""
+Дешевый предварительный фильтр перед дорогим анализом нескольких графиков.
+Первая ступень - индикаторы по уже загруженным свечам (ADX, расширение полос
+Боллинджера, экстремумы RSI) сразу по всем таймфреймам: если рынок во всех них
+во флэте, анализ заканчивается no_signal без отрисовки, загрузки графиков и
+запросов к основной модели. Вторая, необязательная ступень - один график и
+быстрая модель (PREFILTER_MODEL), которая отвечает только "есть ли сетап".
+"""
+
+import os
+import math
+import threading
+
+import numpy as np
+from rich.console import Console
+
+import indicators
+from model_backends import ModelBackend, get_backend
+
+console = Console()
+
+# Общий выключатель поверх настроек стратегий
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() in ("1", "true", "yes")
+PREFILTER_MODEL = os.getenv("PREFILTER_MODEL", "gemini-2.5-flash-lite")
+# Ответ заглушки (MODEL_BACKEND=stub) в формате промпта фильтра
+STUB_SCREENING_RESPONSE = {"setup": True, "reason": "Ответ локальной заглушки фильтра."}
+# Сколько последних значений ширины полос берется за "обычную" ширину
+BB_WIDTH_WINDOW = 50
+RSI_LENGTH, BB_LENGTH, BB_STD, ADX_LENGTH = 14, 20, 2, 14
+
+
+class Verdict:
+    """Решение фильтра: passed=False означает "сетапа нет, дорогой анализ не нужен"."""
+
+    def __init__(self, passed: bool, stage: str, reason: str, features: dict = None):
+        self.passed = passed
+        self.stage = stage
+        self.reason = reason
+        self.features = features or {}
+
+    def as_dict(self) -> dict:
+        return {"passed": self.passed, "stage": self.stage, "reason": self.reason, "features": self.features}
+
+
+def _rounded(value: float, digits: int = 2):
+    return None if math.isnan(value) else round(float(value), digits)
+
+
+def frame_features(frames: dict) -> dict:
+    """
+    Индикаторы последней свечи каждого таймфрейма: {timeframe: {adx, rsi, bb_expansion}}.
+    Ряды всех таймфреймов считаются одной матрицей (по длине самого короткого).
+    bb_expansion - текущая ширина полос относительно медианной за BB_WIDTH_WINDOW свечей.
+    """
+    frames = {tf: ohlcv for tf, ohlcv in frames.items() if ohlcv}
+    if not frames:
+        return {}
+    data = [np.asarray(ohlcv, dtype=np.float64).reshape(-1, 6) for ohlcv in frames.values()]
+    highs = indicators.stack([d[:, 2] for d in data])
+    lows = indicators.stack([d[:, 3] for d in data])
+    closes = indicators.stack([d[:, 4] for d in data])
+
+    adx = indicators.adx(highs, lows, closes, ADX_LENGTH)[:, -1]
+    rsi = indicators.rsi(closes, RSI_LENGTH)[:, -1]
+    upper, lower = indicators.bbands(closes, BB_LENGTH, BB_STD)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        width = (upper - lower) / ((upper + lower) / 2)
+        usual = np.nanmedian(width[:, -BB_WIDTH_WINDOW:], axis=-1)
+        expansion = width[:, -1] / usual
+
+    return {
+        tf: {"adx": _rounded(adx[i]), "rsi": _rounded(rsi[i]), "bb_expansion": _rounded(expansion[i])}
+        for i, tf in enumerate(frames)
+    }
+
+
+def _is_active(features: dict, settings: dict) -> bool:
+    """Таймфрейм не во флэте: сильный тренд, экстремум RSI или расширение волатильности."""
+    adx, rsi, expansion = features["adx"], features["rsi"], features["bb_expansion"]
+    if adx is None or rsi is None or expansion is None:
+        # Недостаточно данных - решение оставляем основной модели
+        return True
+    return (adx >= settings["adx_min"]
+            or rsi <= settings["rsi_low"] or rsi >= settings["rsi_high"]
+            or expansion >= settings["bb_expansion_min"])
+
+
+def screen_numeric(settings: dict, frames: dict) -> Verdict:
+    features = frame_features(frames)
+    if not features:
+        return Verdict(True, "indicators", "Нет свечей для предварительной оценки.")
+    active = [tf for tf, values in features.items() if _is_active(values, settings)]
+    # Таймфреймы без свечей не участвуют: порог не может быть больше числа оцененных
+    required = min(settings["min_active"], len(features))
+    if len(active) >= required:
+        return Verdict(True, "indicators", f"Активные таймфреймы: {', '.join(active)}.", features)
+    return Verdict(False, "indicators",
+                   f"Флэт: активных таймфреймов {len(active)} из {len(features)} при минимуме {required}; "
+                   f"на остальных слабый тренд (ADX < {settings['adx_min']}), узкие полосы Боллинджера "
+                   f"и нейтральный RSI.", features)
+
+
+def get_screening_backend() -> ModelBackend:
+    """Быстрая модель второй ступени из общей фабрики; заглушка всегда видит сетап."""
+    return get_backend(PREFILTER_MODEL, stub_responses=[STUB_SCREENING_RESPONSE])
+
+
+class PrefilterStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.screened = 0
+        self.passed = 0
+        self.rejected = {"indicators": 0, "model": 0}
+        self.model_checks = 0
+        self.model_errors = 0
+        self.expensive_calls_saved = 0
+        self.charts_skipped = 0
+
+    def record(self, verdict: Verdict, expensive_calls: int, charts_skipped: int):
+        """expensive_calls/charts_skipped - во что обошелся бы анализ, если фильтр его отсек."""
+        with self._lock:
+            self.screened += 1
+            if verdict.passed:
+                self.passed += 1
+                return
+            self.rejected[verdict.stage] = self.rejected.get(verdict.stage, 0) + 1
+            self.expensive_calls_saved += expensive_calls
+            self.charts_skipped += charts_skipped
+
+    def record_model_check(self, failed: bool = False):
+        with self._lock:
+            self.model_checks += 1
+            self.model_errors += int(failed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            rejected = sum(self.rejected.values())
+            return {
+                "enabled": PREFILTER_ENABLED,
+                "screened": self.screened,
+                "passed": self.passed,
+                "rejected": dict(self.rejected),
+                "reject_rate": round(rejected / self.screened, 4) if self.screened else 0.0,
+                "model_checks": self.model_checks,
+                "model_errors": self.model_errors,
+                "expensive_calls_saved": self.expensive_calls_saved,
+                "charts_skipped": self.charts_skipped,
+            }
+
+
+prefilter_stats = PrefilterStats()
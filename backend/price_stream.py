@@ -0,0 +1,312 @@
+# backend/price_stream.py
+"""
+Потоковый режим трекера (TRACKER_MODE=stream). Вместо опроса fetch_tickers держим
+WebSocket-подписку на сделки только тех символов, по которым есть отслеживаемые
+сигналы, и для каждого символа - отсортированные индексы уровней (вход, SL, TP).
+На каждый тик бинарным поиском находятся только пересеченные уровни.
+"""
+
+import os
+import json
+import heapq
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta, timezone
+
+import websockets
+from sqlalchemy import select
+
+from database import analyses, async_engine
+from tracker import TRACKED_STATUSES, apply_transitions, _from_ms
+from shards import start_leases
+
+# Поток сделок Binance; для локального прогона - адрес replay_feed.py (ws://localhost:8765)
+PRICE_STREAM_URL = os.getenv("PRICE_STREAM_URL", "wss://stream.binance.com:9443/ws")
+PRICE_STREAM_CHANNEL = os.getenv("PRICE_STREAM_CHANNEL", "aggTrade")
+# Как часто (сек) подтягивать новые сигналы из БД и записывать накопленные переходы
+STREAM_RESYNC_INTERVAL = float(os.getenv("STREAM_RESYNC_INTERVAL", "15"))
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "1"))
+# Как часто (сек) печатать счетчики потока (0 - не печатать)
+STREAM_STATS_INTERVAL = float(os.getenv("STREAM_STATS_INTERVAL", "60"))
+STREAM_RECONNECT_MAX_DELAY = 30.0
+
+# Уровни, срабатывающие при падении цены до уровня (цена <= level) и при росте (цена >= level)
+BELOW, ABOVE = "below", "above"
+
+
+def stream_name(symbol: str) -> str:
+    return f"{symbol.replace('/', '').lower()}@{PRICE_STREAM_CHANNEL}"
+
+
+class TriggerIndex:
+    """
+    Уровни срабатывания одного символа в двух отсортированных списках (level, signal_id, kind).
+    Поиск пересеченных уровней - O(log n + k), где k - число сработавших.
+    """
+
+    def __init__(self):
+        self.levels = {BELOW: [], ABOVE: []}
+        self._by_signal = {}  # signal_id -> [(сторона, элемент)]
+
+    def __len__(self):
+        return len(self._by_signal)
+
+    def add(self, side: str, level: float, signal_id: int, kind: str):
+        item = (level, signal_id, kind)
+        insort(self.levels[side], item)
+        self._by_signal.setdefault(signal_id, []).append((side, item))
+
+    def remove(self, signal_id: int):
+        for side, item in self._by_signal.pop(signal_id, []):
+            levels = self.levels[side]
+            i = bisect_left(levels, item)
+            if i < len(levels) and levels[i] == item:
+                del levels[i]
+
+    def crossed(self, price: float) -> list:
+        """Все (signal_id, kind), чьи уровни пересечены ценой price."""
+        below = self.levels[BELOW]
+        above = self.levels[ABOVE]
+        hits = below[bisect_left(below, (price,)):] + above[:bisect_right(above, (price, float('inf')))]
+        return [(signal_id, kind) for _, signal_id, kind in hits]
+
+
+class StreamTracker:
+    def __init__(self, feed_url: str = PRICE_STREAM_URL, engine=async_engine, leases=None):
+        self.feed_url = feed_url
+        self.engine = engine
+        self.leases = leases  # ShardLeases: отслеживать только символы своих шардов
+        self.signals = {}     # signal_id -> состояние отслеживаемого сигнала
+        self.indexes = {}     # symbol -> TriggerIndex
+        self.expiry = []      # куча (время истечения в мс, signal_id)
+        self.pending = {}     # переходы, еще не записанные в БД
+        self.expected = {}    # signal_id -> статус в БД, из которого выполняется переход
+        self.subscribed = set()
+        self._symbols = {}    # 'BTCUSDT' -> 'BTC/USDT'
+        self._ws = None
+        self._request_id = 0
+        self.ticks = 0
+        self.fired = 0
+
+    # --- Индексы уровней ---
+
+    def track(self, row):
+        signal = {
+            "id": row.id,
+            "symbol": row.symbol,
+            "direction": row.direction,
+            "status": row.status,
+            "db_status": row.status,
+            "entry_price": row.entry_price,
+            "stop_loss": row.stop_loss,
+            "take_profit": row.take_profit,
+            "expires_at": int((row.timestamp.replace(tzinfo=timezone.utc)
+                               + timedelta(hours=row.invalidation_hours)).timestamp() * 1000),
+        }
+        self.signals[row.id] = signal
+        self._symbols[row.symbol.replace('/', '').upper()] = row.symbol
+        self._arm(signal)
+        if signal["status"] == 'active':
+            heapq.heappush(self.expiry, (signal["expires_at"], row.id))
+
+    def _arm(self, signal: dict):
+        index = self.indexes.setdefault(signal["symbol"], TriggerIndex())
+        is_long = signal["direction"] == 'Long'
+        if signal["status"] == 'active':
+            # Рыночные входы по цене не активируются - только истекают, как и в режиме ticker
+            if signal["entry_price"] != 'Market':
+                index.add(BELOW if is_long else ABOVE, float(signal["entry_price"]), signal["id"], 'entry')
+        else:
+            index.add(ABOVE if is_long else BELOW, signal["take_profit"], signal["id"], 'take_profit')
+            index.add(BELOW if is_long else ABOVE, signal["stop_loss"], signal["id"], 'stop_loss')
+
+    def untrack(self, signal_id: int):
+        signal = self.signals.pop(signal_id, None)
+        if signal is None:
+            return
+        index = self.indexes.get(signal["symbol"])
+        if index is not None:
+            index.remove(signal_id)
+            if not len(index):
+                del self.indexes[signal["symbol"]]
+
+    def _transition(self, signal_id: int, **changes):
+        self.expected.setdefault(signal_id, self.signals[signal_id]["db_status"])
+        self.pending.setdefault(signal_id, {}).update(changes)
+        self.fired += 1
+
+    def on_tick(self, symbol: str, price: float, ts_ms: int):
+        """Обрабатывает одну сделку: срабатывают только сигналы с пересеченными уровнями."""
+        self.ticks += 1
+        index = self.indexes.get(symbol)
+        if index is None:
+            return
+        for signal_id, kind in index.crossed(price):
+            signal = self.signals.get(signal_id)
+            if signal is None:
+                continue
+            if kind == 'entry':
+                if ts_ms >= signal["expires_at"]:
+                    continue  # сигнал уже истек, его закроет expire_due
+                print(f"✅ Сигнал #{signal_id} ({symbol}) АКТИВИРОВАН по цене {price}")
+                self._transition(signal_id, status='activated', entry_timestamp=_from_ms(ts_ms))
+                index.remove(signal_id)
+                signal["status"] = 'activated'
+                self._arm(signal)
+            else:
+                icon = "🎯 ТЕЙК-ПРОФИТ" if kind == 'take_profit' else "🛡️ СТОП-ЛОСС"
+                print(f"{icon} для сигнала #{signal_id} ({symbol}) по цене {price}")
+                self._transition(signal_id, status=f"{kind}_hit", closed_timestamp=_from_ms(ts_ms))
+                self.untrack(signal_id)
+
+    def expire_due(self, now_ms: int):
+        while self.expiry and self.expiry[0][0] <= now_ms:
+            expires_at, signal_id = heapq.heappop(self.expiry)
+            signal = self.signals.get(signal_id)
+            if signal is None or signal["status"] != 'active':
+                continue
+            print(f"⌛ Сигнал #{signal_id} ({signal['symbol']}) ИСТЕК по времени")
+            self._transition(signal_id, status='expired', closed_timestamp=_from_ms(expires_at))
+            self.untrack(signal_id)
+
+    # --- Синхронизация с БД ---
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        expected, self.expected = self.expected, {}
+        try:
+            async with self.engine.begin() as conn:
+                await apply_transitions(conn, pending, expected)
+        except Exception:
+            # Вернем переходы, чтобы записать их в следующий раз
+            for signal_id, changes in pending.items():
+                self.pending[signal_id] = {**changes, **self.pending.get(signal_id, {})}
+                self.expected[signal_id] = expected[signal_id]
+            raise
+        for signal_id, changes in pending.items():
+            if signal_id in self.signals:
+                self.signals[signal_id]["db_status"] = changes["status"]
+
+    async def resync(self):
+        """Подхватывает новые сигналы и забывает закрытые в БД кем-то еще."""
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(
+                select(analyses).where(analyses.c.status.in_(TRACKED_STATUSES))
+            )).fetchall()
+
+        seen = set()
+        for row in rows:
+            if self.leases is not None and not self.leases.owns(row.symbol):
+                continue
+            seen.add(row.id)
+            if row.id in self.pending:
+                continue
+            known = self.signals.get(row.id)
+            if known is not None and known["status"] == row.status:
+                continue
+            self.untrack(row.id)
+            self.track(row)
+        for signal_id in [s for s in self.signals if s not in seen and s not in self.pending]:
+            self.untrack(signal_id)
+
+    # --- Подписки ---
+
+    async def _send(self, method: str, symbols: set):
+        self._request_id += 1
+        await self._ws.send(json.dumps({
+            "method": method,
+            "params": sorted(stream_name(s) for s in symbols),
+            "id": self._request_id,
+        }))
+
+    async def sync_subscriptions(self):
+        if self._ws is None:
+            return
+        wanted = set(self.indexes)
+        added, removed = wanted - self.subscribed, self.subscribed - wanted
+        if added:
+            await self._send("SUBSCRIBE", added)
+        if removed:
+            await self._send("UNSUBSCRIBE", removed)
+        if added or removed:
+            print(f"Подписки обновлены: +{sorted(added)} -{sorted(removed)}")
+        self.subscribed = wanted
+
+    def handle_message(self, raw: str):
+        message = json.loads(raw)
+        data = message.get("data", message)  # комбинированные потоки оборачивают событие в data
+        if data.get("e") not in ("aggTrade", "trade"):
+            return
+        symbol = self._symbols.get(data["s"])
+        if symbol is not None:
+            self.on_tick(symbol, float(data["p"]), int(data["T"]))
+
+    # --- Основной цикл ---
+
+    async def _housekeeping(self):
+        last_resync = last_stats = asyncio.get_running_loop().time()
+        while True:
+            await asyncio.sleep(STREAM_FLUSH_INTERVAL)
+            try:
+                self.expire_due(int(datetime.now(timezone.utc).timestamp() * 1000))
+                await self.flush()
+                now = asyncio.get_running_loop().time()
+                if now - last_resync >= STREAM_RESYNC_INTERVAL:
+                    last_resync = now
+                    await self.resync()
+                await self.sync_subscriptions()
+                if STREAM_STATS_INTERVAL and now - last_stats >= STREAM_STATS_INTERVAL:
+                    last_stats = now
+                    print(f"📊 Потоковый трекер: {self.stats()}")
+            except Exception as e:
+                print(f"Ошибка синхронизации потокового трекера: {e}")
+
+    async def run(self):
+        print(f"🚀 Потоковый трекер запущен: {self.feed_url}")
+        await self.resync()
+        housekeeping = asyncio.create_task(self._housekeeping())
+        delay = 1.0
+        try:
+            while True:
+                try:
+                    async with websockets.connect(self.feed_url, ping_interval=20) as ws:
+                        self._ws, self.subscribed, delay = ws, set(), 1.0
+                        await self.sync_subscriptions()
+                        async for raw in ws:
+                            self.handle_message(raw)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Поток цен отключился: {e}. Переподключение через {delay:.0f} сек.")
+                finally:
+                    self._ws = None
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, STREAM_RECONNECT_MAX_DELAY)
+        finally:
+            housekeeping.cancel()
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "signals": len(self.signals),
+            "symbols": len(self.indexes),
+            "subscribed": len(self.subscribed),
+            "ticks": self.ticks,
+            "fired": self.fired,
+            "pending_writes": len(self.pending),
+        }
+
+
+async def run_stream_tracker():
+    leases = await start_leases()
+    try:
+        await StreamTracker(leases=leases).run()
+    finally:
+        if leases is not None:
+            await leases.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_stream_tracker())
@@ -0,0 +1,109 @@
+# backend/replay_feed.py
+"""
+Локальный сервер потока цен для проверки потокового трекера без биржи.
+Понимает SUBSCRIBE/UNSUBSCRIBE в формате Binance и проигрывает сделки
+из файла JSON Lines ({"symbol": "BTC/USDT", "price": 65000.5, "time": 1717000000000})
+или случайное блуждание для символов из --synthetic.
+
+    python replay_feed.py ticks.jsonl --speed 60
+    python replay_feed.py --synthetic BTC/USDT:65000 ETH/USDT:3500
+    PRICE_STREAM_URL=ws://localhost:8765 TRACKER_MODE=stream python tracker.py
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import websockets
+
+from price_stream import stream_name
+
+
+def load_ticks(path: str) -> list:
+    with open(path, 'r', encoding='utf-8') as f:
+        ticks = [json.loads(line) for line in f if line.strip()]
+    return sorted(ticks, key=lambda t: t["time"])
+
+
+def synthetic_ticks(specs: list, count: int, step_ms: int, volatility: float) -> list:
+    now = int(time.time() * 1000)
+    ticks = []
+    for spec in specs:
+        symbol, price = spec.rsplit(':', 1)
+        price = float(price)
+        for i in range(count):
+            price *= 1 + random.gauss(0, volatility)
+            ticks.append({"symbol": symbol, "price": round(price, 8), "time": now + i * step_ms})
+    return sorted(ticks, key=lambda t: t["time"])
+
+
+def trade_message(tick: dict) -> str:
+    return json.dumps({
+        "e": "aggTrade",
+        "E": tick["time"],
+        "s": tick["symbol"].replace('/', '').upper(),
+        "p": str(tick["price"]),
+        "q": "1",
+        "T": tick["time"],
+    })
+
+
+async def serve_connection(ws, ticks: list, speed: float):
+    """Каждое подключение получает свое проигрывание с начала, только по подписанным потокам."""
+    streams = set()
+
+    async def read_commands():
+        async for raw in ws:
+            command = json.loads(raw)
+            params = set(command.get("params", []))
+            if command.get("method") == "SUBSCRIBE":
+                streams.update(params)
+            elif command.get("method") == "UNSUBSCRIBE":
+                streams.difference_update(params)
+            await ws.send(json.dumps({"result": None, "id": command.get("id")}))
+
+    reader = asyncio.create_task(read_commands())
+    try:
+        previous = None
+        for tick in ticks:
+            if previous is not None and speed > 0:
+                await asyncio.sleep(max(tick["time"] - previous, 0) / 1000 / speed)
+            previous = tick["time"]
+            if stream_name(tick["symbol"]) in streams:
+                await ws.send(trade_message(tick))
+        print(f"Проигрывание завершено ({len(ticks)} сделок)")
+        await reader
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        reader.cancel()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Локальный replay-сервер потока цен")
+    parser.add_argument("ticks_file", nargs="?", help="файл JSON Lines со сделками")
+    parser.add_argument("--synthetic", nargs="*", default=[], metavar="SYMBOL:PRICE")
+    parser.add_argument("--count", type=int, default=10000, help="сделок на символ для --synthetic")
+    parser.add_argument("--step-ms", type=int, default=1000)
+    parser.add_argument("--volatility", type=float, default=0.001)
+    parser.add_argument("--speed", type=float, default=10.0, help="ускорение времени, 0 - без пауз")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.ticks_file:
+        ticks = load_ticks(args.ticks_file)
+    elif args.synthetic:
+        ticks = synthetic_ticks(args.synthetic, args.count, args.step_ms, args.volatility)
+    else:
+        parser.error("укажите файл со сделками или --synthetic")
+
+    async with websockets.serve(lambda ws: serve_connection(ws, ticks, args.speed), args.host, args.port):
+        print(f"▶️ Replay-сервер на ws://{args.host}:{args.port}, {len(ticks)} сделок")
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
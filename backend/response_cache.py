@@ -0,0 +1,198 @@
+# backend/response_cache.py
+"""
+Постоянный кэш ответов модели в SQLite (stdlib sqlite3). Ключ - хэш имени модели,
+готового промпта, хэшей содержимого графиков и номера попытки консенсуса, значение -
+уже разобранный clean_json_response JSON. Попадание в кэш не тратит ни запрос к модели,
+ни загрузку графиков, ни разбор ответа: повторы, реплеи и локальные прогоны бесплатны.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import asyncio
+import threading
+
+from rich.console import Console
+
+console = Console()
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.db")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "168")) * 3600
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024
+# on - читать и писать, refresh - не читать (принудительный запрос к модели), но писать, off - отключен
+RESPONSE_CACHE_MODE = os.getenv("RESPONSE_CACHE", "on").lower()
+CACHE_MODES = ("on", "refresh", "off")
+# Формат ключа: при изменении разбора ответа увеличьте версию, чтобы не читать старые записи
+RESPONSE_CACHE_VERSION = 1
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_digests(paths: list) -> list:
+    """Хэши содержимого графиков (в порядке paths); отсутствующий файл дает пустую строку."""
+    digests = []
+    for path in paths:
+        try:
+            digests.append(file_digest(path))
+        except OSError:
+            digests.append("")
+    return digests
+
+
+def make_key(model_name: str, prompt: str, digests: list, attempt) -> str:
+    """attempt - номер попытки консенсуса или метка запроса нескольких вариантов ("samples:3")."""
+    payload = json.dumps([RESPONSE_CACHE_VERSION, model_name, prompt, list(digests), attempt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Таблица key -> JSON с TTL и вытеснением давно не читанных записей по суммарному размеру."""
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl: float = RESPONSE_CACHE_TTL,
+                 max_bytes: int = RESPONSE_CACHE_MAX_BYTES, mode: str = RESPONSE_CACHE_MODE):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Неизвестный режим RESPONSE_CACHE '{mode}', доступны: {list(CACHE_MODES)}")
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._conn = None
+        self._bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.writes = 0
+        self.expired = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)")
+            self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str, bypass: bool = False):
+        """Разобранный ответ или None (промах, истек TTL, кэш отключен или bypass)."""
+        if bypass or self.mode != "on":
+            with self._lock:
+                self.bypassed += 1
+            return None
+        now = time.time()
+        with self._lock:
+            try:
+                db = self._db()
+                row = db.execute("SELECT value, size, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                value, size, created_at = row
+                if created_at + self.ttl < now:
+                    db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._bytes -= size
+                    self.expired += 1
+                    self.misses += 1
+                    return None
+                db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                self.hits += 1
+            except sqlite3.Error as e:
+                self.errors += 1
+                console.print(f"⚠️ Кэш ответов модели недоступен: {e}")
+                return None
+        return json.loads(value)
+
+    def put(self, key: str, value):
+        """value - любой JSON: разобранный ответ или список вариантов ответа."""
+        if self.mode == "off":
+            return
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode())
+        now = time.time()
+        with self._lock:
+            try:
+                db = self._db()
+                old = db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, size, now, now),
+                )
+                self._bytes += size - (old[0] if old else 0)
+                self.writes += 1
+                if self._bytes > self.max_bytes:
+                    self._evict(now)
+            except sqlite3.Error as e:
+                self.errors += 1
+                console.print(f"⚠️ Не удалось сохранить ответ модели в кэш: {e}")
+
+    def _evict(self, now: float):
+        # Сначала просроченные записи, затем самые давно не читанные, пока не уложимся в лимит
+        db = self._conn
+        self.expired += db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)).rowcount
+        self._bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if self._bytes <= self.max_bytes:
+            return
+        victims = []
+        excess = self._bytes - self.max_bytes
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+            self._bytes -= size
+        db.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    async def get_async(self, key: str, bypass: bool = False):
+        return await asyncio.to_thread(self.get, key, bypass)
+
+    async def put_async(self, key: str, value):
+        await asyncio.to_thread(self.put, key, value)
+
+    def clear(self):
+        with self._lock:
+            self._db().execute("DELETE FROM responses")
+            self._bytes = 0
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "writes": self.writes,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+response_cache = ResponseCache()
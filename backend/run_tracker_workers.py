@@ -0,0 +1,38 @@
+# backend/run_tracker_workers.py
+"""
+Запускает несколько воркеров трекера против одной БД - для локальной проверки
+шардирования: python run_tracker_workers.py 3 --shards 8
+Остановка любого воркера (Ctrl+C или kill) через TRACKER_LEASE_TTL секунд
+передает его шарды остальным. Тот же сценарий без процессов и Postgres
+(несколько ShardLeases на одной SQLite) проверяет tests/test_tracker_shards.py.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Несколько воркеров трекера на одной БД")
+    parser.add_argument("workers", type=int, help="число воркеров")
+    parser.add_argument("--shards", type=int, default=None, help="число шардов (по умолчанию = воркерам * 2)")
+    args = parser.parse_args()
+
+    tracker_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tracker.py")
+    shards = args.shards or args.workers * 2
+    processes = []
+    for i in range(args.workers):
+        env = dict(os.environ, TRACKER_SHARDS=str(shards), TRACKER_WORKER_ID=f"worker-{i}")
+        processes.append(subprocess.Popen([sys.executable, tracker_path], env=env))
+    print(f"Запущено {args.workers} воркеров, {shards} шардов")
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# backend/shards.py
+"""
+Распределение сигналов между несколькими воркерами трекера. Символы делятся на
+TRACKER_SHARDS шардов по crc32, а каждым шардом владеет один воркер по аренде
+в таблице tracker_leases, которую он продлевает heartbeat-ом. Если воркер упал,
+его аренда истекает и шард забирает другой. Шарды делятся поровну между живыми
+воркерами: новый воркер получает свою долю, когда остальные отдают лишнее.
+"""
+
+import os
+import math
+import zlib
+import socket
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, insert, delete, or_
+from sqlalchemy.exc import IntegrityError
+
+from database import tracker_leases, tracker_workers, async_engine
+
+TRACKER_SHARDS = max(1, int(os.getenv("TRACKER_SHARDS", "1")))
+TRACKER_WORKER_ID = os.getenv("TRACKER_WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+# Срок аренды (сек); heartbeat продлевает ее втрое чаще
+TRACKER_LEASE_TTL = int(os.getenv("TRACKER_LEASE_TTL", "60"))
+
+_EXPIRED = datetime(1970, 1, 1)
+
+
+def shard_of(symbol: str, shards: int = TRACKER_SHARDS) -> int:
+    return zlib.crc32(symbol.encode()) % shards
+
+
+def _utcnow() -> datetime:
+    # Наивное UTC-время, как и остальные колонки DateTime
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ShardLeases:
+    def __init__(self, shards: int = TRACKER_SHARDS, owner: str = TRACKER_WORKER_ID,
+                 ttl: int = TRACKER_LEASE_TTL, engine=async_engine):
+        self.shards = shards
+        self.owner = owner
+        self.ttl = ttl
+        self.engine = engine
+        self.owned = set()
+        self.valid_until = _EXPIRED
+        self.takeovers = 0
+        self._heartbeat = None
+
+    def owns(self, symbol: str) -> bool:
+        return shard_of(symbol, self.shards) in self.owned
+
+    async def setup(self):
+        """Создает таблицы аренды и строки для всех шардов (если их еще нет)."""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(tracker_workers.create, checkfirst=True)
+            await conn.run_sync(tracker_leases.create, checkfirst=True)
+            existing = set((await conn.execute(select(tracker_leases.c.shard))).scalars())
+        for shard in set(range(self.shards)) - existing:
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(insert(tracker_leases).values(shard=shard, owner='', expires_at=_EXPIRED))
+            except IntegrityError:
+                pass  # строку одновременно создал другой воркер
+
+    async def _heartbeat_worker(self, now: datetime):
+        """Отмечает воркер живым, даже если у него пока нет ни одного шарда."""
+        async with self.engine.begin() as conn:
+            result = await conn.execute(update(tracker_workers).where(
+                tracker_workers.c.owner == self.owner
+            ).values(heartbeat_at=now))
+            if result.rowcount:
+                return
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(insert(tracker_workers).values(owner=self.owner, heartbeat_at=now))
+        except IntegrityError:
+            pass
+
+    async def rebalance(self) -> set:
+        """Продлевает свои аренды, забирает свободные и истекшие шарды и отдает лишние."""
+        now = _utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        await self._heartbeat_worker(now)
+        async with self.engine.begin() as conn:
+            live_owners = set((await conn.execute(select(tracker_workers.c.owner).where(
+                tracker_workers.c.heartbeat_at > now - timedelta(seconds=self.ttl)
+            ))).scalars()) | {self.owner}
+            target = math.ceil(self.shards / len(live_owners))
+
+            rows = (await conn.execute(select(tracker_leases).where(tracker_leases.c.shard < self.shards))).fetchall()
+
+            mine = sorted(r.shard for r in rows if r.owner == self.owner and r.expires_at > now)
+            keep, surplus = mine[:target], mine[target:]
+            free = {r.shard: r.owner for r in rows if r.expires_at <= now}
+
+            if surplus:
+                await conn.execute(update(tracker_leases).where(
+                    tracker_leases.c.shard.in_(surplus), tracker_leases.c.owner == self.owner
+                ).values(owner='', expires_at=_EXPIRED))
+
+            owned = set()
+            candidates = keep + sorted(free)[:max(target - len(keep), 0)]
+            for shard in candidates:
+                # Условие в WHERE делает захват атомарным: из двух воркеров шард получит один
+                result = await conn.execute(update(tracker_leases).where(
+                    tracker_leases.c.shard == shard,
+                    or_(tracker_leases.c.owner == self.owner, tracker_leases.c.expires_at <= now),
+                ).values(owner=self.owner, expires_at=expires_at))
+                if result.rowcount:
+                    owned.add(shard)
+                    # Отданные добровольно шарды освобождаются с пустым владельцем - это не перехват
+                    if free.get(shard) not in ('', self.owner, None):
+                        self.takeovers += 1
+
+        if owned != self.owned:
+            print(f"Воркер {self.owner}: шарды {sorted(owned)} из {self.shards}")
+        self.owned = owned
+        self.valid_until = expires_at
+        return owned
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self.rebalance()
+            except Exception as e:
+                print(f"Не удалось продлить аренду шардов: {e}")
+                # Без продления аренда истечет, и шарды заберут другие - перестаем их обрабатывать
+                if _utcnow() >= self.valid_until:
+                    self.owned = set()
+
+    async def start(self):
+        await self.setup()
+        await self.rebalance()
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        """Останавливает heartbeat и сразу освобождает шарды для других воркеров."""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        async with self.engine.begin() as conn:
+            await conn.execute(update(tracker_leases).where(
+                tracker_leases.c.owner == self.owner
+            ).values(owner='', expires_at=_EXPIRED))
+            await conn.execute(delete(tracker_workers).where(tracker_workers.c.owner == self.owner))
+        self.owned = set()
+
+    def stats(self) -> dict:
+        return {
+            "owner": self.owner,
+            "shards": self.shards,
+            "owned": sorted(self.owned),
+            "takeovers": self.takeovers,
+        }
+
+
+async def start_leases():
+    """Аренды нужны только при нескольких шардах; с одним шардом воркер обрабатывает все."""
+    if TRACKER_SHARDS <= 1:
+        return None
+    leases = ShardLeases()
+    await leases.start()
+    return leases
@@ -0,0 +1,239 @@
+# backend/strategies.py
+"""
+Реестр стратегий: config.json и шаблоны промптов читаются и проверяются один раз
+при старте, а затем перечитываются только при изменении файлов (mtime) или по SIGHUP.
+"""
+
+import os
+import json
+import time
+import signal
+import string
+import threading
+
+import ccxt
+from rich.console import Console
+
+console = Console()
+
+CONFIG_PATH = os.getenv("STRATEGIES_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"))
+# Как часто (сек) проверять mtime файлов при обращении к реестру
+RELOAD_CHECK_INTERVAL = float(os.getenv("STRATEGIES_RELOAD_INTERVAL", "2"))
+PROMPT_FIELDS = {"symbol", "current_price"}
+# Промпт быстрой модели предварительного фильтра - общий для всех стратегий,
+# путь относительно config.json (переопределяется ключом prefilter_prompt_file)
+SCREENING_PROMPT_FILE = os.path.join("prompts", "prefilter_prompt.txt")
+SCREENING_PROMPT_FIELDS = {"symbol", "timeframe"}
+REQUIRED_KEYS = ("name", "description", "timeframes", "prompt_file")
+# Консенсус: sequential - отдельный запрос на каждое мнение, multi_sample - несколько
+# вариантов ответа (candidate_count) в одном запросе с одной загрузкой графиков
+CONSENSUS_MODES = ("sequential", "multi_sample")
+DEFAULT_CONSENSUS = {"mode": "sequential", "samples": 3}
+# Голосованию 2 из 3 нужно хотя бы два варианта
+MIN_CONSENSUS_SAMPLES, MAX_CONSENSUS_SAMPLES = 2, 8
+# Предварительный фильтр (prefilter.py): пороги индикаторов и необязательная проверка дешевой моделью
+DEFAULT_PREFILTER = {
+    "enabled": False,
+    "adx_min": 25.0,
+    "rsi_low": 30.0,
+    "rsi_high": 70.0,
+    "bb_expansion_min": 1.5,
+    "min_active": 1,
+    "model_check": False,
+    "model_timeframe": None,
+}
+
+
+class StrategyConfigError(Exception):
+    pass
+
+
+def _compile_prompt(path: str, allowed_fields: set = PROMPT_FIELDS) -> str:
+    """Читает шаблон промпта и проверяет, что в нем только известные подстановки."""
+    try:
+        # 'utf-8-sig' автоматически удаляет BOM
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            template = f.read()
+    except OSError as e:
+        raise StrategyConfigError(f"Промпт не найден: {path} ({e})")
+    try:
+        fields = {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+    except ValueError as e:
+        raise StrategyConfigError(f"Некорректный шаблон промпта {path}: {e}")
+    unknown = fields - allowed_fields
+    if unknown:
+        raise StrategyConfigError(f"Неизвестные поля {sorted(unknown)} в промпте {path}")
+    return template
+
+
+def _validate_consensus(key: str, consensus) -> dict:
+    if consensus is None:
+        return dict(DEFAULT_CONSENSUS)
+    if not isinstance(consensus, dict):
+        raise StrategyConfigError(f"Стратегия '{key}': consensus должен быть объектом")
+    unknown = set(consensus) - set(DEFAULT_CONSENSUS)
+    if unknown:
+        raise StrategyConfigError(f"Стратегия '{key}': неизвестные поля consensus {sorted(unknown)}")
+    compiled = dict(DEFAULT_CONSENSUS, **consensus)
+    if compiled['mode'] not in CONSENSUS_MODES:
+        raise StrategyConfigError(f"Стратегия '{key}': неизвестный режим консенсуса '{compiled['mode']}', "
+                                  f"доступны: {list(CONSENSUS_MODES)}")
+    samples = compiled['samples']
+    if isinstance(samples, bool) or not isinstance(samples, int) or not MIN_CONSENSUS_SAMPLES <= samples <= MAX_CONSENSUS_SAMPLES:
+        raise StrategyConfigError(f"Стратегия '{key}': consensus.samples должно быть целым "
+                                  f"от {MIN_CONSENSUS_SAMPLES} до {MAX_CONSENSUS_SAMPLES}")
+    return compiled
+
+
+def _validate_prefilter(key: str, prefilter, timeframes: list) -> dict:
+    if prefilter is None:
+        return dict(DEFAULT_PREFILTER)
+    if not isinstance(prefilter, dict):
+        raise StrategyConfigError(f"Стратегия '{key}': prefilter должен быть объектом")
+    unknown = set(prefilter) - set(DEFAULT_PREFILTER)
+    if unknown:
+        raise StrategyConfigError(f"Стратегия '{key}': неизвестные поля prefilter {sorted(unknown)}")
+    compiled = dict(DEFAULT_PREFILTER, **prefilter)
+    for field in ("enabled", "model_check"):
+        if not isinstance(compiled[field], bool):
+            raise StrategyConfigError(f"Стратегия '{key}': prefilter.{field} должно быть true/false")
+    for field in ("adx_min", "rsi_low", "rsi_high", "bb_expansion_min"):
+        value = compiled[field]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise StrategyConfigError(f"Стратегия '{key}': prefilter.{field} должно быть неотрицательным числом")
+    if not compiled['rsi_low'] < compiled['rsi_high'] <= 100:
+        raise StrategyConfigError(f"Стратегия '{key}': prefilter требует rsi_low < rsi_high <= 100")
+    min_active = compiled['min_active']
+    if isinstance(min_active, bool) or not isinstance(min_active, int) or not 1 <= min_active <= len(timeframes):
+        raise StrategyConfigError(f"Стратегия '{key}': prefilter.min_active должно быть от 1 до {len(timeframes)}")
+    if compiled['model_timeframe'] is None:
+        compiled['model_timeframe'] = timeframes[0]
+    elif compiled['model_timeframe'] not in timeframes:
+        raise StrategyConfigError(f"Стратегия '{key}': prefilter.model_timeframe '{compiled['model_timeframe']}' "
+                                  f"не входит в timeframes")
+    return compiled
+
+
+def _validate_strategy(key: str, strategy: dict, base_dir: str) -> dict:
+    missing = [k for k in REQUIRED_KEYS if k not in strategy]
+    if missing:
+        raise StrategyConfigError(f"Стратегия '{key}': нет полей {missing}")
+    timeframes = strategy['timeframes']
+    if not isinstance(timeframes, list) or not timeframes:
+        raise StrategyConfigError(f"Стратегия '{key}': список timeframes пуст")
+    for tf in timeframes:
+        try:
+            ccxt.Exchange.parse_timeframe(tf)
+        except Exception:
+            raise StrategyConfigError(f"Стратегия '{key}': неизвестный таймфрейм '{tf}'")
+
+    prompt_path = os.path.join(base_dir, strategy['prompt_file'])
+    compiled = dict(strategy)
+    compiled['prompt_path'] = prompt_path
+    compiled['prompt_template'] = _compile_prompt(prompt_path)
+    compiled['consensus'] = _validate_consensus(key, strategy.get('consensus'))
+    compiled['prefilter'] = _validate_prefilter(key, strategy.get('prefilter'), timeframes)
+    return compiled
+
+
+def render_prompt(strategy: dict, **kwargs) -> str:
+    return strategy['prompt_template'].format(**kwargs)
+
+
+class StrategyRegistry:
+    def __init__(self, config_path: str = CONFIG_PATH):
+        self.config_path = config_path
+        self._strategies = {}
+        self._screening_prompt = None  # {'path', 'template'}
+        self._mtimes = {}
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._reload_requested = False
+        self.reloads = 0
+
+    def _watched_files(self, strategies: dict, screening_prompt: dict) -> list:
+        return [self.config_path, screening_prompt['path']] + [s['prompt_path'] for s in strategies.values()]
+
+    def _read_mtimes(self, paths: list) -> dict:
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def load(self):
+        """Загружает и проверяет конфигурацию. При ошибке бросает StrategyConfigError."""
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise StrategyConfigError(f"Не удалось прочитать {self.config_path}: {e}")
+
+        raw = config.get('strategies')
+        if not isinstance(raw, dict) or not raw:
+            raise StrategyConfigError(f"В {self.config_path} нет ни одной стратегии")
+        base_dir = os.path.dirname(os.path.abspath(self.config_path))
+        strategies = {key: _validate_strategy(key, value, base_dir) for key, value in raw.items()}
+        screening_path = os.path.join(base_dir, config.get('prefilter_prompt_file', SCREENING_PROMPT_FILE))
+        screening_prompt = {'path': screening_path,
+                            'template': _compile_prompt(screening_path, SCREENING_PROMPT_FIELDS)}
+
+        with self._lock:
+            self._strategies = strategies
+            self._screening_prompt = screening_prompt
+            self._mtimes = self._read_mtimes(self._watched_files(strategies, screening_prompt))
+            self._last_check = time.monotonic()
+            self.reloads += 1
+
+    def reload(self) -> bool:
+        """Горячая перезагрузка: при ошибке остается предыдущая рабочая конфигурация."""
+        try:
+            self.load()
+        except StrategyConfigError as e:
+            console.print(f"❌ Конфигурация стратегий не перезагружена: {e}")
+            return False
+        console.print(f"🔄 Конфигурация стратегий перезагружена ({len(self._strategies)} шт.)")
+        return True
+
+    def _maybe_reload(self):
+        if not self._strategies:
+            # load() при старте не вызывали (скрипты, тесты): загружаем при первом обращении,
+            # чтобы ошибка конфигурации была видна, а не превращалась в "стратегия не найдена"
+            self.load()
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not self._reload_requested and now - self._last_check < RELOAD_CHECK_INTERVAL:
+                return
+            self._last_check = now
+            requested, self._reload_requested = self._reload_requested, False
+            changed = self._read_mtimes(list(self._mtimes)) != self._mtimes
+        if requested or changed:
+            self.reload()
+
+    def request_reload(self, *_):
+        """Обработчик SIGHUP: перезагрузка произойдет при следующем обращении к реестру."""
+        self._reload_requested = True
+
+    def install_signal_handler(self):
+        if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, self.request_reload)
+
+    def get(self, key: str) -> dict:
+        """Возвращает стратегию по ключу или бросает KeyError."""
+        self._maybe_reload()
+        return self._strategies[key]
+
+    def keys(self) -> list:
+        self._maybe_reload()
+        return list(self._strategies)
+
+    def render_screening_prompt(self, symbol: str, timeframe: str) -> str:
+        """Промпт быстрой модели предварительного фильтра."""
+        self._maybe_reload()
+        return self._screening_prompt['template'].format(symbol=symbol, timeframe=timeframe)
+
+
+registry = StrategyRegistry()
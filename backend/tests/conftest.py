@@ -0,0 +1,37 @@
+# backend/tests/conftest.py
+# Модули бэкенда плоские (import indicators, import logic) - добавляем backend в путь импорта
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.pool import NullPool  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # noqa: E402
+
+import database  # noqa: E402
+
+TEST_USER_ID = 1
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """
+    Временная SQLite со схемой и пользователем TEST_USER_ID: engine, sessions и url.
+    NullPool не держит соединения между вызовами, поэтому базу можно использовать
+    из нескольких asyncio.run одного теста.
+    """
+    url = f"sqlite+aiosqlite:///{tmp_path / 'history.db'}"
+    engine = create_async_engine(url, poolclass=NullPool)
+
+    async def prepare():
+        async with engine.begin() as conn:
+            await conn.run_sync(database.metadata.create_all)
+            await conn.execute(database.users.insert().values(id=TEST_USER_ID, username="trader", hashed_password="x"))
+
+    asyncio.run(prepare())
+    yield SimpleNamespace(engine=engine, sessions=async_sessionmaker(engine, expire_on_commit=False), url=url)
+    asyncio.run(engine.dispose())
@@ -0,0 +1,106 @@
+# backend/tests/test_chart_cache.py
+"""
+Кэш отрисованных графиков: вытеснение по размеру не трогает только что использованные
+файлы, а файл, исчезнувший между lookup и чтением, рисуется заново.
+"""
+
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import charts
+
+OHLCV = [[1_700_000_000_000, 1.0, 2.0, 0.5, 1.5, 10.0]]
+
+
+def write_chart(directory, name: str, size: int, age: float) -> str:
+    path = os.path.join(directory, f"chart_{name}.png")
+    with open(path, 'wb') as f:
+        f.write(b"x" * size)
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+    return path
+
+
+def test_eviction_removes_oldest_files_over_limit(tmp_path):
+    cache = charts.ChartRenderCache(str(tmp_path), max_bytes=250, grace=60)
+    oldest = write_chart(tmp_path, "a", 100, age=3000)
+    older = write_chart(tmp_path, "b", 100, age=2000)
+    newest = write_chart(tmp_path, "c", 100, age=1000)
+    cache.add(newest)
+    assert not os.path.exists(oldest)
+    assert os.path.exists(older) and os.path.exists(newest)
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] == 200
+
+
+def test_eviction_keeps_recently_used_files(tmp_path):
+    cache = charts.ChartRenderCache(str(tmp_path), max_bytes=150, grace=60)
+    old = write_chart(tmp_path, "old", 100, age=3000)
+    fresh = [write_chart(tmp_path, f"fresh{i}", 100, age=5) for i in range(2)]
+    cache.add(fresh[-1])
+    assert not os.path.exists(old)
+    # Лимит все еще превышен, но свежие графики нужны идущим анализам
+    assert all(os.path.exists(p) for p in fresh)
+    assert cache.stats()["bytes"] == 200
+
+
+def test_lookup_refreshes_mtime(tmp_path):
+    cache = charts.ChartRenderCache(str(tmp_path), max_bytes=150, grace=60)
+    used = write_chart(tmp_path, "used", 100, age=3000)
+    other = write_chart(tmp_path, "other", 100, age=2000)
+    assert cache.lookup(used)
+    cache.add(other)
+    assert os.path.exists(used) and not os.path.exists(other)
+
+
+@pytest.fixture
+def fake_pool(tmp_path, monkeypatch):
+    """Пул потоков вместо процессов и отрисовка без matplotlib."""
+    rendered = []
+
+    def fake_render(symbol, timeframe, ohlcv, as_bytes=False, filepath=None):
+        rendered.append(timeframe)
+        if as_bytes:
+            return b"fresh png"
+        with open(filepath, 'wb') as f:
+            f.write(b"fresh png")
+        return filepath
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(charts, "render_chart", fake_render)
+    monkeypatch.setattr(charts, "get_pool", lambda: pool)
+    monkeypatch.setattr(charts, "render_cache", charts.ChartRenderCache(str(tmp_path), grace=60))
+    yield rendered
+    pool.shutdown(wait=True)
+
+
+def test_bytes_from_cache(fake_pool):
+    path = asyncio.run(charts.render_charts_async("BTC/USDT", {"1h": OHLCV}))["1h"]
+    assert asyncio.run(charts.render_charts_async("BTC/USDT", {"1h": OHLCV}, as_bytes=True)) == {"1h": b"fresh png"}
+    assert fake_pool == ["1h"]
+    assert os.path.exists(path)
+
+
+def test_chart_evicted_after_lookup_is_rendered_again(fake_pool, monkeypatch):
+    # lookup видит файл, но до чтения его удаляет вытеснение в другом потоке
+    monkeypatch.setattr(charts.render_cache, "lookup", lambda path: True)
+    result = asyncio.run(charts.render_charts_async("BTC/USDT", {"1h": OHLCV, "4h": OHLCV}, as_bytes=True))
+    assert result == {"1h": b"fresh png", "4h": b"fresh png"}
+    assert sorted(fake_pool) == ["1h", "4h"]
+
+
+def test_submit_failure_affects_only_its_chart(fake_pool, monkeypatch):
+    submit = charts.submit_render
+
+    def flaky_submit(symbol, timeframe, ohlcv, as_bytes=False):
+        if timeframe == "4h":
+            raise RuntimeError("пул недоступен")
+        return submit(symbol, timeframe, ohlcv, as_bytes)
+
+    monkeypatch.setattr(charts, "submit_render", flaky_submit)
+    result = asyncio.run(charts.render_charts_async("BTC/USDT", {"1h": OHLCV, "4h": OHLCV}, as_bytes=True))
+    assert result == {"1h": b"fresh png", "4h": None}
@@ -0,0 +1,101 @@
+# backend/tests/test_history_pagination.py
+"""
+Keyset-пагинация /history на SQLite: несколько записей в одну секунду не должны
+повторяться между страницами - ни для новых записей, ни для старых, созданных
+через func.now() (без долей секунды). Фильтры по дате принимают время с часовым поясом.
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from fastapi import Response
+from sqlalchemy import text
+
+import database
+import main
+from auth import UserInDB
+
+USER = UserInDB(id=1, username="trader", hashed_password="x")
+SIGNAL = dict(user_id=1, symbol="BTC/USDT", analysis_summary="s", direction="Long", entry_type="Limit",
+              entry_price="100", stop_loss=95.0, take_profit=110.0, risk_reward_ratio="1:2",
+              invalidation_hours=24, consensus="2/3", status="active")
+
+
+async def fetch_page(session, cursor=None, limit=1, date_from=None, date_to=None) -> tuple:
+    response = Response()
+    records = await main.get_user_history(
+        response=response, limit=limit, cursor=cursor, symbol=None, signal_status=None,
+        date_from=date_from, date_to=date_to, fields="id", current_user=USER, db=session,
+    )
+    return [r["id"] for r in records], response.headers.get("X-Next-Cursor")
+
+
+async def walk_history(session, limit: int) -> list:
+    pages, cursor = [], None
+    while True:
+        ids, cursor = await fetch_page(session, cursor, limit)
+        pages.append(ids)
+        if not cursor:
+            return pages
+        assert len(pages) <= 10, f"Пагинация не заканчивается: {pages}"
+
+
+def test_rows_in_same_second_written_from_python(sqlite_db):
+    engine, sessions = sqlite_db.engine, sqlite_db.sessions
+
+    async def scenario():
+        second = datetime(2026, 1, 1, 12, 0, 0)
+        async with engine.begin() as conn:
+            await conn.execute(database.analyses.insert(), [dict(SIGNAL, timestamp=second) for _ in range(3)])
+        async with sessions() as session:
+            first, cursor = await fetch_page(session, limit=2)
+            assert first == [3, 2]
+            assert await fetch_page(session, cursor, limit=2) == ([1], None)
+            assert await walk_history(session, limit=1) == [[3], [2], [1]]
+    asyncio.run(scenario())
+
+
+def test_default_timestamp_matches_cursor_format(sqlite_db):
+    engine, sessions = sqlite_db.engine, sqlite_db.sessions
+
+    async def scenario():
+        async with engine.begin() as conn:
+            for _ in range(3):
+                await conn.execute(database.analyses.insert().values(**SIGNAL))
+        async with sessions() as session:
+            assert await walk_history(session, limit=1) == [[3], [2], [1]]
+    asyncio.run(scenario())
+
+
+def test_legacy_rows_without_fractional_seconds(sqlite_db):
+    engine, sessions = sqlite_db.engine, sqlite_db.sessions
+
+    async def scenario():
+        async with engine.begin() as conn:
+            # Как писал прежний default=func.now(): CURRENT_TIMESTAMP без долей секунды
+            for _ in range(3):
+                await conn.execute(database.analyses.insert().values(**SIGNAL, timestamp=text("'2025-08-05 11:10:21'")))
+            await conn.execute(database.analyses.insert().values(**SIGNAL, timestamp=text("'2025-08-05 11:10:20'")))
+            assert await database.normalize_legacy_timestamps(conn) == 4
+        async with sessions() as session:
+            assert await walk_history(session, limit=1) == [[3], [2], [1], [4]]
+            assert await walk_history(session, limit=3) == [[3, 2, 1], [4]]
+    asyncio.run(scenario())
+
+
+def test_date_filters_with_timezone(sqlite_db):
+    engine, sessions = sqlite_db.engine, sqlite_db.sessions
+
+    async def scenario():
+        async with engine.begin() as conn:
+            await conn.execute(database.analyses.insert(), [
+                dict(SIGNAL, timestamp=datetime(2026, 1, 1, hour)) for hour in (11, 12, 13)
+            ])
+        async with sessions() as session:
+            # 14:30 по Москве - это 11:30 UTC; "Z" в запросе FastAPI разбирает в UTC
+            date_from = datetime(2026, 1, 1, 14, 30, tzinfo=timezone(timedelta(hours=3)))
+            date_to = datetime(2026, 1, 1, 12, 30, tzinfo=timezone.utc)
+            assert await fetch_page(session, limit=10, date_from=date_from, date_to=date_to) == ([2], None)
+            # Наивное время по-прежнему считается UTC
+            assert await fetch_page(session, limit=10, date_from=datetime(2026, 1, 1, 12)) == ([3, 2], None)
+    asyncio.run(scenario())
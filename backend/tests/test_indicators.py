@@ -0,0 +1,142 @@
+# backend/tests/test_indicators.py
+"""
+Эквивалентность векторных индикаторов прежним pandas-калькуляторам (charts.py /
+trader_ai.py до перехода на indicators.py) для float64 и float32, одного ряда и
+матрицы (n_symbols, n_bars).
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators
+
+
+# <--- ПРЕЖНИЕ PANDAS-КАЛЬКУЛЯТОРЫ --->
+
+def calculate_rsi(series: pd.Series, length: int = 14) -> pd.Series:
+    delta = series.diff()
+    gain = delta.where(delta > 0, 0)
+    loss = -delta.where(delta < 0, 0)
+    avg_gain = gain.ewm(com=length - 1, min_periods=length).mean()
+    avg_loss = loss.ewm(com=length - 1, min_periods=length).mean()
+    if avg_loss.empty or (avg_loss == 0).all():
+        return pd.Series(100.0, index=series.index)
+    rs = avg_gain / avg_loss
+    return 100 - (100 / (1 + rs))
+
+
+def calculate_bbands(series: pd.Series, length: int = 20, std: int = 2):
+    middle_band = series.rolling(window=length).mean()
+    std_dev = series.rolling(window=length).std()
+    return middle_band + (std_dev * std), middle_band - (std_dev * std)
+
+
+def calculate_atr(df, length=14):
+    high_low = df['high'] - df['low']
+    high_close = (df['high'] - df['close'].shift()).abs()
+    low_close = (df['low'] - df['close'].shift()).abs()
+    tr = high_low.combine(high_close, max).combine(low_close, max)
+    return tr.ewm(alpha=1 / length, adjust=False).mean()
+
+
+def calculate_adx(df, length=14):
+    df['ATR'] = calculate_atr(df, length)
+    plus_dm = df['high'].diff()
+    minus_dm = df['low'].diff()
+    plus_dm[plus_dm < 0] = 0
+    minus_dm[minus_dm > 0] = 0
+    plus_di = 100 * (plus_dm.ewm(alpha=1 / length, adjust=False).mean() / df['ATR'])
+    minus_di = 100 * (abs(minus_dm.ewm(alpha=1 / length, adjust=False).mean()) / df['ATR'])
+    dx = 100 * (abs(plus_di - minus_di) / (abs(plus_di + minus_di) + 1e-6))
+    df[f'ADX_{length}'] = dx.ewm(alpha=1 / length, adjust=False).mean()
+    return df
+
+
+# <--- ДАННЫЕ И СРАВНЕНИЕ --->
+
+N_SYMBOLS, N_BARS = 4, 300
+TOLERANCE = {np.float64: dict(rtol=1e-7, atol=1e-7), np.float32: dict(rtol=2e-3, atol=2e-2)}
+
+
+def make_candles(seed: int, n: int = N_BARS) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.005, n)) * close
+    return pd.DataFrame({
+        "high": np.maximum(open_, close) + spread,
+        "low": np.minimum(open_, close) - spread,
+        "close": close,
+    })
+
+
+@pytest.fixture(scope="module")
+def frames() -> list:
+    return [make_candles(seed) for seed in range(N_SYMBOLS)]
+
+
+def pandas_reference(df: pd.DataFrame) -> dict:
+    upper, lower = calculate_bbands(df['close'])
+    return {
+        "rsi": calculate_rsi(df['close']).to_numpy(),
+        "bb_upper": upper.to_numpy(),
+        "bb_lower": lower.to_numpy(),
+        "atr": calculate_atr(df).to_numpy(),
+        "adx": calculate_adx(df.copy())['ADX_14'].to_numpy(),
+        "sma": df['close'].rolling(window=20).mean().to_numpy(),
+        "ema": df['close'].ewm(span=20, adjust=False).mean().to_numpy(),
+    }
+
+
+def vectorized(high, low, close, dtype) -> dict:
+    upper, lower = indicators.bbands(close, dtype=dtype)
+    return {
+        "rsi": indicators.rsi(close, dtype=dtype),
+        "bb_upper": upper,
+        "bb_lower": lower,
+        "atr": indicators.atr(high, low, close, dtype=dtype),
+        "adx": indicators.adx(high, low, close, dtype=dtype),
+        "sma": indicators.sma(close, 20, dtype=dtype),
+        "ema": indicators.ema(close, 20, dtype=dtype),
+    }
+
+
+def assert_matches(actual: np.ndarray, expected: np.ndarray, dtype, name: str):
+    assert actual.dtype == dtype, name
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected), err_msg=f"{name}: NaN-маска")
+    np.testing.assert_allclose(actual.astype(np.float64), expected, equal_nan=True,
+                               err_msg=name, **TOLERANCE[dtype])
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_single_series_matches_pandas(frames, dtype):
+    for df in frames:
+        expected = pandas_reference(df)
+        actual = vectorized(df['high'], df['low'], df['close'], dtype)
+        for name in expected:
+            assert_matches(actual[name], expected[name], dtype, name)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_stacked_matrix_matches_pandas(frames, dtype):
+    high, low, close = (indicators.stack([df[col] for df in frames], dtype=dtype) for col in ("high", "low", "close"))
+    actual = vectorized(high, low, close, dtype)
+    for row, df in enumerate(frames):
+        expected = pandas_reference(df)
+        for name in expected:
+            assert actual[name].shape == (N_SYMBOLS, N_BARS)
+            assert_matches(actual[name][row], expected[name], dtype, name)
+
+
+def test_adx_does_not_mutate_input(frames):
+    high, low, close = (frames[0][col].to_numpy().copy() for col in ("high", "low", "close"))
+    before = [a.copy() for a in (high, low, close)]
+    indicators.adx(high, low, close)
+    for original, after in zip(before, (high, low, close)):
+        np.testing.assert_array_equal(original, after)
+
+
+def test_rsi_without_losses_is_100():
+    close = np.arange(1, 60, dtype=np.float64)
+    np.testing.assert_array_equal(indicators.rsi(close), calculate_rsi(pd.Series(close)).to_numpy())
@@ -0,0 +1,316 @@
+# backend/tests/test_jobs.py
+"""
+Очередь анализов на хранилище в памяти и управляемом анализаторе-заглушке:
+переходы статусов, ошибки, переполнение, позиция и оценка времени, поток событий;
+объединение одинаковых анализов (SingleFlight).
+"""
+
+import time
+import asyncio
+
+import pytest
+
+import jobs
+
+
+class GatedAnalyzer:
+    """Анализатор, который завершает анализ пары только по команде release(pair)."""
+
+    def __init__(self, results: dict = None):
+        self.results = results or {}
+        self.gates = {}
+        self.calls = []
+
+    def gate(self, pair: str) -> asyncio.Event:
+        return self.gates.setdefault(pair, asyncio.Event())
+
+    def release(self, pair: str):
+        self.gate(pair).set()
+
+    async def __call__(self, pair: str, strategy_key: str) -> dict:
+        self.calls.append(pair)
+        await self.gate(pair).wait()
+        result = self.results.get(pair, {"status": "success", "pair": pair})
+        if isinstance(result, Exception):
+            raise result
+        return dict(result)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def run(scenario):
+    asyncio.run(scenario())
+
+
+def test_job_goes_from_queued_to_done():
+    async def scenario():
+        saved = []
+
+        async def on_result(job, result):
+            saved.append((job.id, result["pair"]))
+
+        analyzer = GatedAnalyzer()
+        queue = jobs.JobQueue(analyzer, on_result=on_result, concurrency=1)
+        job = queue.submit("BTC/USDT", "swing", user_id=1)
+        assert job.status == jobs.QUEUED and queue.get(job.id) is job
+        await queue.start()
+        await settle()
+        assert job.status == jobs.RUNNING and job.started_at is not None
+        analyzer.release("BTC/USDT")
+        await settle()
+        assert job.status == jobs.DONE
+        assert job.result == {"status": "success", "pair": "BTC/USDT"}
+        assert saved == [(job.id, "BTC/USDT")]
+        assert queue.stats()["completed"] == 1
+        await queue.stop()
+
+    run(scenario)
+
+
+def test_error_result_fails_job_without_saving():
+    async def scenario():
+        saved = []
+
+        async def on_result(job, result):
+            saved.append(result)
+
+        analyzer = GatedAnalyzer({"BTC/USDT": {"error": "Биржа недоступна"}})
+        analyzer.release("BTC/USDT")
+        queue = jobs.JobQueue(analyzer, on_result=on_result, concurrency=1)
+        await queue.start()
+        job = queue.submit("BTC/USDT", "swing", user_id=1)
+        await settle()
+        assert job.status == jobs.FAILED and job.error == "Биржа недоступна"
+        assert saved == [] and queue.stats()["failed"] == 1
+        await queue.stop()
+
+    run(scenario)
+
+
+def test_exception_in_analyzer_or_on_result_fails_job():
+    async def scenario():
+        async def broken_save(job, result):
+            raise RuntimeError("БД недоступна")
+
+        analyzer = GatedAnalyzer({"ETH/USDT": ValueError("сбой анализа")})
+        for pair in ("BTC/USDT", "ETH/USDT"):
+            analyzer.release(pair)
+        queue = jobs.JobQueue(analyzer, on_result=broken_save, concurrency=1)
+        await queue.start()
+        saved_fails = queue.submit("BTC/USDT", "swing", user_id=1)
+        analysis_fails = queue.submit("ETH/USDT", "swing", user_id=1)
+        await settle()
+        assert saved_fails.status == jobs.FAILED and "БД недоступна" in saved_fails.error
+        assert analysis_fails.status == jobs.FAILED and "сбой анализа" in analysis_fails.error
+        # Воркер пережил обе ошибки
+        assert queue.stats()["failed"] == 2 and len(queue._workers) == 1
+        await queue.stop()
+
+    run(scenario)
+
+
+def test_stop_fails_running_job():
+    async def scenario():
+        queue = jobs.JobQueue(GatedAnalyzer(), concurrency=1)
+        await queue.start()
+        job = queue.submit("BTC/USDT", "swing", user_id=1)
+        await settle()
+        await queue.stop()
+        assert job.status == jobs.FAILED and "остановкой" in job.error
+
+    run(scenario)
+
+
+def test_queue_full():
+    async def scenario():
+        queue = jobs.JobQueue(GatedAnalyzer(), concurrency=1, max_queue=2)
+        queue.submit("A/USDT", "swing", user_id=1)
+        queue.submit("B/USDT", "swing", user_id=1)
+        with pytest.raises(jobs.QueueFullError):
+            queue.submit("C/USDT", "swing", user_id=1)
+        # Запущенная задача освобождает место в очереди
+        await queue.start()
+        await settle()
+        queue.submit("C/USDT", "swing", user_id=1)
+        await queue.stop()
+
+    run(scenario)
+
+
+def test_position_and_eta():
+    async def scenario():
+        analyzer = GatedAnalyzer()
+        queue = jobs.JobQueue(analyzer, concurrency=2)
+        queue._durations.extend([10.0, 30.0])
+        submitted = [queue.submit(f"P{i}/USDT", "swing", user_id=1) for i in range(5)]
+        assert [queue.position(j) for j in submitted] == [1, 2, 3, 4, 5]
+        # Пока ничего не запущено: первые две задачи в первой волне, затем по две на волну
+        assert [queue.eta(j) for j in submitted] == [20.0, 20.0, 40.0, 40.0, 60.0]
+
+        await queue.start()
+        await settle()
+        running, queued = submitted[:2], submitted[2:]
+        assert [queue.position(j) for j in running] == [0, 0]
+        assert [queue.position(j) for j in queued] == [1, 2, 3]
+        assert all(0 < queue.eta(j) <= 20.0 for j in running)
+        assert [queue.eta(j) for j in queued] == [40.0, 40.0, 60.0]
+
+        analyzer.release("P0/USDT")
+        await settle()
+        assert queue.eta(submitted[0]) == 0.0
+        assert submitted[2].status == jobs.RUNNING
+        assert [queue.position(j) for j in submitted[3:]] == [1, 2]
+        info = queue.describe(submitted[3])
+        # Средняя длительность теперь учитывает и завершенную задачу
+        assert info["position"] == 1 and "result" not in info
+        assert info["eta_seconds"] == round(2 * queue.average_duration(), 1)
+        await queue.stop()
+
+    run(scenario)
+
+
+def test_events_end_on_completion():
+    async def scenario():
+        analyzer = GatedAnalyzer()
+        queue = jobs.JobQueue(analyzer, concurrency=1)
+        job = queue.submit("BTC/USDT", "swing", user_id=1)
+
+        async def collect():
+            return [event async for event in queue.events(job, heartbeat=1)]
+
+        events = asyncio.create_task(collect())
+        await settle()
+        await queue.start()
+        await settle()
+        analyzer.release("BTC/USDT")
+        snapshots = await asyncio.wait_for(events, 2)
+        assert [s["status"] for s in snapshots] == [jobs.QUEUED, jobs.RUNNING, jobs.DONE]
+        assert snapshots[-1]["result"] == {"status": "success", "pair": "BTC/USDT"}
+        await queue.stop()
+
+    run(scenario)
+
+
+def test_store_prunes_finished_jobs():
+    store = jobs.InMemoryJobStore(ttl=60, limit=2)
+
+    def finished_job(finished_at: float) -> jobs.Job:
+        job = jobs.Job("BTC/USDT", "swing", user_id=1)
+        job.status, job.finished_at = jobs.DONE, finished_at
+        store.add(job)
+        return job
+
+    now = time.time()
+    first, second, third = finished_job(now), finished_job(now), finished_job(now)
+    # Сверх лимита вытесняются самые старые завершенные задачи
+    assert store.get(first.id) is None
+    assert store.get(second.id) is second and store.get(third.id) is third
+
+    expired = finished_job(now - 120)
+    assert store.get(expired.id) is None
+    assert store.get(second.id) is None and store.get(third.id) is third
+
+
+# --- SingleFlight: объединение одинаковых анализов в пределах свечи ---
+
+class Period:
+    """Управляемое время закрытия текущей свечи для SingleFlight."""
+
+    def __init__(self, close_at: float):
+        self.close_at = close_at
+
+    def __call__(self, strategy_key: str) -> float:
+        return self.close_at
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    async def scenario():
+        analyzer = GatedAnalyzer()
+        flight = jobs.SingleFlight(analyzer, Period(time.time() + 60))
+        callers = [asyncio.create_task(flight("BTC/USDT", "swing")) for _ in range(3)]
+        other = asyncio.create_task(flight("BTC/USDT", "scalping"))
+        await settle()
+        assert analyzer.calls == ["BTC/USDT", "BTC/USDT"]
+        analyzer.release("BTC/USDT")
+        results = await asyncio.gather(*callers, other)
+        assert all(r == {"status": "success", "pair": "BTC/USDT"} for r in results)
+        assert flight.stats() == {"executions": 2, "coalesced": 2, "cache_hits": 0,
+                                  "in_flight": 0, "cached_results": 2}
+
+    run(scenario)
+
+
+def test_single_flight_caches_until_period_end():
+    async def scenario():
+        analyzer = GatedAnalyzer()
+        analyzer.release("BTC/USDT")
+        period = Period(time.time() + 0.05)
+        flight = jobs.SingleFlight(analyzer, period)
+        await flight("BTC/USDT", "swing")
+        await flight("BTC/USDT", "swing")
+        assert len(analyzer.calls) == 1 and flight.cache_hits == 1
+
+        # Свеча закрылась: результат прошлой свечи удаляется, анализ выполняется заново
+        await asyncio.sleep(0.06)
+        period.close_at = time.time() + 60
+        await flight("BTC/USDT", "swing")
+        assert len(analyzer.calls) == 2
+        assert flight.stats()["cached_results"] == 1
+
+    run(scenario)
+
+
+def test_single_flight_does_not_cache_errors():
+    async def scenario():
+        analyzer = GatedAnalyzer({"BTC/USDT": {"error": "Биржа недоступна"}})
+        analyzer.release("BTC/USDT")
+        flight = jobs.SingleFlight(analyzer, Period(time.time() + 60))
+        assert (await flight("BTC/USDT", "swing"))["error"]
+        assert (await flight("BTC/USDT", "swing"))["error"]
+        assert len(analyzer.calls) == 2 and flight.cache_hits == 0
+
+        analyzer.results["ETH/USDT"] = RuntimeError("сбой")
+        analyzer.release("ETH/USDT")
+        with pytest.raises(RuntimeError):
+            await flight("ETH/USDT", "swing")
+        assert flight.stats()["in_flight"] == 0 and flight.stats()["cached_results"] == 0
+
+    run(scenario)
+
+
+def test_single_flight_returns_independent_copies():
+    async def scenario():
+        analyzer = GatedAnalyzer({"BTC/USDT": {"status": "success", "chart_images": ["a.png"]}})
+        flight = jobs.SingleFlight(analyzer, Period(time.time() + 60))
+        first, second = asyncio.create_task(flight("BTC/USDT", "swing")), asyncio.create_task(flight("BTC/USDT", "swing"))
+        await settle()
+        analyzer.release("BTC/USDT")
+        first, second = await first, await second
+        first["chart_images"].append("b.png")
+        first["status"] = "changed"
+        assert second == {"status": "success", "chart_images": ["a.png"]}
+        cached = await flight("BTC/USDT", "swing")
+        assert cached == {"status": "success", "chart_images": ["a.png"]}
+        cached["chart_images"].clear()
+        assert (await flight("BTC/USDT", "swing"))["chart_images"] == ["a.png"]
+
+    run(scenario)
+
+
+def test_single_flight_cancelled_caller_does_not_cancel_others():
+    async def scenario():
+        analyzer = GatedAnalyzer()
+        flight = jobs.SingleFlight(analyzer, Period(time.time() + 60))
+        cancelled = asyncio.create_task(flight("BTC/USDT", "swing"))
+        waiting = asyncio.create_task(flight("BTC/USDT", "swing"))
+        await settle()
+        cancelled.cancel()
+        await settle()
+        analyzer.release("BTC/USDT")
+        assert (await waiting)["status"] == "success"
+        assert cancelled.cancelled() and len(analyzer.calls) == 1
+
+    run(scenario)
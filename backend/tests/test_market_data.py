@@ -0,0 +1,225 @@
+# backend/tests/test_market_data.py
+"""
+Кэш свечей: граница TTL на закрытии свечи (включая недельные свечи с понедельника
+и месячные), вытеснение по LRU и лимиту памяти, замена незакрытой свечи при дозагрузке
+и параметры since/limit, с которыми кэш ходит на биржу.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import market_data
+from market_data import OHLCVCache, CANDLE_ROW_BYTES, next_candle_close
+
+HOUR = 3600
+HOUR_MS = HOUR * 1000
+# Понедельник, 2024-01-01 00:00 UTC
+MONDAY = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+def utc(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+# --- next_candle_close ---
+
+@pytest.mark.parametrize("timeframe, now, expected", [
+    ("1h", MONDAY - 0.001, MONDAY),
+    ("1h", MONDAY, MONDAY + HOUR),
+    ("4h", MONDAY + 5 * HOUR, MONDAY + 8 * HOUR),
+    ("1d", MONDAY + 23 * HOUR, MONDAY + 24 * HOUR),
+    # Недельная свеча закрывается в понедельник, а не в четверг (как эпоха)
+    ("1w", MONDAY - 0.001, MONDAY),
+    ("1w", MONDAY, MONDAY + 7 * 24 * HOUR),
+    ("1w", utc(2024, 1, 4), MONDAY + 7 * 24 * HOUR),
+    ("1M", utc(2024, 1, 31, 23, 59, 59), utc(2024, 2, 1)),
+    ("1M", utc(2024, 2, 1), utc(2024, 3, 1)),
+    ("1M", utc(2024, 12, 15), utc(2025, 1, 1)),
+    ("3M", utc(2024, 2, 10), utc(2024, 4, 1)),
+    ("3M", utc(2024, 11, 1), utc(2025, 1, 1)),
+])
+def test_next_candle_close(timeframe, now, expected):
+    assert next_candle_close(timeframe, now) == expected
+
+
+# --- OHLCVCache ---
+
+class Clock:
+    """Управляемое время для market_data вместо time.time()."""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(MONDAY + 600)
+    monkeypatch.setattr(market_data, "time", SimpleNamespace(time=clock.time))
+    return clock
+
+
+def candles(first_ms: int, count: int, close: float = 1.0) -> list:
+    return [[first_ms + i * HOUR_MS, 1.0, 2.0, 0.5, close, 10.0] for i in range(count)]
+
+
+def test_entry_expires_exactly_at_candle_close(clock):
+    cache = OHLCVCache()
+    rows = candles(int(MONDAY * 1000) - 4 * HOUR_MS, 5)
+    cache.put("BTC/USDT", "1h", 5, rows)
+    clock.now = MONDAY + HOUR - 0.001
+    assert cache.lookup("BTC/USDT", "1h", 5) == (rows, None)
+    assert cache.lookup("BTC/USDT", "1h", 3) == (rows[-3:], None)
+    # Окно больше закэшированного - полный промах
+    assert cache.lookup("BTC/USDT", "1h", 10) == (None, None)
+    clock.now = MONDAY + HOUR
+    assert cache.lookup("BTC/USDT", "1h", 5) == (None, rows[-1][0])
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_weekly_entry_lives_until_monday(clock):
+    cache = OHLCVCache()
+    clock.now = utc(2024, 1, 4, 12)
+    cache.put("BTC/USDT", "1w", 1, [[int(MONDAY * 1000), 1.0, 2.0, 0.5, 1.5, 10.0]])
+    clock.now = utc(2024, 1, 7, 23, 59)
+    assert cache.lookup("BTC/USDT", "1w", 1)[0] is not None
+    clock.now = utc(2024, 1, 8)
+    assert cache.lookup("BTC/USDT", "1w", 1)[0] is None
+
+
+def test_lru_eviction_by_entries(clock):
+    cache = OHLCVCache(max_entries=2)
+    for symbol in ("A/USDT", "B/USDT"):
+        cache.put(symbol, "1h", 1, candles(0, 1))
+    # Обращение к A делает вытесняемой B
+    assert cache.lookup("A/USDT", "1h", 1)[0] is not None
+    cache.put("C/USDT", "1h", 1, candles(0, 1))
+    assert cache.lookup("B/USDT", "1h", 1) == (None, None)
+    assert cache.lookup("A/USDT", "1h", 1)[0] is not None
+    assert cache.stats()["entries"] == 2 and cache.evictions == 1
+
+
+def test_eviction_by_bytes(clock):
+    cache = OHLCVCache(max_bytes=10 * CANDLE_ROW_BYTES)
+    cache.put("A/USDT", "1h", 4, candles(0, 4))
+    cache.put("B/USDT", "1h", 4, candles(0, 4))
+    assert cache.stats()["bytes"] == 8 * CANDLE_ROW_BYTES
+    cache.put("C/USDT", "1h", 4, candles(0, 4))
+    assert cache.lookup("A/USDT", "1h", 4) == (None, None)
+    assert cache.stats()["bytes"] == 8 * CANDLE_ROW_BYTES and cache.evictions == 1
+
+    # Буфер больше всего лимита не кэшируется и не вытесняет остальные
+    cache.put("D/USDT", "1h", 11, candles(0, 11))
+    assert cache.lookup("D/USDT", "1h", 11) == (None, None)
+    assert cache.stats()["entries"] == 2
+
+
+def test_merge_replaces_unclosed_candle(clock):
+    cache = OHLCVCache()
+    start = int(MONDAY * 1000) - 4 * HOUR_MS
+    cache.put("BTC/USDT", "1h", 5, candles(start, 5, close=1.0))
+    fresh = candles(start + 4 * HOUR_MS, 3, close=2.0)
+    merged = cache.merge("BTC/USDT", "1h", 5, fresh)
+    assert [row[0] for row in merged] == [start + i * HOUR_MS for i in range(2, 7)]
+    # Незакрытая свеча из буфера заменена свежей, закрытые остались как были
+    assert [row[4] for row in merged] == [1.0, 1.0, 2.0, 2.0, 2.0]
+    assert cache.stats()["incremental_refreshes"] == 1 and cache.rows_refreshed == 3
+    assert cache.merge("ETH/USDT", "1h", 5, fresh) is None
+
+
+# --- Запросы к бирже ---
+
+class FakeExchange:
+    """Биржа с часовыми свечами до текущей (незакрытой) включительно; запоминает запросы."""
+
+    def __init__(self, clock: Clock):
+        self.clock = clock
+        self.calls = []
+
+    def _rows(self, since: int = None, limit: int = None) -> list:
+        current = int(self.clock.now // HOUR) * HOUR_MS
+        first = since if since is not None else current - (limit - 1) * HOUR_MS
+        count = (current - first) // HOUR_MS + 1
+        # Цена закрытия - время запроса: так видно, какая версия свечи в буфере
+        return candles(first, min(count, limit), close=self.clock.now)
+
+    def fetch_ohlcv(self, symbol, timeframe="1h", since=None, limit=None):
+        self.calls.append({"since": since, "limit": limit} if since is not None else {"limit": limit})
+        return self._rows(since, limit)
+
+
+class AsyncFakeExchange(FakeExchange):
+    async def fetch_ohlcv(self, symbol, timeframe="1h", since=None, limit=None):
+        await asyncio.sleep(0)
+        return super().fetch_ohlcv(symbol, timeframe, since, limit)
+
+
+@pytest.fixture
+def cache(clock, monkeypatch):
+    cache = OHLCVCache()
+    monkeypatch.setattr(market_data, "ohlcv_cache", cache)
+    return cache
+
+
+def test_refresh_requests_only_new_candles(clock, cache):
+    exchange = FakeExchange(clock)
+    first = market_data.fetch_ohlcv_cached(exchange, "BTC/USDT", "1h", limit=5)
+    assert market_data.fetch_ohlcv_cached(exchange, "BTC/USDT", "1h", limit=5) == first
+    assert exchange.calls == [{"limit": 5}]
+
+    clock.now += 2 * HOUR
+    refreshed = market_data.fetch_ohlcv_cached(exchange, "BTC/USDT", "1h", limit=5)
+    last = first[-1][0]
+    # Две новые свечи плюс незакрытая из буфера и одна про запас
+    assert exchange.calls[1] == {"since": last, "limit": 4}
+    assert [row[0] for row in refreshed] == [last + i * HOUR_MS for i in range(-2, 3)]
+    assert refreshed[:2] == first[-3:-1]
+    assert all(row[4] == clock.now for row in refreshed[2:])
+    assert cache.stats()["incremental_refreshes"] == 1
+
+
+def test_gap_larger_than_window_refetches_everything(clock, cache):
+    exchange = FakeExchange(clock)
+    market_data.fetch_ohlcv_cached(exchange, "BTC/USDT", "1h", limit=5)
+    clock.now += 10 * HOUR
+    result = market_data.fetch_ohlcv_cached(exchange, "BTC/USDT", "1h", limit=5)
+    assert exchange.calls == [{"limit": 5}, {"limit": 5}]
+    assert len(result) == 5 and cache.refreshes == 0
+
+
+def test_empty_refresh_falls_back_to_full_fetch(clock, cache):
+    exchange = FakeExchange(clock)
+    market_data.fetch_ohlcv_cached(exchange, "BTC/USDT", "1h", limit=5)
+    clock.now += HOUR
+    fetch = exchange.fetch_ohlcv
+
+    def empty_refresh(symbol, timeframe="1h", since=None, limit=None):
+        rows = fetch(symbol, timeframe, since, limit)
+        return [] if since is not None else rows
+
+    exchange.fetch_ohlcv = empty_refresh
+    result = market_data.fetch_ohlcv_cached(exchange, "BTC/USDT", "1h", limit=5)
+    assert [c.get("since") is not None for c in exchange.calls] == [False, True, False]
+    assert len(result) == 5 and result[-1][0] == int(clock.now // HOUR) * HOUR_MS
+
+
+def test_async_misses_share_one_request(clock, cache):
+    exchange = AsyncFakeExchange(clock)
+
+    async def scenario():
+        return await asyncio.gather(*(
+            market_data.fetch_ohlcv_cached_async(exchange, "BTC/USDT", "1h", limit=5) for _ in range(3)))
+
+    results = asyncio.run(scenario())
+    assert exchange.calls == [{"limit": 5}]
+    assert results[0] == results[1] == results[2] and len(results[0]) == 5
+    assert market_data._inflight_fetches == {}
+
+    clock.now += HOUR
+    asyncio.run(scenario())
+    assert exchange.calls[1] == {"since": results[0][-1][0], "limit": 3}
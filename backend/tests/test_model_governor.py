@@ -0,0 +1,183 @@
+# backend/tests/test_model_governor.py
+"""
+Регулятор запросов к модели: границы настроек и автомат размыкателя - отмененный
+пробный запрос не должен оставлять цепь в half_open навсегда.
+"""
+
+import asyncio
+
+import pytest
+
+from model_governor import (ModelGovernor, TokenBucket, CircuitBreaker, ModelUnavailableError,
+                            CLOSED, OPEN, HALF_OPEN)
+
+
+def test_zero_retries_still_makes_one_call():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        return "ok"
+
+    governor = ModelGovernor(max_retries=0, rate_per_minute=60)
+    assert asyncio.run(governor.call(fn)) == "ok"
+    assert calls == [1]
+
+
+def test_zero_retries_raises_the_call_error():
+    async def fn():
+        raise RuntimeError("boom")
+
+    governor = ModelGovernor(max_retries=0, rate_per_minute=60)
+    with pytest.raises(RuntimeError):
+        asyncio.run(governor.call(fn))
+
+
+@pytest.mark.parametrize("rate", [0, -1])
+def test_non_positive_rate_is_rejected(rate):
+    with pytest.raises(ValueError):
+        ModelGovernor(rate_per_minute=rate)
+    with pytest.raises(ValueError):
+        TokenBucket(rate, burst=1)
+
+
+# --- Автомат размыкателя: closed -> open -> half_open -> closed/open ---
+
+async def ok():
+    return "ok"
+
+
+async def fail():
+    raise RuntimeError("API недоступно")
+
+
+def make_governor(cooldown: float = 0.05, **kwargs) -> ModelGovernor:
+    options = dict(rate_per_minute=6000, burst=10, max_retries=1, backoff_base=0)
+    options.update(kwargs)
+    return ModelGovernor(breaker=CircuitBreaker(threshold=1, cooldown=cooldown), **options)
+
+
+async def open_breaker(governor: ModelGovernor):
+    with pytest.raises(RuntimeError):
+        await governor.call(fail)
+    assert governor.breaker.state == OPEN
+    with pytest.raises(ModelUnavailableError):
+        await governor.call(ok)
+    await asyncio.sleep(governor.breaker.cooldown + 0.01)
+
+
+def test_trial_success_closes_breaker():
+    async def scenario():
+        governor = make_governor()
+        await open_breaker(governor)
+        assert await governor.call(ok) == "ok"
+        assert governor.breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_trial_failure_reopens_breaker():
+    async def scenario():
+        governor = make_governor()
+        await open_breaker(governor)
+        with pytest.raises(RuntimeError):
+            await governor.call(fail)
+        assert governor.breaker.state == OPEN
+        assert governor.breaker.opens == 2
+
+    asyncio.run(scenario())
+
+
+def test_calls_wait_for_trial_outcome():
+    async def scenario():
+        governor = make_governor()
+        await open_breaker(governor)
+        gate = asyncio.Event()
+
+        async def slow():
+            await gate.wait()
+            return "trial"
+
+        trial = asyncio.create_task(governor.call(slow))
+        await asyncio.sleep(0.01)
+        assert governor.breaker.state == HALF_OPEN
+        waiter = asyncio.create_task(governor.call(ok))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        gate.set()
+        assert await trial == "trial"
+        assert await asyncio.wait_for(waiter, 1) == "ok"
+
+    asyncio.run(scenario())
+
+
+def test_trial_cancelled_in_rate_limit_wait_releases_slot():
+    async def scenario():
+        # Одна заявка в секунду: после открытия цепи корзина пуста, и пробный запрос ждет токен
+        governor = make_governor(rate_per_minute=60, burst=1)
+        await open_breaker(governor)
+        trial = asyncio.create_task(governor.call(ok))
+        await asyncio.sleep(0.01)
+        assert governor.breaker.state == HALF_OPEN
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert governor.breaker._trial is None
+        governor._buckets.clear()
+        assert await asyncio.wait_for(governor.call(ok), 1) == "ok"
+        assert governor.breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_trial_cancelled_in_semaphore_wait_releases_slot():
+    async def scenario():
+        governor = make_governor(concurrency=1)
+        gate = asyncio.Event()
+
+        async def hold():
+            await gate.wait()
+            return "held"
+
+        # Запрос, начатый до размыкания, занимает единственный слот семафора
+        holder = asyncio.create_task(governor.call(hold))
+        await asyncio.sleep(0.01)
+        governor._semaphore, semaphore = asyncio.Semaphore(1), governor._semaphore
+        await open_breaker(governor)
+        governor._semaphore = semaphore
+
+        trial = asyncio.create_task(governor.call(ok))
+        await asyncio.sleep(0.01)
+        assert governor.breaker.state == HALF_OPEN
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert governor.breaker._trial is None
+
+        waiter = asyncio.create_task(governor.call(ok))
+        await asyncio.sleep(0.01)
+        gate.set()
+        assert await holder == "held"
+        assert await asyncio.wait_for(waiter, 1) == "ok"
+
+    asyncio.run(scenario())
+
+
+def test_trial_cancelled_inside_call_releases_slot():
+    async def scenario():
+        governor = make_governor()
+        await open_breaker(governor)
+
+        async def hang():
+            await asyncio.Event().wait()
+
+        trial = asyncio.create_task(governor.call(hang))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert governor.breaker.state == HALF_OPEN
+        assert governor.in_flight == 0
+        assert await asyncio.wait_for(governor.call(ok), 1) == "ok"
+
+    asyncio.run(scenario())
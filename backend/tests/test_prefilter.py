@@ -0,0 +1,110 @@
+# backend/tests/test_prefilter.py
+"""
+Первая ступень предварительного фильтра на синтетических свечах: тренд проходит,
+флэт отсекается, таймфреймы без свечей не учитываются в пороге min_active.
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import logic
+import prefilter
+import strategies
+
+CANDLES = 200
+
+
+def make_candles(closes, spread: float = 0.5) -> list:
+    return [[i * 3_600_000, closes[i - 1] if i else closes[0], close + spread, close - spread, close, 1000.0]
+            for i, close in enumerate(closes)]
+
+
+def trending() -> list:
+    return make_candles(100 + np.arange(CANDLES, dtype=float))
+
+
+def flat() -> list:
+    return make_candles(100 + np.random.default_rng(0).normal(0, 0.3, CANDLES))
+
+
+def settings(**overrides) -> dict:
+    return {**strategies.DEFAULT_PREFILTER, "enabled": True, "model_timeframe": "1h", **overrides}
+
+
+def test_features_of_trend_and_flat():
+    features = prefilter.frame_features({"1h": trending(), "4h": flat(), "1d": []})
+    assert set(features) == {"1h", "4h"}
+    assert features["1h"]["adx"] > 90 and features["1h"]["rsi"] > 90
+    assert features["4h"]["adx"] < 25 and 30 < features["4h"]["rsi"] < 70
+    assert features["4h"]["bb_expansion"] < 1.5
+
+
+def test_trend_passes():
+    verdict = prefilter.screen_numeric(settings(), {"1h": trending(), "4h": flat()})
+    assert verdict.passed
+    assert verdict.reason == "Активные таймфреймы: 1h."
+
+
+def test_flat_is_rejected():
+    verdict = prefilter.screen_numeric(settings(), {"1h": flat(), "4h": flat()})
+    assert not verdict.passed
+    assert "активных таймфреймов 0 из 2" in verdict.reason
+
+
+def test_min_active_counts_only_frames_with_candles():
+    # Скальпинг требует два активных таймфрейма, но свечи есть только у одного
+    verdict = prefilter.screen_numeric(settings(min_active=2), {"1h": trending(), "15m": [], "5m": None})
+    assert verdict.passed
+    assert list(verdict.features) == ["1h"]
+
+
+def test_min_active_still_applies_to_frames_with_candles():
+    verdict = prefilter.screen_numeric(settings(min_active=2), {"1h": trending(), "4h": flat()})
+    assert not verdict.passed
+    assert "активных таймфреймов 1 из 2 при минимуме 2" in verdict.reason
+
+
+def test_no_candles_passes_to_model():
+    verdict = prefilter.screen_numeric(settings(), {"1h": [], "4h": []})
+    assert verdict.passed and not verdict.features
+
+
+def test_short_history_is_left_to_model():
+    # Меньше свечей, чем нужно ADX, - индикаторы не определены, решает основная модель
+    verdict = prefilter.screen_numeric(settings(), {"1h": flat()[:10]})
+    assert verdict.passed
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    fresh = prefilter.PrefilterStats()
+    monkeypatch.setattr(prefilter, "prefilter_stats", fresh)
+    monkeypatch.setattr(prefilter, "PREFILTER_ENABLED", True)
+    return fresh
+
+
+def strategy(**overrides) -> dict:
+    return {"prefilter": settings(**overrides), "consensus": dict(strategies.DEFAULT_CONSENSUS)}
+
+
+def test_prefilter_analysis_rejects_flat(stats):
+    result = asyncio.run(logic.prefilter_analysis("BTC/USDT", strategy(), {"1h": flat(), "4h": flat()}))
+    assert result["status"] == "no_signal"
+    assert result["prefilter"]["stage"] == "indicators"
+    assert stats.stats()["rejected"]["indicators"] == 1
+    assert stats.charts_skipped == 2
+    assert stats.expensive_calls_saved == logic.expected_model_calls(strategies.DEFAULT_CONSENSUS)
+
+
+def test_prefilter_analysis_passes_trend(stats):
+    assert asyncio.run(logic.prefilter_analysis("BTC/USDT", strategy(), {"1h": trending(), "4h": flat()})) is None
+    assert stats.passed == 1
+
+
+def test_prefilter_analysis_disabled(stats, monkeypatch):
+    assert asyncio.run(logic.prefilter_analysis("BTC/USDT", strategy(enabled=False), {"1h": flat()})) is None
+    monkeypatch.setattr(prefilter, "PREFILTER_ENABLED", False)
+    assert asyncio.run(logic.prefilter_analysis("BTC/USDT", strategy(), {"1h": flat()})) is None
+    assert stats.screened == 0
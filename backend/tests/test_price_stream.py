@@ -0,0 +1,169 @@
+# backend/tests/test_price_stream.py
+"""
+Потоковый трекер: границы поиска пересеченных уровней в TriggerIndex и полный прогон
+StreamTracker против локального replay_feed на SQLite - переходы, записанные в БД,
+и команды SUBSCRIBE/UNSUBSCRIBE, полученные сервером.
+"""
+
+import json
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+import websockets
+from sqlalchemy import select
+
+import database
+import price_stream
+import replay_feed
+from price_stream import TriggerIndex, StreamTracker, BELOW, ABOVE
+
+
+# --- TriggerIndex.crossed ---
+
+def make_index() -> TriggerIndex:
+    index = TriggerIndex()
+    index.add(BELOW, 100.0, 1, 'entry')        # Long: вход при падении до 100
+    index.add(BELOW, 100.0, 2, 'stop_loss')    # тот же уровень у другого сигнала
+    index.add(BELOW, 95.0, 3, 'stop_loss')
+    index.add(ABOVE, 110.0, 4, 'take_profit')  # Long: тейк при росте до 110
+    index.add(ABOVE, 120.0, 5, 'entry')
+    return index
+
+
+@pytest.mark.parametrize("price, expected", [
+    (100.5, []),
+    (100.0, [(1, 'entry'), (2, 'stop_loss')]),
+    (99.99, [(1, 'entry'), (2, 'stop_loss')]),
+    (95.0, [(3, 'stop_loss'), (1, 'entry'), (2, 'stop_loss')]),
+    (109.99, []),
+    (110.0, [(4, 'take_profit')]),
+    (125.0, [(4, 'take_profit'), (5, 'entry')]),
+])
+def test_crossed_boundaries(price, expected):
+    assert make_index().crossed(price) == expected
+
+
+def test_crossed_after_remove():
+    index = make_index()
+    index.remove(1)
+    assert index.crossed(100.0) == [(2, 'stop_loss')]
+    index.remove(4)
+    index.remove(5)
+    assert index.crossed(1000.0) == []
+    assert len(index) == 2
+    # Повторное удаление и неизвестный сигнал ничего не ломают
+    index.remove(1)
+    index.remove(42)
+    assert len(index) == 2
+
+
+def test_crossed_with_empty_sides():
+    index = TriggerIndex()
+    assert index.crossed(100.0) == []
+    index.add(ABOVE, 10.0, 1, 'take_profit')
+    assert index.crossed(0.0) == [] and index.crossed(10.0) == [(1, 'take_profit')]
+
+
+# --- StreamTracker против replay_feed ---
+
+SIGNAL = dict(user_id=1, analysis_summary="s", entry_type="Limit", risk_reward_ratio="1:2", consensus="2/3")
+
+
+class RecordingSocket:
+    """Обертка над соединением сервера, запоминающая команды клиента."""
+
+    def __init__(self, ws, commands: list):
+        self.ws = ws
+        self.commands = commands
+
+    async def send(self, message: str):
+        await self.ws.send(message)
+
+    async def __aiter__(self):
+        async for raw in self.ws:
+            self.commands.append(json.loads(raw))
+            yield raw
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not await condition():
+        assert time.monotonic() < deadline, "Не дождались ожидаемого состояния"
+        await asyncio.sleep(0.02)
+
+
+def test_stream_tracker_against_replay_feed(sqlite_db, monkeypatch):
+    monkeypatch.setattr(price_stream, "STREAM_FLUSH_INTERVAL", 0.05)
+    monkeypatch.setattr(price_stream, "STREAM_RESYNC_INTERVAL", 60)
+    now = database.utcnow()
+    base = int(time.time() * 1000)
+
+    async def scenario():
+        async with sqlite_db.engine.begin() as conn:
+            await conn.execute(database.analyses.insert(), [
+                dict(SIGNAL, symbol="BTC/USDT", direction="Long", status="active", entry_price="100",
+                     stop_loss=95.0, take_profit=110.0, invalidation_hours=24, timestamp=now),
+                dict(SIGNAL, symbol="ETH/USDT", direction="Short", status="activated", entry_price="200",
+                     stop_loss=210.0, take_profit=180.0, invalidation_hours=24, timestamp=now, entry_timestamp=now),
+                # Уже истек: закрывается по времени без единой сделки
+                dict(SIGNAL, symbol="SOL/USDT", direction="Long", status="active", entry_price="50",
+                     stop_loss=45.0, take_profit=60.0, invalidation_hours=1, timestamp=now - timedelta(hours=2)),
+            ])
+
+        ticks = [
+            # Первая сделка по неподписанному символу дает трекеру время подписаться
+            {"symbol": "ZZZ/USDT", "price": 1.0, "time": base},
+            {"symbol": "BTC/USDT", "price": 101.0, "time": base + 300},
+            {"symbol": "BTC/USDT", "price": 99.5, "time": base + 350},
+            {"symbol": "ETH/USDT", "price": 190.0, "time": base + 400},
+            {"symbol": "ETH/USDT", "price": 179.0, "time": base + 450},
+            {"symbol": "BTC/USDT", "price": 111.0, "time": base + 500},
+        ]
+        commands = []
+        server = await websockets.serve(
+            lambda ws: replay_feed.serve_connection(RecordingSocket(ws, commands), ticks, speed=1.0), "localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+        tracker = StreamTracker(feed_url=f"ws://localhost:{port}", engine=sqlite_db.engine)
+        running = asyncio.create_task(tracker.run())
+
+        async def rows() -> dict:
+            async with sqlite_db.engine.connect() as conn:
+                result = await conn.execute(select(database.analyses))
+            return {row.symbol: row for row in result}
+
+        async def all_closed() -> bool:
+            return all(row.status not in ("active", "activated") for row in (await rows()).values())
+
+        async def all_unsubscribed() -> bool:
+            return not tracker.subscribed and any(c["method"] == "UNSUBSCRIBE" for c in commands)
+
+        try:
+            await wait_for(all_closed)
+            await wait_for(all_unsubscribed)
+        finally:
+            running.cancel()
+            await asyncio.gather(running, return_exceptions=True)
+            server.close()
+            await server.wait_closed()
+        return await rows(), commands, tracker
+
+    final, commands, tracker = asyncio.run(scenario())
+
+    def at(offset_ms: int) -> datetime:
+        return price_stream._from_ms(base + offset_ms)
+
+    btc, eth, sol = final["BTC/USDT"], final["ETH/USDT"], final["SOL/USDT"]
+    assert (btc.status, btc.entry_timestamp, btc.closed_timestamp) == ("take_profit_hit", at(350), at(500))
+    assert (eth.status, eth.closed_timestamp) == ("take_profit_hit", at(450))
+    # Время истечения хранится с точностью до миллисекунды
+    assert sol.status == "expired"
+    assert sol.closed_timestamp == now - timedelta(hours=1, microseconds=now.microsecond % 1000)
+
+    streams = {s: price_stream.stream_name(s) for s in ("BTC/USDT", "ETH/USDT", "SOL/USDT")}
+    subscribed = [c for c in commands if c["method"] == "SUBSCRIBE"]
+    unsubscribed = {p for c in commands if c["method"] == "UNSUBSCRIBE" for p in c["params"]}
+    assert subscribed[0]["params"] == sorted(streams.values())
+    assert unsubscribed == set(streams.values())
+    assert tracker.fired == 4 and tracker.stats()["pending_writes"] == 0
@@ -0,0 +1,83 @@
+# backend/tests/test_strategies.py
+"""
+Промпт предварительного фильтра живет в реестре стратегий: проверяется при загрузке
+вместе с остальными промптами и перечитывается при изменении файла.
+"""
+
+import os
+import json
+import shutil
+
+import pytest
+
+import model_backends
+import prefilter
+import strategies
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_registry(tmp_path) -> strategies.StrategyRegistry:
+    shutil.copy(os.path.join(BACKEND_DIR, "config.json"), tmp_path / "config.json")
+    shutil.copytree(os.path.join(BACKEND_DIR, "prompts"), tmp_path / "prompts")
+    return strategies.StrategyRegistry(str(tmp_path / "config.json"))
+
+
+def test_screening_prompt_is_rendered_from_registry(tmp_path):
+    registry = make_registry(tmp_path)
+    registry.load()
+    prompt = registry.render_screening_prompt("BTC/USDT", "1h")
+    assert "BTC/USDT" in prompt and "1h" in prompt
+    assert '{"setup": true' in prompt
+
+
+def test_unknown_field_in_screening_prompt_fails_load(tmp_path):
+    registry = make_registry(tmp_path)
+    (tmp_path / "prompts" / "prefilter_prompt.txt").write_text("{symbol} {current_price}", encoding="utf-8")
+    with pytest.raises(strategies.StrategyConfigError, match="current_price"):
+        registry.load()
+
+
+def test_screening_prompt_file_can_be_overridden(tmp_path):
+    registry = make_registry(tmp_path)
+    config = json.loads((tmp_path / "config.json").read_text(encoding="utf-8"))
+    config["prefilter_prompt_file"] = "screen.txt"
+    (tmp_path / "config.json").write_text(json.dumps(config), encoding="utf-8")
+    (tmp_path / "screen.txt").write_text("Свой фильтр {symbol}", encoding="utf-8")
+    registry.load()
+    assert registry.render_screening_prompt("ETH/USDT", "4h") == "Свой фильтр ETH/USDT"
+
+
+def test_screening_prompt_change_is_reloaded(tmp_path, monkeypatch):
+    monkeypatch.setattr(strategies, "RELOAD_CHECK_INTERVAL", 0)
+    registry = make_registry(tmp_path)
+    registry.load()
+    path = tmp_path / "prompts" / "prefilter_prompt.txt"
+    path.write_text("Новый фильтр {symbol} {timeframe}", encoding="utf-8")
+    os.utime(path, ns=(1, 1))
+    assert registry.render_screening_prompt("BTC/USDT", "1h") == "Новый фильтр BTC/USDT 1h"
+    assert registry.reloads == 2
+
+
+def test_screening_backend_comes_from_shared_factory(monkeypatch):
+    monkeypatch.setattr(model_backends, "MODEL_BACKEND", "stub")
+    monkeypatch.setattr(model_backends, "_backends", {})
+    screening = prefilter.get_screening_backend()
+    assert isinstance(screening, model_backends.StubBackend)
+    assert screening.responses == [prefilter.STUB_SCREENING_RESPONSE]
+    assert prefilter.get_screening_backend() is screening
+    assert model_backends.get_backend() is not screening
+
+
+def test_registry_loads_lazily_on_first_access(tmp_path):
+    registry = make_registry(tmp_path)
+    assert "swing" in registry.keys()
+    assert registry.get("swing")["prompt_template"]
+    assert registry.reloads == 1
+
+
+def test_lazy_load_reports_config_error(tmp_path):
+    registry = make_registry(tmp_path)
+    (tmp_path / "config.json").write_text("{}", encoding="utf-8")
+    with pytest.raises(strategies.StrategyConfigError, match="нет ни одной стратегии"):
+        registry.get("swing")
@@ -0,0 +1,85 @@
+# backend/tests/test_streaming_indicators.py
+"""
+Потоковые индикаторы, проинициализированные частью истории и затем обновляемые
+по одной свече, должны совпадать с пакетными rsi/bbands/atr/adx по всему ряду.
+"""
+
+import numpy as np
+import pytest
+
+import indicators
+
+N_BARS = 260
+SEED_LENGTHS = [1, 5, 30, 200]
+TOLERANCE = dict(rtol=1e-6, atol=1e-6)
+
+
+@pytest.fixture(scope="module")
+def candles():
+    rng = np.random.default_rng(7)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, N_BARS)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.005, N_BARS)) * close
+    return np.maximum(open_, close) + spread, np.minimum(open_, close) - spread, close
+
+
+def assert_close(actual: float, expected: float, label: str):
+    if np.isnan(expected):
+        assert np.isnan(actual), f"{label}: ожидался NaN, получено {actual}"
+    else:
+        np.testing.assert_allclose(actual, expected, err_msg=label, **TOLERANCE)
+
+
+@pytest.mark.parametrize("seed", SEED_LENGTHS)
+def test_streaming_rsi(candles, seed):
+    _, _, close = candles
+    expected = indicators.rsi(close)
+    stream = indicators.StreamingRSI(close[:seed])
+    assert_close(stream.value, expected[seed - 1], f"seed {seed}")
+    for i in range(seed, N_BARS):
+        assert_close(stream.update(close[i]), expected[i], f"seed {seed}, свеча {i}")
+
+
+@pytest.mark.parametrize("seed", SEED_LENGTHS)
+def test_streaming_bbands(candles, seed):
+    _, _, close = candles
+    upper, lower = indicators.bbands(close)
+    stream = indicators.StreamingBBands(close[:seed])
+    for i in range(seed, N_BARS):
+        stream_upper, stream_lower = stream.update(close[i])
+        assert_close(stream_upper, upper[i], f"upper, seed {seed}, свеча {i}")
+        assert_close(stream_lower, lower[i], f"lower, seed {seed}, свеча {i}")
+
+
+@pytest.mark.parametrize("seed", SEED_LENGTHS)
+def test_streaming_atr(candles, seed):
+    high, low, close = candles
+    expected = indicators.atr(high, low, close)
+    stream = indicators.StreamingATR(high[:seed], low[:seed], close[:seed])
+    assert_close(stream.value, expected[seed - 1], f"seed {seed}")
+    for i in range(seed, N_BARS):
+        assert_close(stream.update(high[i], low[i], close[i]), expected[i], f"seed {seed}, свеча {i}")
+
+
+@pytest.mark.parametrize("seed", SEED_LENGTHS)
+def test_streaming_adx(candles, seed):
+    high, low, close = candles
+    expected = indicators.adx(high, low, close)
+    stream = indicators.StreamingADX(high[:seed], low[:seed], close[:seed])
+    assert_close(stream.value, expected[seed - 1], f"seed {seed}")
+    for i in range(seed, N_BARS):
+        assert_close(stream.update(high[i], low[i], close[i]), expected[i], f"seed {seed}, свеча {i}")
+
+
+def test_candle_indicator_stream(candles):
+    high, low, close = candles
+    ohlcv = [[i, close[i], high[i], low[i], close[i], 1.0] for i in range(N_BARS)]
+    stream = indicators.CandleIndicatorStream(ohlcv[:100])
+    for candle in ohlcv[100:]:
+        values = stream.update(candle)
+    upper, lower = indicators.bbands(close)
+    assert_close(values["rsi"], indicators.rsi(close)[-1], "rsi")
+    assert_close(values["bb_upper"], upper[-1], "bb_upper")
+    assert_close(values["bb_lower"], lower[-1], "bb_lower")
+    assert_close(values["atr"], indicators.atr(high, low, close)[-1], "atr")
+    assert_close(values["adx"], indicators.adx(high, low, close)[-1], "adx")
@@ -0,0 +1,51 @@
+# backend/tests/test_stub_signal.py
+"""
+Ответ заглушки модели проходит весь путь сигнала: консенсус, decide_signal и
+сохранение через save_analysis_result - как в бенчмарке с MODEL_BACKEND=stub.
+Неполный бэкенд отклоняется уже при создании.
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+import database
+import jobs
+import logic
+import main
+import model_backends
+import response_cache
+from model_backends import StubBackend
+
+CHARTS = ["chart_1h.png", "chart_4h.png"]
+
+
+def test_stub_response_is_saved_as_signal(tmp_path, monkeypatch, sqlite_db):
+    monkeypatch.setattr(logic, "response_cache", response_cache.ResponseCache(path=str(tmp_path / "cache.db"), mode="off"))
+    monkeypatch.setattr(main, "AsyncSessionLocal", sqlite_db.sessions)
+
+    async def scenario():
+        results = await logic.gather_opinions(CHARTS, "промпт", backend=StubBackend(latency_ms=0))
+        result = logic.decide_signal(results, CHARTS)
+        assert result["status"] == "success"
+        await main.save_analysis_result(jobs.Job("STUB/USDT", "swing", user_id=1), result)
+
+        async with sqlite_db.engine.connect() as conn:
+            return (await conn.execute(select(database.analyses))).mappings().one()
+
+    row = asyncio.run(scenario())
+    assert row["symbol"] == "STUB/USDT"
+    assert row["direction"] == "Long"
+    assert row["entry_price"] == "100.0"
+    assert row["consensus"] == f"{logic.TARGET_SUCCESSFUL_RUNS}/{logic.TARGET_SUCCESSFUL_RUNS}"
+
+
+def test_incomplete_backend_fails_on_creation():
+    class NoGenerate(model_backends.ModelBackend):
+        async def open_session(self, image_paths: list):
+            return None
+
+    with pytest.raises(TypeError, match="generate"):
+        NoGenerate()
+    assert isinstance(StubBackend(latency_ms=0), model_backends.ModelBackend)
@@ -0,0 +1,123 @@
+# backend/tests/test_tracker_candles.py
+"""
+Разбор минутных свечей трекером (TRACKER_MODE=candles): активация лимитных сигналов,
+консервативный порядок TP/SL внутри свечи и истечение по времени.
+"""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import tracker
+
+T0 = datetime(2026, 1, 1, 12, 0, 0)
+MINUTE = timedelta(minutes=1)
+
+
+@pytest.fixture(autouse=True)
+def clean_last_checked():
+    tracker.last_checked.clear()
+    yield
+    tracker.last_checked.clear()
+
+
+def make_signal(direction="Long", status="active", entry_price="100", stop_loss=95.0, take_profit=110.0,
+                timestamp=T0, invalidation_hours=24, entry_timestamp=None, signal_id=1):
+    return SimpleNamespace(id=signal_id, symbol="BTC/USDT", direction=direction, status=status,
+                           entry_price=entry_price, stop_loss=stop_loss, take_profit=take_profit,
+                           timestamp=timestamp, invalidation_hours=invalidation_hours,
+                           entry_timestamp=entry_timestamp)
+
+
+def candle(minute: int, high: float, low: float) -> list:
+    return [tracker._to_ms(T0 + minute * MINUTE), (high + low) / 2, high, low, (high + low) / 2, 1.0]
+
+
+def resolve(signal, candles, now=T0 + 10 * MINUTE) -> dict:
+    return tracker.resolve_with_candles([signal], candles, now).get(signal.id)
+
+
+def test_long_activates_on_first_touch():
+    changes = resolve(make_signal(), [candle(0, 102, 101), candle(1, 101, 99.5), candle(2, 101, 99)])
+    assert changes == {"status": "activated", "entry_timestamp": T0 + MINUTE}
+
+
+def test_short_activates_on_first_touch():
+    changes = resolve(make_signal("Short", stop_loss=105.0, take_profit=90.0),
+                      [candle(0, 99, 98), candle(1, 100.5, 99)])
+    assert changes == {"status": "activated", "entry_timestamp": T0 + MINUTE}
+
+
+def test_creation_candle_does_not_activate():
+    # Сигнал создан в 12:00:30, а минимум свечи 12:00 мог быть до него
+    created = T0 + timedelta(seconds=30)
+    signal = make_signal(timestamp=created)
+    assert resolve(signal, [candle(0, 101, 99), candle(1, 102, 101)]) is None
+    assert tracker.last_checked[signal.id] == tracker._to_ms(T0 + MINUTE)
+
+    changes = resolve(signal, [candle(0, 101, 99), candle(1, 102, 101), candle(2, 101, 99.9)])
+    assert changes["entry_timestamp"] == T0 + 2 * MINUTE
+    assert changes["entry_timestamp"] >= created
+
+
+def test_stop_loss_counts_in_activation_candle():
+    changes = resolve(make_signal(), [candle(0, 101, 94)])
+    assert changes == {"status": "stop_loss_hit", "entry_timestamp": T0, "closed_timestamp": T0}
+
+
+def test_take_profit_counts_from_next_candle():
+    changes = resolve(make_signal(), [candle(0, 111, 99)])
+    assert changes == {"status": "activated", "entry_timestamp": T0}
+
+    tracker.last_checked.clear()
+    changes = resolve(make_signal(), [candle(0, 111, 99), candle(1, 111, 100)])
+    assert changes == {"status": "take_profit_hit", "entry_timestamp": T0, "closed_timestamp": T0 + MINUTE}
+
+
+def test_stop_loss_wins_a_tie():
+    signal = make_signal(status="activated", entry_timestamp=T0)
+    changes = resolve(signal, [candle(1, 111, 94)])
+    assert changes == {"status": "stop_loss_hit", "closed_timestamp": T0 + MINUTE}
+
+
+def test_short_take_profit_and_stop_loss():
+    short = dict(direction="Short", status="activated", stop_loss=105.0, take_profit=90.0, entry_timestamp=T0)
+    assert resolve(make_signal(**short), [candle(1, 101, 89)]) == {"status": "take_profit_hit",
+                                                                  "closed_timestamp": T0 + MINUTE}
+    tracker.last_checked.clear()
+    assert resolve(make_signal(**short), [candle(1, 106, 99)]) == {"status": "stop_loss_hit",
+                                                                  "closed_timestamp": T0 + MINUTE}
+
+
+def test_activated_signal_closes_no_earlier_than_entry():
+    # Вход записан тикерным режимом посреди минуты: стоп в той же свече закрывает позицию не раньше входа
+    entry = T0 + timedelta(seconds=30)
+    signal = make_signal(status="activated", entry_timestamp=entry)
+    assert resolve(signal, [candle(0, 101, 94)]) == {"status": "stop_loss_hit", "closed_timestamp": entry}
+
+
+def test_take_profit_ignores_entry_candle_of_activated_signal():
+    signal = make_signal(status="activated", entry_timestamp=T0 + timedelta(seconds=30))
+    assert resolve(signal, [candle(0, 111, 100)]) is None
+    tracker.last_checked.clear()
+    assert resolve(signal, [candle(0, 111, 100), candle(1, 111, 100)])["status"] == "take_profit_hit"
+
+
+def test_expiry_without_touch():
+    signal = make_signal(invalidation_hours=1)
+    now = T0 + timedelta(hours=1, minutes=5)
+    changes = resolve(signal, [candle(0, 102, 101), candle(61, 102, 101)], now=now)
+    assert changes == {"status": "expired", "closed_timestamp": T0 + timedelta(hours=1)}
+
+
+def test_touch_after_expiry_does_not_activate():
+    signal = make_signal(invalidation_hours=1)
+    now = T0 + timedelta(hours=1, minutes=5)
+    changes = resolve(signal, [candle(0, 102, 101), candle(60, 101, 99)], now=now)
+    assert changes["status"] == "expired"
+
+
+def test_market_signal_is_never_activated_by_price():
+    signal = make_signal(entry_price="Market")
+    assert resolve(signal, [candle(0, 101, 90)]) is None
@@ -0,0 +1,170 @@
+# backend/tests/test_tracker_shards.py
+"""
+Несколько воркеров трекера на одной SQLite: шарды не пересекаются, делятся заново,
+когда приходит новый воркер, переходят к живому после истечения аренды упавшего,
+а один и тот же переход, примененный дважды, меняет строку только один раз.
+"""
+
+import asyncio
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+import database
+import shards
+import tracker
+
+SHARDS = 4
+SYMBOLS = ["BTC/USDT", "ETH/USDT", "SOL/USDT", "XRP/USDT", "ADA/USDT", "DOGE/USDT", "BNB/USDT", "TRX/USDT"]
+SIGNAL = dict(user_id=1, analysis_summary="s", direction="Long", entry_type="Limit", entry_price="100",
+              stop_loss=95.0, take_profit=110.0, risk_reward_ratio="1:2", invalidation_hours=24,
+              consensus="2/3", status="active")
+
+
+class FakeExchange:
+    """Биржа с одинаковой ценой для всех символов; запоминает, какие символы у нее спросили."""
+
+    def __init__(self, price: float):
+        self.price = price
+        self.requested = []
+
+    async def fetch_tickers(self, symbols: list) -> dict:
+        self.requested.extend(symbols)
+        return {s: {"last": self.price} for s in symbols}
+
+
+def make_leases(db, owner: str) -> shards.ShardLeases:
+    return shards.ShardLeases(shards=SHARDS, owner=owner, ttl=60, engine=db.engine)
+
+
+async def statuses(db) -> dict:
+    async with db.engine.connect() as conn:
+        rows = (await conn.execute(select(database.analyses.c.symbol, database.analyses.c.status))).fetchall()
+    return dict(rows)
+
+
+def run(scenario):
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def db(sqlite_db, monkeypatch):
+    monkeypatch.setattr(tracker, "async_engine", sqlite_db.engine)
+    monkeypatch.setattr(tracker, "TRACKER_MODE", "ticker")
+
+    async def fill():
+        async with sqlite_db.engine.begin() as conn:
+            await conn.execute(database.analyses.insert(), [dict(SIGNAL, symbol=s) for s in SYMBOLS])
+
+    asyncio.run(fill())
+    return sqlite_db
+
+
+def test_symbols_cover_every_shard():
+    # Иначе проверки ниже не задействуют часть шардов
+    assert {shards.shard_of(s, SHARDS) for s in SYMBOLS} == set(range(SHARDS))
+
+
+def test_workers_own_disjoint_shards_and_rebalance_on_join(db):
+    async def scenario():
+        first, second = make_leases(db, "worker-a"), make_leases(db, "worker-b")
+        await first.setup()
+        assert await first.rebalance() == set(range(SHARDS))
+
+        # Новый воркер сначала ничего не получает: все шарды заняты живой арендой
+        await second.setup()
+        assert await second.rebalance() == set()
+        # Первый воркер видит второго и отдает лишнее, второй забирает освободившееся
+        assert len(await first.rebalance()) == SHARDS // 2
+        assert len(await second.rebalance()) == SHARDS // 2
+        assert first.owned.isdisjoint(second.owned)
+        assert first.owned | second.owned == set(range(SHARDS))
+
+        # Третий воркер: ceil(4 / 3) = 2 шарда на воркер, никто не владеет одним шардом вдвоем
+        third = make_leases(db, "worker-c")
+        await third.setup()
+        for _ in range(2):
+            for leases in (first, second, third):
+                await leases.rebalance()
+        owned = [first.owned, second.owned, third.owned]
+        assert sum(len(o) for o in owned) == SHARDS
+        assert set().union(*owned) == set(range(SHARDS))
+        assert all(len(o) <= 2 for o in owned)
+
+    run(scenario)
+
+
+def test_takeover_after_lease_expires(db):
+    async def scenario():
+        first, second = make_leases(db, "worker-a"), make_leases(db, "worker-b")
+        await first.setup()
+        await first.rebalance()
+        await second.rebalance()
+        await first.rebalance()
+        await second.rebalance()
+        assert len(second.owned) == SHARDS // 2
+        # Шарды, отданные при перераспределении, не считаются перехваченными
+        assert second.takeovers == 0
+
+        # Первый воркер упал: ни heartbeat, ни продления аренды больше нет
+        past = shards._utcnow() - timedelta(seconds=first.ttl + 1)
+        async with db.engine.begin() as conn:
+            await conn.execute(update(database.tracker_leases).where(
+                database.tracker_leases.c.owner == "worker-a").values(expires_at=past))
+            await conn.execute(update(database.tracker_workers).where(
+                database.tracker_workers.c.owner == "worker-a").values(heartbeat_at=past))
+
+        assert await second.rebalance() == set(range(SHARDS))
+        assert second.takeovers == SHARDS // 2
+
+    run(scenario)
+
+
+def test_stop_releases_shards_immediately(db):
+    async def scenario():
+        first, second = make_leases(db, "worker-a"), make_leases(db, "worker-b")
+        await first.setup()
+        await first.rebalance()
+        await first.stop()
+        assert await second.rebalance() == set(range(SHARDS))
+        assert second.takeovers == 0
+
+    run(scenario)
+
+
+def test_run_cycle_processes_only_owned_symbols(db):
+    async def scenario():
+        first, second = make_leases(db, "worker-a"), make_leases(db, "worker-b")
+        await first.setup()
+        for leases in (first, second, first, second):
+            await leases.rebalance()
+
+        exchanges = {"worker-a": FakeExchange(99.0), "worker-b": FakeExchange(99.0)}
+        for leases in (first, second):
+            assert await tracker.run_cycle(exchanges[leases.owner], leases=leases) == 0
+        requested_a, requested_b = set(exchanges["worker-a"].requested), set(exchanges["worker-b"].requested)
+        assert requested_a.isdisjoint(requested_b)
+        assert requested_a | requested_b == set(SYMBOLS)
+        assert all(first.owns(s) for s in requested_a) and all(second.owns(s) for s in requested_b)
+        assert set((await statuses(db)).values()) == {"activated"}
+
+    run(scenario)
+
+
+def test_same_transition_applied_twice_changes_one_row(db):
+    async def scenario():
+        async with db.engine.connect() as conn:
+            signal_id = (await conn.execute(select(database.analyses.c.id).where(
+                database.analyses.c.symbol == "BTC/USDT"))).scalar_one()
+        transition = {signal_id: {"status": "activated", "entry_timestamp": database.utcnow()}}
+        expected = {signal_id: "active"}
+
+        # Два воркера прочитали сигнал в статусе active и оба вычислили активацию
+        async with db.engine.begin() as conn:
+            assert await tracker.apply_transitions(conn, transition, expected) == (1, 1)
+        async with db.engine.begin() as conn:
+            assert await tracker.apply_transitions(conn, transition, expected) == (1, 0)
+        assert (await statuses(db))["BTC/USDT"] == "activated"
+
+    run(scenario)
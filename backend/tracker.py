@@ -1,88 +1,329 @@
 # backend/tracker.py
+import os
 import asyncio
-import time
 from datetime import datetime, timedelta, timezone
+import numpy as np
 import ccxt.async_support as ccxt
-from sqlalchemy import create_engine, select, update
-from sqlalchemy.orm import sessionmaker
-from database import analyses
+from sqlalchemy import select, update, bindparam
+from database import analyses, async_engine
+from shards import start_leases
 
-# --- ИЗМЕНЕНИЕ: Забираем DATABASE_URL из database.py ---
-from database import DATABASE_URL
+# Пауза между проверками и максимум сигналов, обрабатываемых за один цикл
+TRACKER_INTERVAL = int(os.getenv("TRACKER_INTERVAL", "300"))
+TRACKER_BATCH_SIZE = int(os.getenv("TRACKER_BATCH_SIZE", "5000"))
+TRACKED_STATUSES = ('active', 'activated')
+# ticker - сравнение с последней ценой; candles - разбор минутных свечей с момента прошлой проверки;
+# stream - WebSocket-поток сделок (см. price_stream.py)
+TRACKER_MODE = os.getenv("TRACKER_MODE", "ticker")
+CANDLE_TIMEFRAME_MS = 60_000
+CANDLE_PAGE_LIMIT = 1000
+# Глубина догрузки свечей за один цикл (страниц по CANDLE_PAGE_LIMIT минут)
+TRACKER_MAX_CANDLE_PAGES = int(os.getenv("TRACKER_MAX_CANDLE_PAGES", "10"))
 
-# Используем СИНХРОННЫЙ движок, так как скрипт простой и линейный
-# Заменяем "+asyncpg" на "" для синхронного драйвера psycopg2
-sync_db_url = DATABASE_URL.replace("+asyncpg", "")
-engine = create_engine(sync_db_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Время (мс) последней проверенной свечи для каждого сигнала в режиме candles
+last_checked = {}
 
-async def run_tracker():
-    print("🚀 Трекер сигналов запущен. Проверка каждые 5 минут.")
-    
-    while True:
-        # Помещаем создание биржи внутрь цикла для переподключения в случае ошибок
-        exchange = ccxt.binance()
-        db_session = SessionLocal()
-        try:
-            query = select(analyses).where(analyses.c.status.in_(['active', 'activated']))
-            signals_to_track = db_session.execute(query).fetchall()
-
-            if not signals_to_track:
-                print("Активных сигналов для отслеживания нет. Следующая проверка через 5 минут.")
+
+def evaluate_signal(signal, current_price: float, now: datetime) -> dict:
+    """
+    Вычисляет переход состояния сигнала по текущей цене.
+    Возвращает новые значения полей ({'status': ..., ...}) или None, если ничего не изменилось.
+    """
+    # Колонки DateTime в БД без часового пояса - пишем наивное UTC-время
+    now_db = now.replace(tzinfo=None)
+    changes = {}
+
+    if signal.status == 'active':
+        # Проверяем, что это не рыночный ордер, перед сравнением цен
+        if signal.entry_price != 'Market':
+            is_long_activation = signal.direction == 'Long' and current_price <= float(signal.entry_price)
+            is_short_activation = signal.direction == 'Short' and current_price >= float(signal.entry_price)
+
+            if is_long_activation or is_short_activation:
+                print(f"✅ Сигнал #{signal.id} ({signal.symbol}) АКТИВИРОВАН по цене {current_price}")
+                changes.update(status='activated', entry_timestamp=now_db)
+
+        # Проверка на "протухание" (продолжает работать для всех типов)
+        if now > signal.timestamp.replace(tzinfo=timezone.utc) + timedelta(hours=signal.invalidation_hours):
+            print(f"⌛ Сигнал #{signal.id} ({signal.symbol}) ИСТЕК по времени")
+            changes.update(status='expired', closed_timestamp=now_db)
+
+    elif signal.status == 'activated':
+        is_tp_hit = (signal.direction == 'Long' and current_price >= signal.take_profit) or \
+                    (signal.direction == 'Short' and current_price <= signal.take_profit)
+        is_sl_hit = (signal.direction == 'Long' and current_price <= signal.stop_loss) or \
+                    (signal.direction == 'Short' and current_price >= signal.stop_loss)
+
+        if is_tp_hit:
+            print(f"🎯 ТЕЙК-ПРОФИТ для сигнала #{signal.id} ({signal.symbol}) по цене {current_price}")
+            changes.update(status='take_profit_hit', closed_timestamp=now_db)
+        elif is_sl_hit:
+            print(f"🛡️ СТОП-ЛОСС для сигнала #{signal.id} ({signal.symbol}) по цене {current_price}")
+            changes.update(status='stop_loss_hit', closed_timestamp=now_db)
+
+    return changes or None
+
+
+def _to_ms(value: datetime) -> int:
+    return int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _from_ms(value: int) -> datetime:
+    # Наивное UTC-время, как и остальные колонки DateTime
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+
+def signal_check_start(signal) -> int:
+    """С какого момента (мс) разбирать свечи для сигнала."""
+    if signal.id in last_checked:
+        return last_checked[signal.id]
+    if signal.status == 'activated' and signal.entry_timestamp is not None:
+        return _to_ms(signal.entry_timestamp)
+    return _to_ms(signal.timestamp)
+
+
+def _first_hit(mask: np.ndarray) -> np.ndarray:
+    """Индекс первой свечи с True по каждой строке; len(row), если совпадений нет."""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), mask.shape[1])
+
+
+def resolve_with_candles(signals: list, candles: list, now: datetime) -> dict:
+    """
+    Определяет активацию, TP, SL и истечение сигналов одного символа по минутным
+    свечам (high/low) векторно для всех сигналов сразу. Возвращает переходы
+    {signal_id: {поле: значение}} с точным временем свечи срабатывания.
+
+    Порядок внутри одной свечи неизвестен, поэтому используется консервативное
+    правило: стоп-лосс учитывается уже в свече активации, тейк-профит - со следующей,
+    а при одновременном касании TP и SL в одной свече считается, что первым был SL.
+    Свеча, в которой сигнал создан, открылась раньше него: ее high/low могли дать сделки
+    до сигнала, поэтому для активации она не используется.
+    """
+    if not signals or not candles:
+        return {}
+    data = np.asarray(candles, dtype=np.float64)
+    ts, high, low = data[:, 0].astype(np.int64), data[:, 2], data[:, 3]
+    n_candles = len(ts)
+    now_ms = _to_ms(now)
+
+    is_long = np.array([s.direction == 'Long' for s in signals])[:, None]
+    is_active = np.array([s.status == 'active' for s in signals])
+    start = np.array([signal_check_start(s) for s in signals], dtype=np.int64)
+    created = np.array([_to_ms(s.timestamp) for s in signals], dtype=np.int64)
+    # Начало позиции для уже активированных: раньше него TP и SL не могли сработать
+    entered = np.array([_to_ms(s.entry_timestamp) if s.status == 'activated' and s.entry_timestamp is not None
+                        else _to_ms(s.timestamp) for s in signals], dtype=np.int64)
+    expiry = np.array([_to_ms(s.timestamp) + s.invalidation_hours * 3_600_000 for s in signals], dtype=np.int64)
+    entry = np.array([float(s.entry_price) if s.status == 'active' and s.entry_price != 'Market' else np.nan
+                      for s in signals])[:, None]
+    stop_loss = np.array([s.stop_loss for s in signals], dtype=np.float64)[:, None]
+    take_profit = np.array([s.take_profit for s in signals], dtype=np.float64)[:, None]
+
+    # Свечи, которые еще не закрылись к моменту прошлой проверки
+    fresh = (ts[None, :] + CANDLE_TIMEFRAME_MS) > start[:, None]
+    columns = np.arange(n_candles)[None, :]
+
+    with np.errstate(invalid='ignore'):
+        touched_entry = np.where(is_long, low[None, :] <= entry, high[None, :] >= entry)
+    opened_after_signal = ts[None, :] >= created[:, None]
+    activation_mask = (fresh & opened_after_signal & is_active[:, None]
+                       & (ts[None, :] < expiry[:, None]) & touched_entry)
+    activation = _first_hit(activation_mask)
+    activated_now = is_active & (activation < n_candles)
+
+    # Для уже активированных сигналов SL ищем с первой непроверенной свечи, а TP - со свечи,
+    # открывшейся после входа (свеча входа для TP не считается, как и при активации в этом цикле)
+    sl_from = np.where(activated_now, activation, _first_hit(fresh))
+    tp_from = np.where(activated_now, activation + 1, _first_hit(fresh & (ts[None, :] > entered[:, None])))
+    entered = np.where(activated_now, ts[np.minimum(activation, n_candles - 1)], entered)
+    in_position = ~is_active | activated_now
+    sl_mask = (columns >= sl_from[:, None]) & np.where(is_long, low[None, :] <= stop_loss, high[None, :] >= stop_loss)
+    tp_mask = (columns >= tp_from[:, None]) & np.where(is_long, high[None, :] >= take_profit, low[None, :] <= take_profit)
+    sl_hit, tp_hit = _first_hit(sl_mask), _first_hit(tp_mask)
+
+    transitions = {}
+    for i, signal in enumerate(signals):
+        changes = {}
+        if activated_now[i]:
+            changes.update(status='activated', entry_timestamp=_from_ms(ts[activation[i]]))
+            print(f"✅ Сигнал #{signal.id} ({signal.symbol}) АКТИВИРОВАН в {changes['entry_timestamp']}")
+        elif is_active[i] and now_ms >= expiry[i]:
+            print(f"⌛ Сигнал #{signal.id} ({signal.symbol}) ИСТЕК по времени")
+            changes.update(status='expired', closed_timestamp=_from_ms(expiry[i]))
+
+        if in_position[i] and min(sl_hit[i], tp_hit[i]) < n_candles:
+            if sl_hit[i] <= tp_hit[i]:
+                print(f"🛡️ СТОП-ЛОСС для сигнала #{signal.id} ({signal.symbol})")
+                changes.update(status='stop_loss_hit', closed_timestamp=_from_ms(max(ts[sl_hit[i]], entered[i])))
             else:
-                symbols = list(set([s.symbol for s in signals_to_track]))
-                print(f"Отслеживается {len(signals_to_track)} сигналов для символов: {symbols}")
-                
-                tickers = await exchange.fetch_tickers(symbols)
-                
-                for signal in signals_to_track:
-                    current_price = tickers[signal.symbol]['last']
-                    now = datetime.now(timezone.utc)
-
-                    if signal.status == 'active':
-                        # --- КЛЮЧЕВОЕ ИСПРАВЛЕНИЕ ЗДЕСЬ ---
-                        # Проверяем, что это не рыночный ордер, перед сравнением цен
-                        if signal.entry_price != 'Market':
-                            is_long_activation = signal.direction == 'Long' and current_price <= float(signal.entry_price)
-                            is_short_activation = signal.direction == 'Short' and current_price >= float(signal.entry_price)
-
-                            if is_long_activation or is_short_activation:
-                                print(f"✅ Сигнал #{signal.id} ({signal.symbol}) АКТИВИРОВАН по цене {current_price}")
-                                update_query = update(analyses).where(analyses.c.id == signal.id).values(status='activated', entry_timestamp=now)
-                                db_session.execute(update_query)
-                        
-                        # Проверка на "протухание" (продолжает работать для всех типов)
-                        if now > signal.timestamp.replace(tzinfo=timezone.utc) + timedelta(hours=signal.invalidation_hours):
-                            print(f"⌛ Сигнал #{signal.id} ({signal.symbol}) ИСТЕК по времени")
-                            update_query = update(analyses).where(analyses.c.id == signal.id).values(status='expired', closed_timestamp=now)
-                            db_session.execute(update_query)
-
-                    elif signal.status == 'activated':
-                        is_tp_hit = (signal.direction == 'Long' and current_price >= signal.take_profit) or \
-                                    (signal.direction == 'Short' and current_price <= signal.take_profit)
-                        is_sl_hit = (signal.direction == 'Long' and current_price <= signal.stop_loss) or \
-                                    (signal.direction == 'Short' and current_price >= signal.stop_loss)
-
-                        if is_tp_hit:
-                            print(f"🎯 ТЕЙК-ПРОФИТ для сигнала #{signal.id} ({signal.symbol}) по цене {current_price}")
-                            update_query = update(analyses).where(analyses.c.id == signal.id).values(status='take_profit_hit', closed_timestamp=now)
-                            db_session.execute(update_query)
-                        elif is_sl_hit:
-                            print(f"🛡️ СТОП-ЛОСС для сигнала #{signal.id} ({signal.symbol}) по цене {current_price}")
-                            update_query = update(analyses).where(analyses.c.id == signal.id).values(status='stop_loss_hit', closed_timestamp=now)
-                            db_session.execute(update_query)
-                
-                db_session.commit()
-
-        except Exception as e:
-            print(f"Произошла ошибка в цикле трекера: {e}")
-            db_session.rollback()
-        finally:
-            db_session.close()
-            await exchange.close()
-
-        # Пауза 5 минут
-        await asyncio.sleep(300)
+                print(f"🎯 ТЕЙК-ПРОФИТ для сигнала #{signal.id} ({signal.symbol})")
+                changes.update(status='take_profit_hit', closed_timestamp=_from_ms(max(ts[tp_hit[i]], entered[i])))
+
+        if changes:
+            transitions[signal.id] = changes
+            last_checked.pop(signal.id, None)
+        else:
+            # Последняя свеча еще формируется - в следующий раз проверим ее снова
+            last_checked[signal.id] = int(ts[-1])
+    return transitions
+
+
+async def fetch_recent_candles(exchange, symbol: str, since: int, now_ms: int) -> list:
+    """Минутные свечи symbol с момента since (постранично, не глубже TRACKER_MAX_CANDLE_PAGES)."""
+    since = max(since, now_ms - TRACKER_MAX_CANDLE_PAGES * CANDLE_PAGE_LIMIT * CANDLE_TIMEFRAME_MS)
+    since -= since % CANDLE_TIMEFRAME_MS
+    candles = []
+    for _ in range(TRACKER_MAX_CANDLE_PAGES):
+        page = await exchange.fetch_ohlcv(symbol, timeframe='1m', since=since, limit=CANDLE_PAGE_LIMIT)
+        if not page:
+            break
+        candles.extend(page)
+        since = page[-1][0] + CANDLE_TIMEFRAME_MS
+        if len(page) < CANDLE_PAGE_LIMIT or since > now_ms:
+            break
+    return candles
+
+
+async def evaluate_with_candles(exchange, signals: list, now: datetime) -> dict:
+    """Одним пакетом загружает свечи всех символов и разбирает сигналы каждого символа."""
+    by_symbol = {}
+    for signal in signals:
+        by_symbol.setdefault(signal.symbol, []).append(signal)
+    now_ms = _to_ms(now)
+
+    symbols = list(by_symbol)
+    results = await asyncio.gather(
+        *[fetch_recent_candles(exchange, sym, min(signal_check_start(s) for s in by_symbol[sym]), now_ms) for sym in symbols],
+        return_exceptions=True,
+    )
+    transitions = {}
+    for symbol, candles in zip(symbols, results):
+        if isinstance(candles, Exception):
+            print(f"Не удалось загрузить свечи {symbol}: {candles}")
+            continue
+        transitions.update(resolve_with_candles(by_symbol[symbol], candles, now))
+    return transitions
+
+
+async def apply_transitions(conn, transitions: dict, expected: dict) -> tuple:
+    """
+    Применяет переходы {signal_id: {поле: значение}} пакетно: по одному executemany
+    на каждую пару (ожидаемый статус, новый статус) и набор изменяемых полей.
+    expected - {signal_id: статус, из которого выполняется переход}. Строка
+    обновляется только если ее статус не изменился (WHERE status = ожидаемый),
+    поэтому параллельные воркеры не применят один переход дважды.
+    Возвращает (число выражений, число реально обновленных строк). Для executemany
+    число строк сообщают не все драйверы (asyncpg - нет); тогда вместо него None.
+    """
+    groups = {}
+    for signal_id, changes in transitions.items():
+        fields = tuple(sorted(k for k in changes if k != 'status'))
+        params = {'b_id': signal_id, **{f'b_{k}': changes[k] for k in fields}}
+        groups.setdefault((expected[signal_id], changes['status'], fields), []).append(params)
+
+    updated = 0
+    for (old_status, new_status, fields), params in groups.items():
+        query = update(analyses).where(
+            analyses.c.id == bindparam('b_id'), analyses.c.status == old_status
+        ).values(status=new_status, **{k: bindparam(f'b_{k}') for k in fields})
+        result = await conn.execute(query, params)
+        updated += max(result.rowcount, 0)
+    if not conn.dialect.supports_sane_multi_rowcount:
+        updated = None
+    return len(groups), updated
+
+
+async def run_cycle(exchange, after_id: int = 0, leases=None) -> int:
+    """
+    Один проход трекера по пачке из TRACKER_BATCH_SIZE сигналов с id > after_id.
+    С leases обрабатываются только символы из шардов, арендованных этим воркером.
+    Возвращает id, с которого продолжить в следующем цикле (0 - начать сначала).
+    Соединение с БД не удерживается, пока идут запросы к бирже: сигналы читаются
+    коротким соединением, а переходы пишутся отдельной короткой транзакцией.
+    Между ними сигнал может изменить другой воркер - это отсекает WHERE status
+    в apply_transitions.
+    """
+    async with async_engine.connect() as conn:
+        query = select(analyses).where(
+            analyses.c.status.in_(TRACKED_STATUSES), analyses.c.id > after_id
+        ).order_by(analyses.c.id).limit(TRACKER_BATCH_SIZE)
+        if leases is not None:
+            tracked_symbols = (await conn.execute(
+                select(analyses.c.symbol).where(analyses.c.status.in_(TRACKED_STATUSES)).distinct()
+            )).scalars()
+            owned_symbols = [s for s in tracked_symbols if leases.owns(s)]
+            if not owned_symbols:
+                print(f"Воркер {leases.owner}: в его шардах нет активных сигналов.")
+                return 0
+            query = query.where(analyses.c.symbol.in_(owned_symbols))
+        signals_to_track = (await conn.execute(query)).fetchall()
+
+    if not signals_to_track:
+        if after_id:
+            return 0
+        print(f"Активных сигналов для отслеживания нет. Следующая проверка через {TRACKER_INTERVAL} сек.")
+        return 0
+
+    symbols = list(set([s.symbol for s in signals_to_track]))
+    print(f"Отслеживается {len(signals_to_track)} сигналов для символов: {symbols}")
+
+    now = datetime.now(timezone.utc)
+
+    # Сначала считаем все переходы в памяти, затем пишем их пакетно
+    if TRACKER_MODE == 'candles':
+        transitions = await evaluate_with_candles(exchange, signals_to_track, now)
+    else:
+        tickers = await exchange.fetch_tickers(symbols)
+        transitions = {}
+        for signal in signals_to_track:
+            ticker = tickers.get(signal.symbol)
+            if not ticker or ticker.get('last') is None:
+                continue
+            changes = evaluate_signal(signal, ticker['last'], now)
+            if changes:
+                transitions[signal.id] = changes
+
+    if transitions:
+        expected = {s.id: s.status for s in signals_to_track}
+        async with async_engine.begin() as conn:
+            statements, updated = await apply_transitions(conn, transitions, expected)
+        if updated is None:
+            print(f"Применено {len(transitions)} переходов за {statements} пакетных запросов "
+                  f"(число измененных строк драйвер не сообщает).")
+        else:
+            print(f"Обновлено {updated} из {len(transitions)} сигналов за {statements} пакетных запросов.")
+
+    # Неполная пачка - значит дошли до конца таблицы и начнем заново
+    return signals_to_track[-1].id if len(signals_to_track) == TRACKER_BATCH_SIZE else 0
+
+
+async def run_tracker():
+    if TRACKER_MODE == 'stream':
+        # Потоковый режим живет в отдельном модуле, чтобы режимы опроса не зависели от websockets
+        from price_stream import run_stream_tracker
+        await run_stream_tracker()
+        return
+
+    print(f"🚀 Трекер сигналов запущен (режим {TRACKER_MODE}). Проверка каждые {TRACKER_INTERVAL} сек., "
+          f"до {TRACKER_BATCH_SIZE} сигналов за цикл.")
+    after_id = 0
+    leases = await start_leases()
+
+    try:
+        while True:
+            # Помещаем создание биржи внутрь цикла для переподключения в случае ошибок
+            exchange = ccxt.binance()
+            try:
+                after_id = await run_cycle(exchange, after_id, leases)
+            except Exception as e:
+                print(f"Произошла ошибка в цикле трекера: {e}")
+            finally:
+                await exchange.close()
+
+            await asyncio.sleep(TRACKER_INTERVAL)
+    finally:
+        if leases is not None:
+            await leases.stop()
 
 if __name__ == "__main__":
     asyncio.run(run_tracker())
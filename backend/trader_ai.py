@@ -19,6 +19,9 @@ from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
 
+import indicators
+from market_data import fetch_ohlcv_cached
+
 # --- НАСТРОЙКА ---
 load_dotenv()
 try:
@@ -29,44 +32,6 @@ except Exception as e:
     print(f"❌ Ошибка конфигурации API: {e}")
     exit()
 
-# <--- БЛОК ВСПОМОГАТЕЛЬНЫХ ФУНКЦИЙ --->
-def calculate_rsi(series: pd.Series, length: int = 14) -> pd.Series:
-    delta = series.diff()
-    gain = delta.where(delta > 0, 0)
-    loss = -delta.where(delta < 0, 0)
-    avg_gain = gain.ewm(com=length - 1, min_periods=length).mean()
-    avg_loss = loss.ewm(com=length - 1, min_periods=length).mean()
-    rs = avg_gain / avg_loss
-    return 100 - (100 / (1 + rs))
-
-def calculate_bbands(series: pd.Series, length: int = 20, std: int = 2):
-    middle_band = series.rolling(window=length).mean()
-    std_dev = series.rolling(window=length).std()
-    upper_band = middle_band + (std_dev * std)
-    lower_band = middle_band - (std_dev * std)
-    return upper_band, lower_band
-
-def calculate_atr(df, length=14):
-    high_low = df['high'] - df['low']
-    high_close = (df['high'] - df['close'].shift()).abs()
-    low_close = (df['low'] - df['close'].shift()).abs()
-    tr = high_low.combine(high_close, max).combine(low_close, max)
-    atr = tr.ewm(alpha=1/length, adjust=False).mean()
-    return atr
-
-def calculate_adx(df, length=14):
-    df['ATR'] = calculate_atr(df, length)
-    plus_dm = df['high'].diff()
-    minus_dm = df['low'].diff()
-    plus_dm[plus_dm < 0] = 0
-    minus_dm[minus_dm > 0] = 0
-    plus_di = 100 * (plus_dm.ewm(alpha=1/length, adjust=False).mean() / df['ATR'])
-    minus_di = 100 * (abs(minus_dm.ewm(alpha=1/length, adjust=False).mean()) / df['ATR'])
-    dx = 100 * (abs(plus_di - minus_di) / (abs(plus_di + minus_di) + 1e-6))
-    adx = dx.ewm(alpha=1/length, adjust=False).mean()
-    df[f'ADX_{length}'] = adx
-    return df
-
 # --- ФУНКЦИЯ ВЫБОРА СТРАТЕГИИ ---
 def select_strategy(config: dict) -> dict:
     console.print(Panel("[bold]Выберите торговую стратегию[/bold]", expand=False))
@@ -91,19 +56,20 @@ def select_strategy(config: dict) -> dict:
 # --- ОСНОВНЫЕ ФУНКЦИИ ---
 def fetch_and_plot(symbol: str, timeframe: str, run_id: int) -> str:
     try:
-        ohlcv = exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=200)
+        ohlcv = fetch_ohlcv_cached(exchange, symbol, timeframe, limit=200)
         if len(ohlcv) < 50:
             console.print(f"⚠️  Недостаточно данных для {timeframe}, пропускаем график.")
             return None
         df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
         df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
         df.set_index('timestamp', inplace=True)
-        df = calculate_adx(df, length=14)
-        latest_adx = df.iloc[-1]['ADX_14'] if not df.empty and 'ADX_14' in df.columns else 20
+        adx = indicators.adx(df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy(), length=14)
+        latest_adx = adx[-1] if len(adx) else 20
         params = {"rsi_length": 21, "bb_length": 25, "bb_std": 2.5} if latest_adx > 25 else {"rsi_length": 14, "bb_length": 20, "bb_std": 2.0}
         params["mode"] = "Trend" if latest_adx > 25 else "Flat/Range"
-        df['RSI'] = calculate_rsi(df['close'], length=params["rsi_length"])
-        df['BBU'], df['BBL'] = calculate_bbands(df['close'], length=params["bb_length"], std=params["bb_std"])
+        close = df['close'].to_numpy()
+        df['RSI'] = indicators.rsi(close, length=params["rsi_length"])
+        df['BBU'], df['BBL'] = indicators.bbands(close, length=params["bb_length"], std=params["bb_std"])
         filepath = f"chart_{symbol.replace('/', '')}_{timeframe}_{run_id}.png"
         rsi_title = f"RSI ({params['rsi_length']}) - {params['mode']} Mode"
         all_plots = [mpf.make_addplot(df['BBU'], color='cyan', width=0.7), mpf.make_addplot(df['BBL'], color='cyan', width=0.7), mpf.make_addplot(df['RSI'], panel=1, color='purple', title=rsi_title, ylim=(0, 100))]
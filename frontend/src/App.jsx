@@ -36,7 +36,8 @@ function App() {
   const [result, setResult] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
-  const [queueSize, setQueueSize] = useState(0);
+  // Последний снимок задачи анализа: статус, место в очереди и оценка сервера (eta_seconds)
+  const [jobState, setJobState] = useState(null);
 
   useEffect(() => {
     // Эта функция теперь просто синхронизирует состояние с localStorage
@@ -71,15 +72,29 @@ function App() {
     setStage('loading');
 
     try {
-      const queueResponse = await axios.get('/analyses/active');
-      setQueueSize(queueResponse.data.active_count);
-      
-      const response = await axios.post('/analyze/', {
+      // Ставим анализ в очередь и опрашиваем задачу, пока она не завершится
+      const submitResponse = await axios.post('/analyze/', {
         pair: coin,
         strategy_key: selectedStrategy,
       });
+      let job = submitResponse.data;
+      setJobState(job);
 
-      setResult(response.data);
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, 3000));
+        const jobResponse = await axios.get(`/analyze/${job.job_id}`);
+        job = jobResponse.data;
+        // Позиция и оценка времени меняются по мере продвижения очереди
+        setJobState(job);
+      }
+
+      if (job.status === 'failed') {
+        setError(`Ошибка от сервера: ${job.error}`);
+        setStage('error');
+        return;
+      }
+
+      setResult(job.result);
       setStage('result');
     } catch (err) {
       if (err.response) {
@@ -122,7 +137,7 @@ function App() {
           {stage === 'strategySelection' && (
             <StrategySelection key="strategySelection" onStrategySelect={handleStrategySelect} coin={coin} />
           )}
-          {stage === 'loading' && <LoadingState key="loading" queueSize={queueSize} />}
+          {stage === 'loading' && <LoadingState key="loading" job={jobState} />}
           {stage === 'result' && (
             <motion.div
               key="result"
@@ -10,23 +10,34 @@ const History = () => {
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState('');
     const [selectedSignal, setSelectedSignal] = useState(null);
+    // Курсор следующей страницы из заголовка X-Next-Cursor (null - страниц больше нет)
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
 
-    useEffect(() => {
-        const fetchHistory = async () => {
-            try {
-                // Используем axios напрямую. Перехватчик добавит токен.
-                const response = await axios.get('/history');
-                setHistory(response.data);
-            } catch (err) {
-                setError('Не удалось загрузить историю.');
-            } finally {
-                setLoading(false);
-            }
-        };
+    const fetchHistory = async (cursor = null) => {
+        // Используем axios напрямую. Перехватчик добавит токен.
+        const response = await axios.get('/history', { params: cursor ? { cursor } : {} });
+        setHistory(prev => cursor ? [...prev, ...response.data] : response.data);
+        setNextCursor(response.headers['x-next-cursor'] || null);
+    };
 
-        fetchHistory();
+    useEffect(() => {
+        fetchHistory()
+            .catch(() => setError('Не удалось загрузить историю.'))
+            .finally(() => setLoading(false));
     }, []); // Пустой массив зависимостей здесь теперь безопасен
 
+    const loadMore = async () => {
+        setLoadingMore(true);
+        try {
+            await fetchHistory(nextCursor);
+        } catch (err) {
+            setError('Не удалось загрузить историю.');
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     if (loading) return <div style={{textAlign: 'center', marginTop: '2rem', color: '#a0a0a0'}}>Загрузка истории...</div>;
     if (error) return <div className="error">{error}</div>;
 
@@ -37,9 +48,14 @@ const History = () => {
                 <p style={{ textAlign: 'center', color: '#a0a0a0' }}>Ваша история пока пуста.</p>
             ) : (
                 <div style={{ display: 'flex', flexDirection: 'column', gap: '1rem' }}>
-                    {history.map((signal, index) => (
-                        <HistoryCard key={index} signal={signal} onCardClick={setSelectedSignal} />
+                    {history.map((signal) => (
+                        <HistoryCard key={signal.id} signal={signal} onCardClick={setSelectedSignal} />
                     ))}
+                    {nextCursor && (
+                        <button onClick={loadMore} disabled={loadingMore} style={{ alignSelf: 'center' }}>
+                            {loadingMore ? 'Загрузка...' : 'Показать еще'}
+                        </button>
+                    )}
                 </div>
             )}
             
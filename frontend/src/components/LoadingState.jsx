@@ -2,13 +2,19 @@
 import { useState, useEffect } from 'react';
 import { motion } from 'framer-motion';
 
-const LoadingState = ({ queueSize }) => {
-  // Рассчитываем время ожидания по формуле (n+1) * 120
-  // Если перед нами 0 человек (n=0), время будет 120с.
-  // Если перед нами 1 человек (n=1), время будет 240с.
-  const estimatedWaitTime = (queueSize + 1) * 180;
-  
-  const [countdown, setCountdown] = useState(estimatedWaitTime);
+const LoadingState = ({ job }) => {
+  const status = job?.status ?? 'queued';
+  const position = job?.position ?? 0;
+  // Оценку времени считает сервер (eta_seconds) по средней длительности анализа
+  // и очереди; она приходит с каждым опросом задачи
+  const etaSeconds = Math.round(job?.eta_seconds ?? 0);
+
+  const [countdown, setCountdown] = useState(etaSeconds);
+
+  // Новая оценка от сервера перезапускает обратный отсчет
+  useEffect(() => {
+    setCountdown(etaSeconds);
+  }, [etaSeconds]);
 
   useEffect(() => {
     if (countdown > 0) {
@@ -28,14 +34,21 @@ const LoadingState = ({ queueSize }) => {
       transition={{ duration: 0.3 }}
       style={{ display: 'flex', flexDirection: 'column', alignItems: 'center' }}
     >
-      <div style={{ fontSize: '1.5rem', marginBottom: '1rem' }}>Анализ запущен...</div>
-      
-      {/* Новые информационные строки */}
-      <div style={{ fontSize: '1.1rem', color: '#a0a0a0', marginBottom: '0.5rem' }}>
-        Ваше место в очереди: <span style={{color: '#64ffda', fontWeight: 'bold'}}>{queueSize + 1}</span>
+      <div style={{ fontSize: '1.5rem', marginBottom: '1rem' }}>
+        {status === 'running' ? 'Анализ выполняется...' : 'Анализ запущен...'}
       </div>
+      
+      {status === 'queued' && position > 0 && (
+        <div style={{ fontSize: '1.1rem', color: '#a0a0a0', marginBottom: '0.5rem' }}>
+          Ваше место в очереди: <span style={{color: '#64ffda', fontWeight: 'bold'}}>{position}</span>
+        </div>
+      )}
       <div style={{ fontSize: '1.1rem', color: '#a0a0a0' }}>
-        Примерное время ожидания: <span style={{color: '#64ffda', fontWeight: 'bold'}}>{countdown}</span> секунд
+        {countdown > 0 ? (
+          <>Примерное время ожидания: <span style={{color: '#64ffda', fontWeight: 'bold'}}>{countdown}</span> секунд</>
+        ) : (
+          'Результат вот-вот будет готов...'
+        )}
       </div>
 
       <motion.div